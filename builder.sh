@@ -1,6 +1,7 @@
 #!/bin/bash
 
-pyinstaller setup.py -n morla --onefile --windowed --clean --icon=data/logo.ico
+# importing morla doesn't start the GUI; morla/__main__.py does (python3 -m morla)
+pyinstaller morla/__main__.py --paths . -n morla --onefile --windowed --clean --icon=data/logo.ico
 mv dist/morla ./morla-bin
 rm -R build/ dist/
 rm morla.spec
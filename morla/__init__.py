@@ -16,9 +16,6 @@
 # from contextlib import redirect_stdout
 # from typing import Any
 
-from morla.morlaframe import gui_loop
-
-
 # metadata
 SELETOR_NAME = "Morla"
 SELETOR_VERSION = (0, 1)
@@ -27,10 +24,6 @@ SELETOR_EMAIL = "diniz.cpm<at>gmail.com"
 SELETOR_LICENSE = "GNU Affero General Public License v3 or later (AGPLv3+)"
 
 
-# main loop
-gui_loop()
-
-
 if __name__ == "__main__":
     print("This module should not be run alone.")
     from tkinter import sys
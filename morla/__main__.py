@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from morla.morlaframe import gui_loop
+
+
+# main loop
+gui_loop()
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""Counts over the metadata of a bank (sources, years, types, tags and the Uso:
+histories), computed with NumPy instead of dict loops: each field is encoded once as
+an array of integer codes, and every report is a bincount over those arrays:
+    python3 -m morla.analytics bank.tex --json report.json --csv reports
+The input may also be a QuestionStore (a .db file). Only the metadata is read, so a
+bank is scanned lazily, without its bodies.
+"""
+
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+import argparse
+import csv
+import io
+import json
+import os
+
+from tkinter import sys
+
+import numpy as np
+
+from morla.utils import *
+from morla.bulk import Question
+from morla.fileio import write_atomically
+from morla.lazy import LazySource
+from morla.store import QuestionStore
+
+
+SCALARS = ("source", "year", "type")
+LISTS = ("tags", "histories")
+FIELDS = SCALARS + LISTS
+QUESTIONS = "questions"
+# a source is over-represented if it has more than this many times the mean count
+OVERREPRESENTED = 2.0
+
+
+class Field(NamedTuple):
+    """A field of the questions, encoded: the distinct labels, the code of each item
+    (one per question for SCALARS, any number per question for LISTS) and the number
+    of the question the item belongs to, in ascending order.
+    """
+
+    labels: List[str]
+    codes: np.ndarray
+    owners: np.ndarray
+
+
+class Table(NamedTuple):
+    name: str
+    rows: List[str]
+    columns: List[str]
+    # len(rows) x len(columns)
+    counts: np.ndarray
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "columns": self.columns,
+            "counts": self.counts.tolist(),
+        }
+
+    def to_csv(self) -> str:
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator=EOL)
+        writer.writerow([self.name] + self.columns)
+        for row, counts in zip(self.rows, self.counts.tolist()):
+            writer.writerow([row] + counts)
+        return output.getvalue()
+
+
+def encode(values: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """The distinct values, in the order they first show up, and the code of each
+    value (its index among them).
+    """
+    labels = list(dict.fromkeys(values))
+    index = {label: code for code, label in enumerate(labels)}
+    codes = np.fromiter(map(index.__getitem__, values), np.intp, len(values))
+    return labels, codes
+
+
+def ordered(labels: List[str]) -> np.ndarray:
+    """The codes of labels in alphabetical order of the labels.
+    """
+    return np.array(sorted(range(len(labels)), key=labels.__getitem__), dtype=np.intp)
+
+
+class BankAnalytics:
+    """The encoded metadata of some questions (which may be a lazy stream, like
+    LazySource or QuestionStore.query), read once; the reports are then computed from
+    the arrays alone.
+    """
+
+    def __init__(self, questions: Iterable[Question]) -> None:
+        sources, years, types = [], [], []
+        tags, tag_lengths = [], []
+        histories, history_lengths = [], []
+        # the loop only gathers; everything else is done by NumPy
+        for q in questions:
+            sources.append(q.source)
+            years.append(q.year)
+            types.append(q.question_type)
+            tags.extend(q.tags)
+            tag_lengths.append(len(q.tags))
+            histories.extend(q.histories)
+            history_lengths.append(len(q.histories))
+        self.size = len(sources)
+        numbers = np.arange(self.size, dtype=np.intp)
+        self.fields = {
+            "source": Field(*encode(sources), numbers),
+            "year": Field(*encode(years), numbers),
+            "type": Field(*encode(types), numbers),
+            "tags": self.list_field(tags, tag_lengths),
+            "histories": self.list_field(histories, history_lengths),
+        }
+
+    def list_field(self, values: List[str], lengths: List[int]) -> Field:
+        """Encodes a field of LISTS, keeping each label once per question, and dropping
+        the empty ones (left by a "Tags:" with nothing after it).
+        """
+        labels, codes = encode(values)
+        owners = np.repeat(
+            np.arange(self.size, dtype=np.intp), np.array(lengths, dtype=np.intp)
+        )
+        width = max(1, len(labels))
+        # sorted by question, and then by code, with no repetitions
+        keys = np.sort(owners.astype(np.int64) * width + codes)
+        first = np.ones(keys.size, dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        keys = keys[first]
+        owners, codes = np.divmod(keys, width)
+        if "" in labels:
+            empty = labels.index("")
+            kept = codes != empty
+            owners, codes = owners[kept], codes[kept]
+            codes -= codes > empty
+            labels.pop(empty)
+        return Field(labels, codes.astype(np.intp), owners.astype(np.intp))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def field(self, name: str) -> Field:
+        try:
+            return self.fields[name]
+        except KeyError:
+            fields = COMMA.join(FIELDS)
+            raise ValueError(f"{repr(name)} isn't one of {fields}!") from None
+
+    def join(self, rows: Field, columns: Field) -> Tuple[np.ndarray, np.ndarray]:
+        """The codes of every (row item, column item) pair of the same question. The
+        items of a question are contiguous, so the column items paired with a row item
+        are a slice of columns.codes; the slices are laid out with repeat and arange,
+        in time proportional to the number of pairs.
+        """
+        lengths = np.bincount(columns.owners, minlength=self.size)
+        starts = np.cumsum(lengths) - lengths
+        repeats = lengths[rows.owners]
+        left = np.repeat(rows.codes, repeats)
+        offsets = np.cumsum(repeats) - repeats
+        within = np.arange(left.size, dtype=np.intp) - np.repeat(offsets, repeats)
+        positions = np.repeat(starts[rows.owners], repeats) + within
+        return left, columns.codes[positions]
+
+    def counts(self, name: str) -> Table:
+        """How many questions have each label of the field name.
+        """
+        field = self.field(name)
+        counts = np.bincount(field.codes, minlength=len(field.labels))
+        order = ordered(field.labels)
+        return Table(
+            name,
+            [field.labels[i] for i in order],
+            [QUESTIONS],
+            counts[order].reshape(-1, 1),
+        )
+
+    def crosstab(self, rows: str, columns: str) -> Table:
+        """How many questions have each pair of labels of the fields rows and columns;
+        crosstab("tags", "tags") is the co-occurrence matrix of the tags, with the
+        number of questions with each tag on the diagonal.
+        """
+        row_field = self.field(rows)
+        column_field = self.field(columns)
+        left, right = self.join(row_field, column_field)
+        width = len(column_field.labels)
+        counts = np.bincount(
+            left * width + right, minlength=len(row_field.labels) * width
+        ).reshape(len(row_field.labels), width)
+        row_order = ordered(row_field.labels)
+        column_order = ordered(column_field.labels)
+        return Table(
+            f"{rows} x {columns}",
+            [row_field.labels[i] for i in row_order],
+            [column_field.labels[i] for i in column_order],
+            counts[np.ix_(row_order, column_order)],
+        )
+
+    def overrepresented(
+        self, name: str = "source", factor: float = OVERREPRESENTED
+    ) -> Table:
+        """The labels of the field name with more than factor times the mean number of
+        questions per label, the most frequent first.
+        """
+        table = self.counts(name)
+        counts = table.counts[:, 0]
+        if not counts.size:
+            return table._replace(name=f"overrepresented {name}")
+        (chosen,) = np.nonzero(counts > factor * counts.mean())
+        chosen = chosen[np.argsort(-counts[chosen], kind="stable")]
+        return Table(
+            f"overrepresented {name}",
+            [table.rows[i] for i in chosen],
+            table.columns,
+            table.counts[chosen],
+        )
+
+    def unused(self, name: str = "tags", by: str = "histories") -> Table:
+        """The labels of the field name whose questions have no by at all (by default,
+        the tags never used in any history), with how many questions have each.
+        """
+        field = self.field(name)
+        has_by = np.bincount(self.field(by).owners, minlength=self.size) > 0
+        used = np.bincount(
+            field.codes, weights=has_by[field.owners], minlength=len(field.labels)
+        )
+        counts = np.bincount(field.codes, minlength=len(field.labels))
+        order = ordered(field.labels)
+        chosen = order[used[order] == 0]
+        return Table(
+            f"{name} without {by}",
+            [field.labels[i] for i in chosen],
+            [QUESTIONS],
+            counts[chosen].reshape(-1, 1),
+        )
+
+    def report(self) -> List[Table]:
+        tables = [self.counts(name) for name in FIELDS]
+        tables.append(self.crosstab("tags", "year"))
+        tables.append(self.crosstab("source", "year"))
+        tables.append(self.overrepresented("source"))
+        tables.append(self.unused("tags", "histories"))
+        tables.append(self.crosstab("tags", "tags"))
+        return tables
+
+
+def report_tables(questions: Iterable[Question]) -> Iterator[Table]:
+    """The tables of BankAnalytics.report, as a generator, for BackgroundTask.
+    """
+    yield from BankAnalytics(questions).report()
+
+
+def to_json(tables: Iterable[Table]) -> str:
+    report = {table.name: table.to_dict() for table in tables}
+    return json.dumps(report, ensure_ascii=False)
+
+
+def csv_name(table: Table) -> str:
+    return "_".join(table.name.split()) + ".csv"
+
+
+def write_csv(tables: Iterable[Table], directory: str) -> Iterator[str]:
+    """Writes each table to its own CSV file in directory, yielding their names.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for table in tables:
+        filename = os.path.join(directory, csv_name(table))
+        for _ in write_atomically(filename, table.to_csv()):
+            pass
+        yield filename
+
+
+def read_questions(filenames: Iterable[str]) -> Iterator[Question]:
+    """The questions of banks and of QuestionStores (.db files), by their metadata.
+    """
+    for filename in filenames:
+        if filename.endswith(".db"):
+            with QuestionStore(filename) as store:
+                yield from store.query()
+        else:
+            with LazySource(filename, cache_size=0) as source:
+                yield from source
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.analytics", description="Counts the metadata of banks."
+    )
+    arg_parser.add_argument("filenames", nargs="+", help="banks or .db stores")
+    arg_parser.add_argument("--json", help="write every table to this file")
+    arg_parser.add_argument("--csv", help="write each table to a file in this folder")
+    args = arg_parser.parse_args(argv)
+    analytics = BankAnalytics(read_questions(args.filenames))
+    tables = analytics.report()
+    print(f"> {len(analytics)} question(s)")
+    for table in tables:
+        print(f">   {table.name}: {len(table.rows)} x {len(table.columns)}")
+    if args.json:
+        for _ in write_atomically(args.json, to_json(tables)):
+            pass
+        print(f"> Wrote {args.json}.")
+    if args.csv:
+        for filename in write_csv(tables, args.csv):
+            print(f"> Wrote {filename}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
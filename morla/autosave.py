@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+from typing import List, Optional, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+import json
+import logging
+import os
+import threading
+
+# https://github.com/python/cpython/blob/3.6/Lib/idlelib/redirector.py
+from idlelib.redirector import WidgetRedirector
+from tkinter import sys
+import tkinter as tk
+
+from morla.utils import *
+from morla.fileio import write_atomically
+
+
+logger = logging.getLogger(__name__)
+
+
+class Autosave:
+    """Journals the edits made to a tk.Text, so that they survive a crash.
+    Every insert and delete is intercepted (with idlelib's WidgetRedirector) and kept
+    as a small operation; when the widget reports <<Modified>>, the operations are
+    appended to a journal a few seconds later, so each autosave costs I/O in proportion
+    to the edits, not to the document.
+    Once a journal grows past compact_bytes, the document is written to a snapshot in a
+    background thread and a new journal, one generation later, is started. A snapshot
+    of generation g holds every edit made before journal g, so any combination of
+    snapshot and journals left behind by a crash can be replayed consistently.
+    """
+
+    SNAPSHOT = "autosave.snapshot"
+    JOURNAL = "autosave.journal"
+    INSERT = "i"
+    DELETE = "d"
+
+    def __init__(
+        self, directory: str, interval: int = 3000, compact_bytes: int = 1 << 20
+    ) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.interval = interval
+        self.compact_bytes = compact_bytes
+        self.generation = 0
+        # operations not yet written to the journal
+        self.pending = []
+        self.journal = None
+        self.journal_size = 0
+        self.enabled = True
+        self.text = None
+        self.redirector = None
+        self.scheduled = None
+        self.compaction = None
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, self.SNAPSHOT)
+
+    def journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"{self.JOURNAL}.{generation}")
+
+    def journals(self) -> List[Tuple[int, str]]:
+        """Returns the (generation, path) of every journal on disk, oldest first.
+        """
+        found = []
+        prefix = self.JOURNAL + "."
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name[len(prefix) :].isdigit():
+                generation = int(name[len(prefix) :])
+                found.append((generation, os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def attach(self, text: tk.Text) -> None:
+        self.text = text
+        self.redirector = WidgetRedirector(text)
+        self.insert = self.redirector.register("insert", self.on_insert)
+        self.delete = self.redirector.register("delete", self.on_delete)
+        text.bind("<<Modified>>", self.on_modified, add="+")
+
+    def on_insert(self, index, chars, *args) -> None:
+        at = self.text.index(index)
+        self.insert(index, chars, *args)
+        if self.enabled:
+            # args alternate tags and more chars: insert(index, chars, tags, chars...)
+            chars = chars + "".join(args[1::2])
+            self.pending.append((self.INSERT, at, chars))
+
+    def on_delete(self, index1, index2=None) -> None:
+        start = self.text.index(index1)
+        if index2 is None:
+            stop = self.text.index(f"{start}+1c")
+        else:
+            stop = self.text.index(index2)
+        self.delete(index1, index2)
+        if self.enabled:
+            self.pending.append((self.DELETE, start, stop))
+
+    def on_modified(self, event=None) -> None:
+        # resetting the flag fires <<Modified>> again
+        if not self.text.edit_modified():
+            return
+        self.text.edit_modified(False)
+        if self.scheduled is None:
+            self.scheduled = self.text.after(self.interval, self.flush)
+
+    def flush(self) -> None:
+        """Appends the pending operations to the current journal.
+        """
+        self.scheduled = None
+        if not self.pending:
+            return
+        if self.journal is None:
+            self.journal = open(
+                self.journal_path(self.generation), "a", encoding=UTF8
+            )
+        lines = "".join([json.dumps(op) + "\n" for op in self.pending])
+        self.pending.clear()
+        self.journal.write(lines)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_size += len(lines)
+        if self.journal_size > self.compact_bytes:
+            self.compact()
+
+    def close_journal(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.journal_size = 0
+
+    def compact(self, force: bool = False) -> None:
+        """Starts a new journal generation and writes the whole document to a snapshot
+        of that generation in a background thread. If a compaction is still running,
+        this one is skipped, unless force: then the running one is waited for, since
+        the current journal must not outlive a document it doesn't apply to.
+        """
+        if self.compaction is not None and self.compaction.is_alive():
+            if not force:
+                # try again after the next flush
+                return
+            self.compaction.join()
+        self.flush()
+        self.close_journal()
+        self.generation += 1
+        content = self.text.get("1.0", "end-1c")
+        self.compaction = threading.Thread(
+            target=self.write_snapshot, args=(self.generation, content), daemon=True
+        )
+        self.compaction.start()
+
+    def write_snapshot(self, generation: int, content: str) -> None:
+        header = json.dumps({"generation": generation})
+        try:
+            for _ in write_atomically(self.snapshot_path, header + "\n" + content):
+                pass
+        except OSError as e:
+            logger.error(f"couldn't write the autosave snapshot: {e}")
+            return
+        # the snapshot holds every edit of the older journals
+        for older, path in self.journals():
+            if older < generation:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        logger.debug(f"autosave snapshot {generation} written")
+
+    def pause(self) -> None:
+        """Stops journaling, e.g. while a whole file is being loaded.
+        """
+        self.enabled = False
+
+    def resume(self) -> None:
+        """Starts journaling again from a fresh snapshot of the document.
+        """
+        self.enabled = True
+        self.pending.clear()
+        self.compact(force=True)
+
+    def recoverable(self) -> bool:
+        return os.path.exists(self.snapshot_path) or bool(self.journals())
+
+    def read_snapshot(self) -> Tuple[int, str]:
+        try:
+            with open(self.snapshot_path, "r", encoding=UTF8) as snapshot:
+                header = json.loads(snapshot.readline())
+                return header["generation"], snapshot.read()
+        except FileNotFoundError:
+            return 0, ""
+
+    def replay(self) -> None:
+        """Rebuilds the document in the attached tk.Text from the snapshot and the
+        journals left on disk, then compacts them.
+        """
+        generation, content = self.read_snapshot()
+        self.enabled = False
+        self.text.delete("1.0", tk.END)
+        self.text.insert("1.0", content)
+        for journal_generation, path in self.journals():
+            if journal_generation < generation:
+                continue
+            with open(path, "r", encoding=UTF8) as journal:
+                for line in journal:
+                    try:
+                        op, first, second = json.loads(line)
+                    except ValueError:
+                        # a half-written line: the crash happened here
+                        logger.warning(f"{path} is truncated")
+                        break
+                    if op == self.INSERT:
+                        self.text.insert(first, second)
+                    else:
+                        self.text.delete(first, second)
+            generation = journal_generation
+        self.generation = generation
+        self.text.edit_modified(False)
+        self.resume()
+
+    def discard(self) -> None:
+        """Erases the snapshot and the journals, e.g. when quitting normally.
+        """
+        if self.scheduled is not None:
+            self.text.after_cancel(self.scheduled)
+            self.scheduled = None
+        self.pending.clear()
+        self.close_journal()
+        if self.compaction is not None:
+            self.compaction.join()
+        paths = [path for _, path in self.journals()]
+        paths.append(self.snapshot_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.generation = 0
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""End-to-end benchmarks for morla, run on synthetic question banks.
+    python3 -m morla.benchmark --sizes 1000 10000 --output bench.json
+    python3 -m morla.benchmark --baseline bench.json
+The second command fails (exit status 1) if any benchmark got slower or hungrier than
+the stored baseline by more than --tolerance.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.configuration import Configuration
+from morla.bulk import Parser, Question
+from morla.formatter import ParallelFormatter
+
+
+SOURCES = (
+    "UFU-MG",
+    "UFA-AM",
+    "UFRJ-RJ",
+    "UFPR-PR",
+    "USP-SP",
+    "UNICAMP-SP",
+    "UFMG-MG",
+    "UNB-DF",
+)
+TAGS = (
+    "aritmética",
+    "geometria",
+    "funções da linguagem",
+    "figuras de linguagem",
+    "sintaxe",
+    "morfologia",
+    "interpretação",
+    "probabilidade",
+)
+WORDS = (
+    "assinale",
+    "calcule",
+    "o",
+    "a",
+    "item",
+    "que",
+    "identifica",
+    "função",
+    "linguagem",
+    "predominante",
+    "texto",
+    "lâmpada",
+    "tungstênio",
+    "vidro",
+    "filamento",
+    "eletricidade",
+    "valor",
+    "de",
+    "$x^2 + 1$",
+    "número",
+)
+
+DEFAULT_SIZES = (1_000, 10_000)
+
+
+# corpus generation --------------------------------------------------------------------
+def generate_bank(
+    n: int,
+    seed: int = 0,
+    choices_ratio: float = 0.7,
+    text_lines: Tuple[int, int] = (1, 4),
+    words_per_line: Tuple[int, int] = (5, 15),
+    tags_per_question: Tuple[int, int] = (0, 3),
+    n_choices: int = 5,
+    configs: Optional[Configuration] = None,
+) -> List[str]:
+    """Returns the lines of a bank of n questions shaped like data/seletor_teste.tex.
+    The same arguments (seed included) always generate the same bank.
+    :param float choices_ratio: the fraction of choices questions; the rest is written
+    :param tuple text_lines: min and max number of lines of each question's text
+    :param tuple words_per_line: min and max number of words of each line
+    :param tuple tags_per_question: min and max number of tags of each question
+    """
+    configs = Configuration(configs)
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        words = rng.choices(WORDS, k=rng.randint(*words_per_line))
+        return capitalize_first(SPACE.join(words)) + "."
+
+    lines = []
+    for i in range(n):
+        source = rng.choice(SOURCES)
+        year = str(rng.randint(1990, 2023)) if rng.random() < 0.8 else configs.BAD_YEAR
+        label = source.split("-")[0].lower()
+        lines.append(f"{PERCENT} {source} {year}")
+        history = f"lista{i % 20:02} {rng.randint(2010, 2023)}"
+        lines.append(f"{PERCENT} {configs.USO} {history}")
+        tags = rng.sample(TAGS, rng.randint(*tags_per_question))
+        if tags:
+            lines.append(f"{PERCENT} {configs.TAGS} {COMMA.join(tags)}")
+        lines.append(
+            f"{configs.BEGIN_QUESTION}[{configs.LABEL}=q:{label},"
+            f"{configs.ORIGIN}={{{source}}}]"
+        )
+        lines.extend(sentence() for _ in range(rng.randint(*text_lines)))
+        if rng.random() < choices_ratio:
+            lines.append(configs.BEGIN_CHOICES)
+            correct = rng.randrange(n_choices)
+            for c in range(n_choices):
+                label = configs.CORRECT if c == correct else configs.CHOICE
+                lines.append(f"{label} {c}{rng.randint(0, 999)}.")
+            lines.append(configs.END_CHOICES)
+        lines.append(configs.END_QUESTION)
+        lines.append(configs.BEGIN_ANSWER)
+        lines.append(sentence())
+        lines.append(configs.END_ANSWER)
+        lines.append("")
+    return lines
+
+
+# measuring ----------------------------------------------------------------------------
+def measure(f: Callable, items: int, memory: bool = True) -> Dict[str, Any]:
+    """Runs f (twice, if memory is True: once timed and once under tracemalloc, which
+    slows it down) and returns its wall time, its throughput in items per second and
+    its peak of allocated memory.
+    """
+    # the parser and the formatter are chatty; their prints aren't being measured
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        f()
+        seconds = time.perf_counter() - start
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                f()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return {
+        "items": items,
+        "seconds": seconds,
+        "throughput": items / seconds if seconds else float("inf"),
+        "peak_bytes": peak,
+    }
+
+
+def bench_bank(n: int, seed: int, memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Benchmarks parsing and formatting a bank of n questions.
+    """
+    configs = Configuration()
+    lines = generate_bank(n, seed=seed)
+    results = {}
+
+    def parse() -> None:
+        Parser().read(lines, configs)
+
+    results["parser.read"] = measure(parse, len(lines), memory)
+    text = "\n".join(lines)
+
+    def parse_buffer() -> None:
+        for _ in Parser().parse_buffer(text, configs):
+            pass
+
+    results["parser.parse_buffer"] = measure(parse_buffer, len(lines), memory)
+    parser = Parser()
+    with redirect_stdout(io.StringIO()):
+        parser.read(lines, configs)
+    questions = parser.questions
+
+    def stringify() -> None:
+        for q in questions:
+            str(q)
+
+    results["question.__str__"] = measure(stringify, len(questions), memory)
+    results["parser.pretty_print"] = measure(
+        parser.pretty_print, len(questions), memory
+    )
+
+    def format_in_parallel() -> None:
+        for _ in ParallelFormatter().format(questions):
+            pass
+
+    results["formatter.parallel"] = measure(format_in_parallel, len(questions), memory)
+    return results
+
+
+def bench_helpers(reps: int, memory: bool = True) -> Dict[str, Dict[str, Any]]:
+    """Benchmarks Configuration access and the utils helpers, reps calls each.
+    """
+    configs = Configuration()
+    long_str = "very long string " * 80
+    languages = {str(i): dict.fromkeys(Configuration.default, "") for i in range(10)}
+    cases = {
+        "configuration.attribute": lambda: configs.BEGIN_QUESTION,
+        "configuration.item": lambda: configs["BEGIN_QUESTION"],
+        "configuration.copy": lambda: Configuration(configs),
+        "utils.truncate": lambda: truncate(long_str),
+        "utils.truncate2": lambda: truncate2(long_str),
+        "utils.var_zfill": lambda: list(var_zfill(*range(1, 100))),
+        "utils.dict_diff": lambda: dict_diff(Configuration.default, configs.dict),
+        "utils.are_subdicts_invalid": lambda: are_subdicts_invalid(languages),
+    }
+    results = {}
+    for name, case in cases.items():
+
+        def run(case: Callable = case) -> None:
+            for _ in range(reps):
+                case()
+
+        results[name] = measure(run, reps, memory)
+    return results
+
+
+def run(
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    seed: int = 0,
+    reps: int = 10_000,
+    memory: bool = True,
+) -> Dict[str, Any]:
+    """Runs every benchmark; the bank ones once per size, so that their scaling can be
+    plotted.
+    """
+    benchmarks = {}
+    for n in sizes:
+        print(f"> benchmarking a bank of {n} questions...")
+        for name, result in bench_bank(n, seed, memory).items():
+            benchmarks.setdefault(name, []).append(dict(size=n, **result))
+    print(f"> benchmarking the helpers ({reps} calls each)...")
+    for name, result in bench_helpers(reps, memory).items():
+        benchmarks[name] = [dict(size=reps, **result)]
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25
+) -> List[str]:
+    """Returns a description of every benchmark whose throughput fell, or whose memory
+    peak rose, by more than tolerance relative to the baseline, at the same size.
+    """
+    regressions = []
+    for name, runs in results["benchmarks"].items():
+        old_runs = {r["size"]: r for r in baseline["benchmarks"].get(name, [])}
+        for new in runs:
+            old = old_runs.get(new["size"])
+            if old is None:
+                continue
+            where = f"{name} (size {new['size']})"
+            if new["throughput"] < old["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"{where}: {old['throughput']:.0f} {ARROW} "
+                    f"{new['throughput']:.0f} items/s"
+                )
+            if old["peak_bytes"] and new["peak_bytes"]:
+                if new["peak_bytes"] > old["peak_bytes"] * (1 + tolerance):
+                    regressions.append(
+                        f"{where}: {old['peak_bytes']} {ARROW} "
+                        f"{new['peak_bytes']} peak bytes"
+                    )
+    return regressions
+
+
+def report(results: Dict[str, Any]) -> None:
+    names = sorted(results["benchmarks"])
+    width = max([len(name) for name in names])
+    print_sep()
+    for name in names:
+        for r in results["benchmarks"][name]:
+            peak = r["peak_bytes"]
+            peak = f"{peak / 2 ** 20:8.2f} MiB" if peak is not None else ""
+            print(
+                f"{name:<{width}} {r['size']:>9} {r['seconds']:9.4f} s "
+                f"{r['throughput']:14.0f}/s {peak}"
+            )
+    print_sep()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.benchmark", description="Benchmarks morla on synthetic banks."
+    )
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--reps", type=int, default=10_000)
+    arg_parser.add_argument(
+        "--no-memory", action="store_true", help="don't measure memory peaks"
+    )
+    arg_parser.add_argument("--output", help="save the results to this JSON file")
+    arg_parser.add_argument("--baseline", help="compare the results to this JSON file")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25)
+    arg_parser.add_argument(
+        "--corpus", help="just write a bank of --sizes[0] questions to this file"
+    )
+    args = arg_parser.parse_args(argv)
+    if args.corpus:
+        with open(args.corpus, "w", encoding=UTF8) as corpus:
+            corpus.write("\n".join(generate_bank(args.sizes[0], seed=args.seed)))
+        return 0
+    results = run(args.sizes, args.seed, args.reps, not args.no_memory)
+    report(results)
+    if args.output:
+        with open(args.output, "w", encoding=UTF8) as output:
+            json.dump(results, output, indent=4)
+        print(f"> Wrote {args.output}.")
+    if args.baseline:
+        with open(args.baseline, "r", encoding=UTF8) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"> regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""A browser over the parsed questions: a list with their source, year, type and tags,
+filtered as the user types, a pane with the selected question, and deletion of the
+selected ones. The list is virtualized, so it opens and scrolls just as fast with
+hundreds of thousands of questions.
+"""
+
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from bisect import bisect_left, bisect_right
+import itertools
+import threading
+
+from tkinter import sys
+from tkinter import ttk
+import tkinter as tk
+
+from morla.utils import *
+from morla.bulk import Question
+from morla.gui import *
+
+
+COLUMNS = ("number", "source", "year", "type", "tags")
+# the last character, to find every word with a given prefix
+LAST = "\U0010ffff"
+# event.state bits
+SHIFT = 0x1
+CONTROL = 0x4
+
+
+class QuestionIndex:
+    """The lowercase words of the source, year, type and tags of each question, sorted
+    along with the position of the question, so that the questions with words starting
+    with a prefix are found with two bisections.
+    """
+
+    def __init__(self, questions: Sequence[Question]) -> None:
+        self.questions = questions
+        self.words = []
+        self.positions = []
+        self.ready = threading.Event()
+
+    def build(self) -> None:
+        pairs = []
+        for i, q in enumerate(self.questions):
+            words = set(q.source.lower().split())
+            words.add(q.year.lower())
+            words.add(q.question_type.split()[0])
+            words.update(tag.lower() for tag in q.tags if tag)
+            pairs.extend((word, i) for word in words)
+        pairs.sort()
+        self.words = [word for word, _ in pairs]
+        self.positions = [i for _, i in pairs]
+        self.ready.set()
+
+    def lookup(self, prefix: str) -> Set[int]:
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + LAST, lo)
+        return set(self.positions[lo:hi])
+
+    def search(self, query: str) -> Optional[List[int]]:
+        """The positions of the questions with a word starting with each word of query,
+        in order; None if query is blank, which means every question.
+        """
+        found = None
+        for prefix in query.lower().split():
+            matches = self.lookup(prefix)
+            found = matches if found is None else found & matches
+            if not found:
+                break
+        return None if found is None else sorted(found)
+
+
+class Selection:
+    """A set of positions kept as sorted, disjoint [start, stop) ranges, so that
+    selecting everything or a shift-clicked span costs the same as selecting one.
+    """
+
+    def __init__(self) -> None:
+        self.ranges = []
+
+    def __len__(self) -> int:
+        return sum(stop - start for start, stop in self.ranges)
+
+    def __contains__(self, position: int) -> bool:
+        i = bisect_right(self.ranges, (position, float("inf"))) - 1
+        return i >= 0 and self.ranges[i][1] > position
+
+    def clear(self) -> None:
+        self.ranges.clear()
+
+    def add(self, start: int, stop: int) -> None:
+        if start >= stop:
+            return
+        kept = []
+        for a, b in self.ranges:
+            # ranges that touch the new one are merged with it
+            if b < start or a > stop:
+                kept.append((a, b))
+            else:
+                start, stop = min(a, start), max(b, stop)
+        kept.append((start, stop))
+        self.ranges = sorted(kept)
+
+    def remove(self, start: int, stop: int) -> None:
+        kept = []
+        for a, b in self.ranges:
+            if b <= start or a >= stop:
+                kept.append((a, b))
+                continue
+            if a < start:
+                kept.append((a, start))
+            if b > stop:
+                kept.append((stop, b))
+        self.ranges = kept
+
+    def toggle(self, position: int) -> None:
+        if position in self:
+            self.remove(position, position + 1)
+        else:
+            self.add(position, position + 1)
+
+
+def without(
+    questions: Iterable[Question], ranges: Sequence[Tuple[int, int]]
+) -> Iterator[Question]:
+    """The questions whose indexes are in none of ranges (sorted and disjoint), in a
+    single pass, whatever the shape of the selection.
+    """
+    questions = iter(questions)
+    previous = 0
+    for start, stop in ranges:
+        yield from itertools.islice(questions, start - previous)
+        # skip the questions in the range
+        next(itertools.islice(questions, stop - start, stop - start), None)
+        previous = stop
+    yield from questions
+
+
+class QuestionBrowser(tk.Frame):
+    """Lists questions (a list, which is edited in place when questions are deleted)
+    in a ttk.Treeview that holds only the rows on screen; scrolling just changes their
+    values. The rows shown are a view: every position of questions (a range) or the
+    ones that passed the filter.
+    Click selects, shift-click selects a span, control-click toggles; control-a selects
+    everything, and Delete deletes the selection.
+    """
+
+    def __init__(
+        self,
+        master,
+        questions: List[Question],
+        get_string: Callable[[str], str],
+        on_delete: Optional[Callable[[int], None]] = None,
+        rows: int = 20,
+    ) -> None:
+        super(QuestionBrowser, self).__init__(master)
+        self.questions = questions
+        self.get_string = get_string
+        self.on_delete = on_delete
+        self.rows = rows
+        self.view = range(len(questions))
+        self.selection = Selection()
+        # first position on screen, the focused one and where shift-clicks start from
+        self.top = 0
+        self.focus = None
+        self.anchor = 0
+        self.filtering = None
+        self.index = None
+        self.build_index()
+        # filter bar
+        # grid(0, 0-1)
+        bar = tk.Frame(self)
+        bar.grid(row=0, column=0, columnspan=2, sticky=(E, W))
+        bar.grid_columnconfigure(1, weight=1)
+        tk.Label(bar, text=get_string("filter")).grid(row=0, column=0)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", self.on_filter)
+        self.filter_entry = tk.Entry(bar, textvariable=self.filter_var)
+        self.filter_entry.grid(row=0, column=1, sticky=(E, W), padx=BORDER)
+        self.count_label = tk.Label(bar)
+        self.count_label.grid(row=0, column=2, padx=BORDER)
+        delete_word = get_string("delete_selected")
+        CustomButton(bar, text=delete_word, command=self.delete_selected).grid(
+            row=0, column=3
+        )
+        # the list
+        # grid(1, 0-1)
+        self.tree = ttk.Treeview(
+            self, columns=COLUMNS, show="headings", height=rows, selectmode="none"
+        )
+        widths = {"number": 70, "source": 220, "year": 60, "type": 80, "tags": 220}
+        for column in COLUMNS:
+            heading = "#" if column == "number" else get_string(column)
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=widths[column], stretch=column == "tags")
+        self.tree.tag_configure("selected", background="#c6dcf5")
+        self.tree.tag_configure("focus", foreground="#1f5fbf")
+        for i in range(rows):
+            self.tree.insert("", tk.END, iid=f"row{i}")
+        self.tree.grid(row=1, column=0, sticky=(N, S, E, W))
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=1, sticky=(N, S))
+        # the question with the focus
+        # grid(2, 0-1)
+        self.detail = ScrolledText(self, height=12, wrap=tk.WORD)
+        self.detail.config(state=DISABLED)
+        self.detail.grid(row=2, column=0, columnspan=2, sticky=(N, S, E, W))
+        self.grid_rowconfigure(1, weight=1)
+        self.grid_rowconfigure(2, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        # bindings
+        self.tree.bind("<Button-1>", self.on_click)
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.tree.bind("<Up>", lambda event: self.move_focus(-1))
+        self.tree.bind("<Down>", lambda event: self.move_focus(1))
+        self.tree.bind("<Prior>", lambda event: self.move_focus(-self.rows))
+        self.tree.bind("<Next>", lambda event: self.move_focus(self.rows))
+        self.tree.bind("<Control-a>", self.select_all)
+        self.tree.bind("<Delete>", lambda event: self.delete_selected())
+        self.render(0)
+
+    def build_index(self) -> None:
+        """Indexes the questions in a background thread; the list works without the
+        index, so the window shows up at once.
+        """
+        self.index = QuestionIndex(self.questions)
+        threading.Thread(target=self.index.build, daemon=True).start()
+
+    def reload(self, questions: List[Question]) -> None:
+        """Shows questions from scratch, for when the list was replaced, cleared or
+        extended behind the browser's back; positions into the old one would be stale.
+        """
+        self.questions = questions
+        self.build_index()
+        self.set_view(range(len(questions)))
+        if self.filter_var.get():
+            self.on_filter()
+
+    # the view ---------------------------------------------------------------------------
+    def render(self, top: int) -> None:
+        total = len(self.view)
+        self.top = max(0, min(top, total - self.rows))
+        for i in range(self.rows):
+            position = self.top + i
+            if position < total:
+                q = self.questions[self.view[position]]
+                values = (
+                    position + 1,
+                    q.source,
+                    q.year,
+                    q.question_type.split()[0],
+                    COMMA.join(q.tags),
+                )
+                tags = []
+                if position in self.selection:
+                    tags.append("selected")
+                if position == self.focus:
+                    tags.append("focus")
+            else:
+                values, tags = ("",) * len(COLUMNS), []
+            self.tree.item(f"row{i}", values=values, tags=tags)
+        if total:
+            lo = self.top / total
+            self.scrollbar.set(lo, min(1.0, (self.top + self.rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        selected = self.get_string("selected", capitalize=False)
+        self.count_label.config(
+            text=f"{total} / {len(self.questions)}, {len(self.selection)} {selected}"
+        )
+
+    def yview(self, *args) -> None:
+        """The scrollbar's command.
+        """
+        total = len(self.view)
+        if not args or not total:
+            return
+        if args[0] == tk.MOVETO:
+            self.render(int(float(args[1]) * total))
+        elif args[0] == tk.SCROLL:
+            step = self.rows if args[2] == tk.PAGES else 1
+            self.scroll_by(int(args[1]) * step)
+
+    def scroll_by(self, rows: int) -> None:
+        self.render(self.top + rows)
+
+    def on_wheel(self, event) -> None:
+        self.scroll_by(-3 if event.delta > 0 else 3)
+
+    def set_view(self, view: Sequence[int]) -> None:
+        self.view = view
+        self.selection.clear()
+        self.focus = None
+        self.anchor = 0
+        self.show_detail()
+        self.render(0)
+
+    def on_filter(self, *args) -> None:
+        # debounced, so that typing a word searches once
+        if self.filtering is not None:
+            self.after_cancel(self.filtering)
+        self.filtering = self.after(150, self.apply_filter)
+
+    def apply_filter(self) -> None:
+        self.filtering = None
+        if not self.index.ready.is_set():
+            self.filtering = self.after(100, self.apply_filter)
+            return
+        found = self.index.search(self.filter_var.get())
+        self.set_view(range(len(self.questions)) if found is None else found)
+
+    # selection --------------------------------------------------------------------------
+    def position_at(self, y: int) -> Optional[int]:
+        row = self.tree.identify_row(y)
+        if not row:
+            return None
+        position = self.top + int(row[len("row") :])
+        return position if position < len(self.view) else None
+
+    def on_click(self, event) -> str:
+        self.tree.focus_set()
+        position = self.position_at(event.y)
+        if position is None:
+            return "break"
+        if event.state & SHIFT:
+            start, stop = sorted((self.anchor, position))
+            self.selection.add(start, stop + 1)
+        elif event.state & CONTROL:
+            self.selection.toggle(position)
+            self.anchor = position
+        else:
+            self.selection.clear()
+            self.selection.add(position, position + 1)
+            self.anchor = position
+        self.focus = position
+        self.show_detail()
+        self.render(self.top)
+        # Treeview's own selection is not used
+        return "break"
+
+    def move_focus(self, delta: int) -> str:
+        total = len(self.view)
+        if not total:
+            return "break"
+        position = 0 if self.focus is None else self.focus + delta
+        position = max(0, min(position, total - 1))
+        self.focus = self.anchor = position
+        self.selection.clear()
+        self.selection.add(position, position + 1)
+        self.show_detail()
+        if position < self.top:
+            self.render(position)
+        elif position >= self.top + self.rows:
+            self.render(position - self.rows + 1)
+        else:
+            self.render(self.top)
+        return "break"
+
+    def select_all(self, event=None) -> str:
+        self.selection.clear()
+        self.selection.add(0, len(self.view))
+        self.render(self.top)
+        return "break"
+
+    def show_detail(self) -> None:
+        self.detail.config(state=NORMAL)
+        self.detail.delete("1.0", tk.END)
+        if self.focus is not None:
+            self.detail.insert(tk.END, self.questions[self.view[self.focus]].render())
+        self.detail.config(state=DISABLED)
+
+    def selected_indexes(self) -> List[Tuple[int, int]]:
+        """The selection as ranges of indexes of questions.
+        """
+        if isinstance(self.view, range):
+            return list(self.selection.ranges)
+        indexes = []
+        for start, stop in self.selection.ranges:
+            indexes.extend((i, i + 1) for i in self.view[start:stop])
+        return indexes
+
+    def delete_selected(self) -> None:
+        ranges = self.selected_indexes()
+        if not ranges:
+            return
+        before = len(self.questions)
+        # streamed, so that a QuestionSpool is rebuilt without loading it
+        self.questions[:] = without(self.questions, ranges)
+        deleted = before - len(self.questions)
+        self.build_index()
+        self.filter_var.set("")
+        self.set_view(range(len(self.questions)))
+        if self.on_delete is not None:
+            self.on_delete(deleted)
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Builds PDFs out of banks: each bank (and each of its shuffled variants) is wrapped in
+a preamble and compiled, many at a time, by a pool of pdflatex/latexmk jobs:
+    python3 -m morla.build lista01.tex lista02.tex --variants 4 --output pdfs/
+Compiled PDFs are cached by the hash of their LaTeX, so an exam that didn't change is
+never compiled again; --stub swaps the compiler for a fake one.
+"""
+
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
+import logging
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Parser, Question
+from morla.configuration import Configuration
+from morla.fileio import read_lines
+from morla import metrics
+
+
+logger = logging.getLogger(__name__)
+
+PREAMBLE = r"""\documentclass[a4paper,12pt]{article}
+\usepackage[utf8]{inputenc}
+\usepackage[T1]{fontenc}
+\usepackage[brazil]{babel}
+\usepackage{amsmath,amssymb}
+\usepackage{exercise}
+\usepackage{tasks}
+\NewTasksEnvironment[label=(\alph*),label-width=2em]{choices}[\choice]
+\newcommand{\CorrectChoice}{\choice}
+"""
+
+
+class BuildError(Exception):
+    pass
+
+
+def digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode(UTF8))
+        # keeps ("ab", "c") and ("a", "bc") apart
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# the cache ----------------------------------------------------------------------------
+class BuildCache:
+    """A content-addressed cache on disk: each entry is stored under the hash of what
+    produced it (objects/ab/cdef....pdf), so it never has to be invalidated.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str, kind: str) -> str:
+        return os.path.join(self.directory, "objects", key[:2], f"{key[2:]}.{kind}")
+
+    def get(self, key: str, kind: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key, kind), "rb") as entry:
+                data = entry.read()
+        except FileNotFoundError:
+            metrics.CACHE.inc(cache=kind, result="miss")
+            return None
+        metrics.CACHE.inc(cache=kind, result="hit")
+        return data
+
+    def put(self, key: str, kind: str, data: bytes) -> str:
+        path = self.path(key, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # two jobs may produce the same entry; whichever is renamed last wins, and
+        # both have the same content
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with open(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_name, path)
+        return path
+
+
+# compilers ----------------------------------------------------------------------------
+class Compiler:
+    """Turns a LaTeX document into PDF bytes; signature is part of every cache key, so
+    PDFs made by different compilers never mix.
+    """
+
+    name = ""
+
+    @property
+    def signature(self) -> str:
+        return self.name
+
+    def compile(self, latex: str) -> bytes:
+        raise NotImplementedError
+
+
+class LatexCompiler(Compiler):
+    """Runs latexmk (or, if it's missing, pdflatex twice, for the references) in a
+    temporary directory.
+    """
+
+    def __init__(self, engine: Optional[str] = None, timeout: float = 120) -> None:
+        self.engine = engine or ("latexmk" if shutil.which("latexmk") else "pdflatex")
+        if shutil.which(self.engine) is None:
+            raise BuildError(f"{self.engine} was not found.")
+        self.timeout = timeout
+        self.name = self.engine
+
+    @property
+    def command(self) -> List[str]:
+        flags = ["-interaction=nonstopmode", "-halt-on-error"]
+        if self.engine == "latexmk":
+            return [self.engine, "-pdf", "-quiet", *flags, "exam.tex"]
+        return [self.engine, *flags, "exam.tex"]
+
+    @property
+    def signature(self) -> str:
+        return SPACE.join(self.command)
+
+    def compile(self, latex: str) -> bytes:
+        runs = 1 if self.engine == "latexmk" else 2
+        with tempfile.TemporaryDirectory(prefix="morla-build-") as workdir:
+            with open(os.path.join(workdir, "exam.tex"), "w", encoding=UTF8) as tex:
+                tex.write(latex)
+            for _ in range(runs):
+                try:
+                    done = subprocess.run(
+                        self.command,
+                        cwd=workdir,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        timeout=self.timeout,
+                    )
+                except subprocess.TimeoutExpired:
+                    raise BuildError(f"{self.engine} timed out.") from None
+                if done.returncode:
+                    tail = done.stdout.decode(UTF8, "replace").splitlines()[-20:]
+                    raise BuildError(EOL.join(tail))
+            with open(os.path.join(workdir, "exam.pdf"), "rb") as pdf:
+                return pdf.read()
+
+
+class StubCompiler(Compiler):
+    """Pretends to compile, taking delay seconds, and returns a tiny PDF that records
+    the hash of the LaTeX it got; for trying out the pipeline without a TeX install.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+
+    def compile(self, latex: str) -> bytes:
+        if self.delay:
+            time.sleep(self.delay)
+        if r"\begin{document}" not in latex:
+            raise BuildError("there is no \\begin{document}.")
+        return f"%PDF-1.4\n% stub {digest(latex)}\n%%EOF\n".encode(UTF8)
+
+
+def get_compiler(stub: bool = False, engine: Optional[str] = None) -> Compiler:
+    return StubCompiler() if stub else LatexCompiler(engine)
+
+
+# rendering ----------------------------------------------------------------------------
+class Job(NamedTuple):
+    """A document to be built: an exam or a variant of one.
+    """
+
+    name: str
+    questions: Tuple[Question, ...]
+    # None keeps the order of the questions and of their choices
+    seed: Optional[int] = None
+
+
+def shuffled(q: Question, rng: random.Random) -> Question:
+    choices = q.choices[:]
+    rng.shuffle(choices)
+    return Question(
+        q.source,
+        q.year,
+        q.question_type,
+        q.answer,
+        q.histories[:],
+        q.tags[:],
+        q.texts[:],
+        choices,
+        q.wrongs[:],
+        q.explanations[:],
+        configs=q.configs,
+    )
+
+
+def variants(name: str, questions: Sequence[Question], n: int) -> List[Job]:
+    """The exam itself and n variants of it, in which the questions and their choices
+    are shuffled; the variants are numbered, and their seeds are their numbers.
+    """
+    jobs = [Job(name, tuple(questions))]
+    jobs.extend(Job(f"{name}-v{i}", tuple(questions), i) for i in range(1, n + 1))
+    return jobs
+
+
+class Builder:
+    """Renders jobs (wrapping the questions in preamble) and compiles them with a pool
+    of workers, skipping every document whose PDF is already in the cache.
+    """
+
+    def __init__(
+        self,
+        compiler: Compiler,
+        cache: BuildCache,
+        preamble: str = PREAMBLE,
+        workers: Optional[int] = None,
+    ) -> None:
+        self.compiler = compiler
+        self.cache = cache
+        self.preamble = preamble
+        self.workers = workers or os.cpu_count() or 1
+
+    def render(self, job: Job) -> str:
+        questions = list(job.questions)
+        if job.seed is not None:
+            rng = random.Random(job.seed)
+            rng.shuffle(questions)
+            questions = [shuffled(q, rng) for q in questions]
+        # rendering is cheap string work; only the compiled PDF is worth caching
+        body = (EOL * 2).join([q.render() for q in questions])
+        return (
+            f"{self.preamble.rstrip()}{EOL}\\begin{{document}}{EOL}{EOL}"
+            f"{body}{EOL}{EOL}\\end{{document}}{EOL}"
+        )
+
+    def build_one(self, job: Job, latex: str, output: str) -> Tuple[str, bool]:
+        """Compiles the LaTeX of job into output/name.pdf and returns (its path,
+        whether it was cached).
+        """
+        key = digest(self.compiler.signature, latex)
+        pdf = self.cache.get(key, "pdf")
+        cached = pdf is not None
+        if not cached:
+            pdf = self.compiler.compile(latex)
+            self.cache.put(key, "pdf", pdf)
+        path = os.path.join(output, f"{job.name}.pdf")
+        with open(path, "wb") as pdf_file:
+            pdf_file.write(pdf)
+        return path, cached
+
+    def build(
+        self, jobs: Sequence[Job], output: str
+    ) -> Iterator[Tuple[Job, Optional[str], bool, Optional[Exception]]]:
+        """Builds every job, workers at a time, and yields (job, path of the PDF,
+        whether it was cached, error) as each one finishes; a failed job has no path.
+        The jobs are rendered in this thread, which is cheap next to compiling them.
+        """
+        os.makedirs(output, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for job in jobs:
+                latex = self.render(job)
+                futures[pool.submit(self.build_one, job, latex, output)] = job
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    path, cached = future.result()
+                except Exception as e:
+                    logger.error(f"building {job.name} failed: {e}")
+                    yield job, None, False, e
+                else:
+                    yield job, path, cached, None
+
+
+def load_jobs(
+    filenames: Sequence[str], n_variants: int = 0, configs: Optional[Configuration] = None
+) -> List[Job]:
+    jobs = []
+    for filename in filenames:
+        parser = Parser(quiet=True)
+        questions = list(parser.parse(read_lines(filename), configs or {}))
+        name = os.path.splitext(os.path.basename(filename))[0]
+        jobs.extend(variants(name, questions, n_variants))
+    return jobs
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.build", description="Compiles banks into PDFs."
+    )
+    arg_parser.add_argument("filenames", nargs="+")
+    arg_parser.add_argument("--output", default=".", help="where the PDFs go")
+    arg_parser.add_argument(
+        "--variants", type=int, default=0, help="shuffled variants of each bank"
+    )
+    arg_parser.add_argument("--jobs", type=int, help="compilations at a time")
+    arg_parser.add_argument("--preamble", help="a file with the LaTeX preamble")
+    arg_parser.add_argument("--engine", choices=["latexmk", "pdflatex"])
+    arg_parser.add_argument(
+        "--cache", default=os.path.join("~", ".morla", "build-cache")
+    )
+    arg_parser.add_argument(
+        "--stub", action="store_true", help="use a fake compiler, for testing"
+    )
+    args = arg_parser.parse_args(argv)
+    preamble = PREAMBLE
+    if args.preamble:
+        with open(args.preamble, "r", encoding=UTF8) as preamble_file:
+            preamble = preamble_file.read()
+    try:
+        compiler = get_compiler(args.stub, args.engine)
+    except BuildError as e:
+        print(f"> {e}")
+        return 1
+    builder = Builder(compiler, BuildCache(args.cache), preamble, args.jobs)
+    jobs = load_jobs(args.filenames, args.variants)
+    failures = 0
+    for job, path, cached, error in builder.build(jobs, args.output):
+        if error is not None:
+            failures += 1
+            print(f"> {job.name}: FAILED{EOL}{error}")
+        else:
+            print(f"> {path}{' (cached)' if cached else ''}")
+    print(f"> {len(jobs) - failures} of {len(jobs)} built")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,39 @@
 # -*- coding: utf-8 -*-
 
-from typing import Optional, Union, Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Union, Sequence
 
 # tk provides the re module
+import hashlib
+import itertools
+import json
+import time
+
 from tkinter import re, sys
 
 from morla.utils import *
 from morla.configuration import Configuration
+from morla.dialects import configs_for_file
+from morla.fileio import read_lines
+from morla.profiling import instrument
+from morla.tokenizer import COMMENT, TEXT, Tokenizer, line_number
+from morla import metrics
 
 
 class ParsingException(Exception):
     pass
 
 
+def normalize_space(text: str) -> str:
+    return SPACE.join(text.split())
+
+
 class Question:
     CHOICES_TYPE = "choices question"
     WRITTEN_TYPE = "written question"
     TYPES = (CHOICES_TYPE, WRITTEN_TYPE)
+    # the fingerprint of the first copy of the question, if it's a duplicate that was
+    # linked to it by a Deduplicator
+    duplicate_of = None
 
     def __init__(
         self,
@@ -66,36 +83,136 @@ class Question:
         self.wrongs = wrongs
         self.explanations = explanations
 
+    def fingerprint(self) -> str:
+        """A hash of the content of the question (its histories and tags, which are
+        about how it's used, are left out), which identifies it across banks.
+        """
+        content = (
+            self.source,
+            self.year,
+            self.question_type,
+            self.texts,
+            self.choices,
+            self.answer,
+            self.explanations,
+        )
+        encoded = json.dumps(content, ensure_ascii=False).encode(UTF8)
+        return hashlib.sha1(encoded).hexdigest()
+
+    def canonical_fingerprint(self) -> str:
+        """A hash of what the student sees and of the answer, with the whitespace
+        normalized and the choices sorted, so that copies of the question that differ
+        only in layout or in the order of the choices have the same one. Unlike
+        fingerprint, it leaves out the source, the year and the explanations too, which
+        each teacher writes their own way.
+        """
+        content = (
+            self.question_type,
+            normalize_space(SPACE.join(self.texts)),
+            sorted(normalize_space(choice) for choice in self.choices),
+            normalize_space(self.answer),
+        )
+        encoded = json.dumps(content, ensure_ascii=False).encode(UTF8)
+        return hashlib.sha1(encoded).hexdigest()
+
     def __repr__(self):
         body = SPACE.join(self.texts)
         return truncate(body, 15)
 
+    def render(self) -> str:
+        """The question in LaTeX, like str(q), but without printing anything.
+        """
+        return render_question(
+            self.configs,
+            self.question_type,
+            self.texts,
+            self.choices,
+            self.answer,
+            self.explanations,
+        )
+
+    @instrument("question.__str__")
     def __str__(self):
         configs = self.configs
         print(truncate(str(configs), prefix=f"{repr(self)} settings: "))
-        # start of the question body
-        body = [configs.BEGIN_QUESTION]
-        body.extend(self.texts)
-        # insert choices, if there are any
-        if self.question_type == self.CHOICES_TYPE:
-            body.append(configs.BEGIN_CHOICES)
-            for c in self.choices:
-                if c == self.answer:
-                    label = configs.CORRECT
-                else:
-                    label = configs.CHOICE
-                body.append(f"{label} {c}")
-            body.append(configs.END_CHOICES)
-        # finish the body
-        body.append(configs.END_QUESTION)
-        # the explanations
-        explanation = [configs.BEGIN_ANSWER]
-        explanation.extend(self.explanations)
-        explanation.append(configs.END_ANSWER)
-        # assemble and return
-        body = EOL.join(body)
-        explanation = EOL.join(explanation)
-        return f"{body}{EOL}{explanation}"
+        return self.render()
+
+
+def render_question(
+    configs: Configuration,
+    question_type: str,
+    texts: Sequence[str],
+    choices: Sequence[str],
+    answer: str,
+    explanations: Sequence[str],
+) -> str:
+    """Renders the parts of a question in LaTeX. It's a function of plain values, so
+    that it can be run in other processes (see formatter.py) without sending whole
+    Question objects there.
+    """
+    # start of the question body
+    body = [configs.BEGIN_QUESTION]
+    body.extend(texts)
+    # insert choices, if there are any
+    if question_type == Question.CHOICES_TYPE:
+        body.append(configs.BEGIN_CHOICES)
+        for c in choices:
+            if c == answer:
+                label = configs.CORRECT
+            else:
+                label = configs.CHOICE
+            body.append(f"{label} {c}")
+        body.append(configs.END_CHOICES)
+    # finish the body
+    body.append(configs.END_QUESTION)
+    # the explanations
+    explanation = [configs.BEGIN_ANSWER]
+    explanation.extend(explanations)
+    explanation.append(configs.END_ANSWER)
+    # assemble and return
+    body = EOL.join(body)
+    explanation = EOL.join(explanation)
+    return f"{body}{EOL}{explanation}"
+
+
+class Deduplicator:
+    """Spots copies of questions already seen, by their canonical fingerprint, with a
+    dict lookup per question. In DROP mode, the copies are left out; in LINK mode, they
+    are kept, with their duplicate_of set to the fingerprint of the first copy.
+    """
+
+    DROP = "drop"
+    LINK = "link"
+    MODES = (DROP, LINK)
+
+    def __init__(self, mode: str = DROP) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"{repr(mode)} is not a deduplication mode!")
+        self.mode = mode
+        # canonical fingerprint: fingerprint of the first question with it
+        self.seen: Dict[str, str] = {}
+        self.duplicates = 0
+
+    def first_copy(self, q: Question) -> Optional[str]:
+        """Returns the fingerprint of the first copy of q, or None (and remembers q)
+        if q is the first.
+        """
+        canonical = q.canonical_fingerprint()
+        first = self.seen.get(canonical)
+        if first is None:
+            self.seen[canonical] = q.fingerprint()
+        else:
+            self.duplicates += 1
+        return first
+
+    def filter(self, questions: Iterable[Question]) -> Iterator[Question]:
+        for q in questions:
+            first = self.first_copy(q)
+            if first is None:
+                yield q
+            elif self.mode == self.LINK:
+                q.duplicate_of = first
+                yield q
 
 
 class Parser:
@@ -120,8 +237,33 @@ class Parser:
         r"\]?"  # optional ]
     )
 
-    def __init__(self) -> None:
+    # the regex engine's state machine: (location, token kind): next location; any
+    # other pair is a syntax error
+    TRANSITIONS = {
+        (OUT, COMMENT): IN_QUESTION,
+        (OUT, "BEGIN_ANSWER"): IN_ANSWER,
+        (IN_QUESTION, COMMENT): IN_QUESTION,
+        (IN_QUESTION, TEXT): IN_QUESTION,
+        (IN_QUESTION, "BEGIN_QUESTION"): IN_QUESTION,
+        (IN_QUESTION, "BEGIN_CHOICES"): IN_QUESTION,
+        (IN_QUESTION, "CHOICE"): IN_QUESTION,
+        (IN_QUESTION, "CORRECT"): IN_QUESTION,
+        (IN_QUESTION, "END_CHOICES"): IN_QUESTION,
+        (IN_QUESTION, "END_QUESTION"): OUT,
+        (IN_ANSWER, COMMENT): IN_ANSWER,
+        (IN_ANSWER, TEXT): IN_ANSWER,
+        (IN_ANSWER, "END_ANSWER"): OUT,
+    }
+
+    def __init__(
+        self, memory_budget: Optional[int] = None, quiet: bool = False
+    ) -> None:
+        # a quiet parser prints nothing, so it can run in a background thread without
+        # redirecting sys.stdout, which is global
+        self.quiet = quiet
         self.location = None
+        # when the current question started being parsed
+        self.started = None
         # strings
         self.source = ""
         self.year = ""
@@ -134,6 +276,9 @@ class Parser:
         self.choices = []
         self.wrongs = []
         self.explanations = []
+        # duplicates found by the last read_text, and where its questions start
+        self.duplicates = 0
+        self.last_read = 0
         self.dynamic = (
             self.histories,
             self.tags,
@@ -144,6 +289,41 @@ class Parser:
         )
         # the questions list
         self.questions = []
+        self.set_memory_budget(memory_budget)
+
+    def set_memory_budget(self, budget: Optional[int]) -> None:
+        """With a budget (in bytes), the parsed questions are kept in a QuestionSpool,
+        which spills them to a temporary file once they take more than that; without
+        one, they are all kept in a list.
+        """
+        # imported here, since spill.py imports this module
+        from morla.spill import QuestionSpool
+
+        questions = self.questions
+        if isinstance(questions, QuestionSpool):
+            if budget:
+                questions.budget = budget
+                if questions.memory_size > budget:
+                    questions.spill()
+                return
+            self.questions = list(questions)
+            questions.clear()
+        elif budget:
+            self.questions = QuestionSpool(budget)
+            self.questions.extend(questions)
+
+    def snapshot(self, start: int = 0) -> Iterable[Question]:
+        """The parsed questions as they are now, from index start on, to be read
+        (e.g. by a background thread) while others are parsed or deleted; spilled
+        questions are streamed back instead of copied.
+        """
+        if isinstance(self.questions, list):
+            return self.questions[start:]
+        return self.questions.tail(start)
+
+    def say(self, *args) -> None:
+        if not self.quiet:
+            print(*args)
 
     def clear(self, total=False):
         self.source = ""
@@ -155,6 +335,33 @@ class Parser:
         if total:
             self.questions.clear()
 
+    @classmethod
+    def option_problems(
+        cls, options: str, source: str, configs: Configuration
+    ) -> List[str]:
+        """Describes the label and the origin of a \\begin{Exercise}[...] line that
+        don't match source.
+        """
+        problems = []
+        for latex_key, latex_value in cls.pattern.findall(options):
+            latex_key = latex_key.lower()
+            latex_value = latex_value.lower()
+            if latex_key == configs.LABEL:
+                if latex_value.lstrip("q:") not in source.lower():
+                    problems.append(f"{latex_value} is not in {source}!")
+            elif latex_key == configs.ORIGIN:
+                if latex_value.strip("}{") not in source.lower():
+                    problems.append(f"{latex_value} is not in {source}!")
+        return problems
+
+    def check_options(self, options: str, configs: Configuration) -> None:
+        """Warns about the label and the origin of a \\begin{Exercise}[...] line that
+        don't match the source of the question.
+        """
+        for problem in self.option_problems(options, self.source, configs):
+            self.say(f"> {problem}")
+
+    @instrument("parser.get_question")
     def get_question(self, configs: Optional[Union[dict, Configuration]]) -> Question:
         copies = [L[:] for L in self.dynamic]
         q = Question(
@@ -168,32 +375,77 @@ class Parser:
         self.clear()
         return q
 
+    @instrument("parser.read", top_level=True)
     def read(
         self, text: Sequence[str], configuration: Union[dict, Configuration]
     ) -> None:
+        sample = SPACE.join(text[:6])
+        self.say(truncate(sample, prefix="Reading: "))
+        for q in self.parse(text, configuration):
+            self.questions.append(q)
+            self.say(truncate(str(self.questions), prefix="self.questions: "))
+
+    def read_file(
+        self,
+        filename: str,
+        configuration: Optional[Union[dict, Configuration]] = None,
+    ) -> None:
+        """Like read_text, for the lines of filename, which are streamed; with a memory
+        budget, a bank of any size can be read.
+        """
+        self.say(f"Reading: {filename}")
+        self.questions.extend(self.parse_file(filename, configuration))
+
+    def parse_file(
+        self,
+        filename: str,
+        configuration: Optional[Union[dict, Configuration]] = None,
+    ) -> Iterator[Question]:
+        """Like parse, for the lines of filename; without a configuration, the one of
+        the dialect of filename is used (see dialects.configs_for_file).
+        """
+        if configuration is None:
+            configuration = configs_for_file(filename)
+        return self.parse(read_lines(filename), configuration)
+
+    def parse(
+        self, text: Iterable[str], configuration: Union[dict, Configuration]
+    ) -> Iterator[Question]:
+        """Yields the questions of text one at a time, as soon as each one ends, without
+        keeping them; text may be lazy (e.g. fileio.read_lines), so a bank of any size
+        can be streamed through.
+        """
         if isinstance(configuration, (dict, Configuration)):
             configs = Configuration(configuration)
         else:
             raise ValueError(f"{repr(configuration)} must be dict or Configuration!")
         # configs is necessarily a Configuration instance
         self.location = self.OUT
-        sample = SPACE.join(text[:6])
-        print(truncate(sample, prefix="Reading: "))
-        indexes = var_zfill(*range(1, len(text) + 1))
-        # assert len(list(indexes)) == len(text)
-        for index, line in zip(indexes, text):  # enumerate(text, start=1):
+        if isinstance(text, Sequence):
+            indexes = var_zfill(*range(1, len(text) + 1))
+        else:
+            # the number of lines isn't known beforehand
+            indexes = map(str, itertools.count(1))
+        lines_read = 0
+        bytes_in = 0
+        for index, line in zip(indexes, text):
+            lines_read += 1
+            # the line plus its line break
+            bytes_in += len(line.encode(UTF8)) + 1
             line = line.strip()
-            print(truncate(line, prefix=f"{index}: "))
+            if not self.quiet:
+                print(truncate(line, prefix=f"{index}: "))
             if line.startswith(PERCENT):
                 # the current line is a LaTeX comment
                 # first, disregard the % character
-                line = re.sub(r"^%+", "", line)
+                line = re.sub(r"^%+", "", line).strip()
                 # .strip(PERCENT)
                 # delete(line, PERCENT)
                 if self.location == self.OUT:
                     # a question has started!
                     self.question_type = ""
                     self.location = self.IN_QUESTION
+                    self.started = time.perf_counter()
                     # this first line should look like this:
                     # % UFRJ-RJ 2011
                     tokens = line.split()
@@ -204,7 +456,7 @@ class Parser:
                     # % Uso: lista01-19, aula13-19
                     # line
                     line = delete(line, configs.USO)
-                    tokens = line.split(COMMA)
+                    tokens = [t.strip() for t in line.split(",")]
                     self.histories.extend(tokens)
                 elif line.startswith(configs.TAGS):
                     # the current line is a
@@ -217,22 +469,7 @@ class Parser:
                 # the current line is a
                 # \begin{Exercise}[label=ufa,origin={UFA-AM}]
                 # line
-                for latex_key, latex_value in self.pattern.findall(line):
-                    latex_key = latex_key.lower()
-                    latex_value = latex_value.lower()
-                    source = self.source.lower()
-                    if latex_key == configs.LABEL:
-                        if latex_value.lstrip("q:") not in source:
-                            print(f"> {latex_value} is not in {self.source}!")
-                        else:
-                            pass
-                            # print(f"{latex_key}={latex_value} is ok!")
-                    elif latex_key == configs.ORIGIN:
-                        if latex_value.strip("}{") not in self.source:
-                            print(f"> {latex_value} is not in {self.source}!")
-                        else:
-                            pass
-                            # print(f"{latex_key}={latex_value} is ok!")
+                self.check_options(line, configs)
             elif line.startswith(configs.BEGIN_CHOICES):
                 # this question is a choices question
                 self.question_type = Question.CHOICES_TYPE
@@ -265,11 +502,15 @@ class Parser:
             elif line.startswith(configs.END_ANSWER):
                 assert self.location == self.IN_ANSWER
                 q = self.get_question(configs)
-                self.questions.append(q)
-                print("Nova questão:")
-                print(q)
-                print(truncate(str(self.questions), prefix="self.questions: "))
+                metrics.QUESTIONS.inc(type=q.question_type)
+                if self.started is not None:
+                    metrics.PARSE_SECONDS.observe(time.perf_counter() - self.started)
+                if not self.quiet:
+                    # str(q) prints too
+                    print("Nova questão:")
+                    print(q)
                 self.location = self.OUT
+                yield q
             elif line:
                 # the line is plain text; append it in the proper list:
                 if self.location == self.IN_QUESTION:
@@ -280,13 +521,165 @@ class Parser:
                     raise ParsingException
             # print(reveal(self))
         self.location = None
+        metrics.LINES_READ.inc(lines_read)
+        metrics.BYTES_IN.inc(bytes_in)
+
+    # this many questions or more are formatted by a pool of processes
+    PARALLEL_THRESHOLD = 50_000
+    # inputs at least this long (in characters) are parsed by the regex engine
+    REGEX_THRESHOLD = 64 * 1024
+    LINE_ENGINE = "line"
+    REGEX_ENGINE = "regex"
+
+    @instrument("parser.read", top_level=True)
+    def read_text(
+        self,
+        text: str,
+        configuration: Union[dict, Configuration],
+        engine: Optional[str] = None,
+        dedupe: Optional[str] = None,
+    ) -> None:
+        """Parses text and appends its questions to self.questions; with dedupe (a
+        Deduplicator mode), copies of questions already parsed are dropped or linked.
+        """
+        self.say(truncate(text[:400], prefix="Reading: "))
+        before = self.last_read = len(self.questions)
+        questions = self.parse_text(text, configuration, engine)
+        self.duplicates = 0
+        if dedupe:
+            deduplicator = Deduplicator(dedupe)
+            # the questions already parsed are the first copies
+            for q in self.questions:
+                deduplicator.first_copy(q)
+            deduplicator.duplicates = 0
+            questions = deduplicator.filter(questions)
+        self.questions.extend(questions)
+        if dedupe:
+            self.duplicates = deduplicator.duplicates
+            action = "dropped" if dedupe == Deduplicator.DROP else "linked"
+            self.say(
+                f"> Parsed {len(self.questions) - before} question(s); "
+                f"{self.duplicates} duplicate(s) {action}."
+            )
+
+    def parse_text(
+        self,
+        text: str,
+        configuration: Union[dict, Configuration],
+        engine: Optional[str] = None,
+    ) -> Iterator[Question]:
+        """Parses a whole bank given as a single str, with the line engine (parse) or
+        the regex engine (parse_buffer); by default, the latter is used for inputs of
+        REGEX_THRESHOLD characters or more, where its lower cost per line pays off.
+        """
+        if engine is None:
+            if len(text) >= self.REGEX_THRESHOLD:
+                engine = self.REGEX_ENGINE
+            else:
+                engine = self.LINE_ENGINE
+        if engine == self.REGEX_ENGINE:
+            return self.parse_buffer(text, configuration)
+        elif engine == self.LINE_ENGINE:
+            return self.parse(text.split("\n"), configuration)
+        raise ValueError(f"{repr(engine)} is not a parsing engine!")
 
+    def parse_buffer(
+        self, text: str, configuration: Union[dict, Configuration]
+    ) -> Iterator[Question]:
+        """Like parse, but text is a whole bank in a single str, which is tokenized with
+        one regular expression (see tokenizer.py) and fed to a small state machine;
+        unlike the line engine, it accepts several markers on the same line. Nothing is
+        printed, except for warnings.
+        """
+        if isinstance(configuration, (dict, Configuration)):
+            configs = Configuration(configuration)
+        else:
+            raise ValueError(f"{repr(configuration)} must be dict or Configuration!")
+        self.location = self.OUT
+        for token in Tokenizer.for_configs(configs).tokenize(text):
+            kind = token.kind
+            next_location = self.TRANSITIONS.get((self.location, kind))
+            if next_location is None:
+                where = line_number(text, token.start)
+                raise ParsingException(
+                    f"unexpected {kind} on line {where} ({self.location})"
+                )
+            if kind == COMMENT:
+                value = token.value
+                if self.location == self.OUT:
+                    # a question has started!
+                    tokens = value.split()
+                    if not tokens:
+                        continue
+                    self.question_type = ""
+                    self.started = time.perf_counter()
+                    self.source = SPACE.join(tokens[:-1])
+                    self.year = tokens[-1]
+                elif value.startswith(configs.USO):
+                    value = delete(value, configs.USO)
+                    self.histories.extend([t.strip() for t in value.split(",")])
+                elif value.startswith(configs.TAGS):
+                    value = delete(value, configs.TAGS)
+                    self.tags.extend([t.strip() for t in value.split(",")])
+            elif kind == TEXT:
+                if self.location == self.IN_QUESTION:
+                    self.texts.append(token.value)
+                else:
+                    self.explanations.append(token.value)
+            elif kind == "BEGIN_QUESTION":
+                self.check_options(token.value, configs)
+            elif kind == "BEGIN_CHOICES":
+                self.question_type = Question.CHOICES_TYPE
+            elif kind in ("CHOICE", "CORRECT"):
+                if self.question_type != Question.CHOICES_TYPE:
+                    where = line_number(text, token.start)
+                    raise ParsingException(f"choice outside choices on line {where}")
+                if kind == "CORRECT":
+                    self.answer = token.value
+                self.choices.append(token.value)
+            elif kind == "END_CHOICES":
+                if self.answer not in self.choices:
+                    where = line_number(text, token.start)
+                    raise ParsingException(f"no correct choice before line {where}")
+                self.wrongs.extend(self.choices)
+                self.wrongs.remove(self.answer)
+            elif kind == "END_QUESTION":
+                if not self.question_type:
+                    self.question_type = Question.WRITTEN_TYPE
+            elif kind == "END_ANSWER":
+                q = self.get_question(configs)
+                metrics.QUESTIONS.inc(type=q.question_type)
+                if self.started is not None:
+                    metrics.PARSE_SECONDS.observe(time.perf_counter() - self.started)
+                self.location = next_location
+                yield q
+            self.location = next_location
+        self.location = None
+        metrics.LINES_READ.inc(text.count("\n") + 1)
+        metrics.BYTES_IN.inc(len(text.encode(UTF8)))
+
+    def iter_pretty(self) -> Iterator[str]:
+        """Yields the formatted questions one at a time, so that they can be streamed
+        instead of joined into a single str.
+        """
+        for q in self.questions:
+            rendered = str(q)
+            metrics.QUESTIONS_FORMATTED.inc()
+            metrics.BYTES_OUT.inc(len(rendered.encode(UTF8)))
+            yield rendered
+
+    @instrument("parser.pretty_print")
     def pretty_print(self) -> str:
         if not self.questions:
             # no_questions_parsed = self.gets
             return ""
+        if len(self.questions) >= self.PARALLEL_THRESHOLD:
+            # imported here, since formatter.py imports this module
+            from morla.formatter import ParallelFormatter
+
+            return "".join(ParallelFormatter().format(self.questions))
         double_eol = EOL * 2
-        return double_eol.join([str(q) for q in self.questions])
+        return double_eol.join(self.iter_pretty())
 
     def __str__(self) -> str:
         """Prints the first three parsed questions, truncated.
@@ -3,7 +3,7 @@
 from typing import Any, ItemsView, KeysView, Optional, Union, ValuesView
 
 
-from morla.utils import COMMA, dict_diff
+from morla.utils import COMMA, key_diff
 
 
 class ConfigurationError(Exception):
@@ -31,14 +31,14 @@ class Configuration:
     }
 
     def update(self, D: dict) -> None:
-        # check whether D has only valid keys
-        illegal = dict_diff(self.default, D)
+        # check whether D has only valid keys; keys it lacks keep their current values
+        _, illegal = key_diff(self.default, D)
         if not illegal:
             self.dict.update(D)
             # this ensures that every default (key, value) not overriden by D
             # is in D; self.dict = D.copy() wouldn't do.
         else:
-            illegal = ", ".join(illegal)
+            illegal = ", ".join(sorted(illegal))
             raise ConfigurationError(f"{illegal} are not valid configuration keys.")
 
     def __init__(self, D: Optional[Union[dict, "Configuration"]] = None) -> None:
@@ -101,9 +101,12 @@ class Configuration:
             # attempt normal attribute name syntax
             return self.__dict__[name]
         except KeyError:
-            # attempt to access the inner dictionary
-            D = self.__dict__["_dict"]
-            return D[name]
+            # attempt to access the inner dictionary, which doesn't exist yet while
+            # unpickling; pickle needs an AttributeError then
+            try:
+                return self.__dict__["_dict"][name]
+            except KeyError:
+                raise AttributeError(name) from None
 
     def __iter__(self) -> iter:
         """This method is called when an iterator is required for a container.
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Checks the input as it's edited: the question block around each edit is checked in a
+background thread, and its problems are marked in the text and listed beside the log,
+instead of waiting for the next Parse. Each check costs time in proportion to the edited
+block, never to the whole bank.
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+
+from tkinter import sys
+import tkinter as tk
+
+from morla.utils import *
+from morla.bulk import Parser
+from morla.configuration import Configuration
+from morla.tokenizer import COMMENT, TEXT, Tokenizer, line_number
+
+
+ERROR = "error"
+WARNING = "warning"
+# tag: options of tk.Text.tag_configure
+TAG_STYLES = {
+    f"diagnostic-{ERROR}": {"background": "#f9d6d5", "underline": True},
+    f"diagnostic-{WARNING}": {"background": "#fbf1c7"},
+}
+ERROR_COLOR = "#990000"
+
+
+class Diagnostic(NamedTuple):
+    # counted from 1, from the first line of the checked block
+    line: int
+    severity: str
+    message: str
+
+
+def check_block(text: str, configs: Configuration) -> List[Diagnostic]:
+    """Checks the questions in text (usually a single one) like the parser would, but
+    reports every problem it finds instead of stopping at the first.
+    """
+    configs = Configuration(configs)
+    found = []
+
+    def report(offset: int, severity: str, message: str) -> None:
+        found.append(Diagnostic(line_number(text, offset), severity, message))
+
+    location = Parser.OUT
+    source = ""
+    # where the current question (and its choices) started, if it did
+    question = None
+    choices = None
+    corrects = 0
+    texts = 0
+    for token in Tokenizer.for_configs(configs).tokenize(text):
+        kind = token.kind
+        next_location = Parser.TRANSITIONS.get((location, kind))
+        if next_location is None:
+            marker = configs[kind] if kind in configs else kind.lower()
+            report(token.start, ERROR, f"unexpected {marker} ({location})")
+            continue
+        if kind == COMMENT:
+            if location == Parser.OUT:
+                tokens = token.value.split()
+                if not tokens:
+                    continue
+                source = SPACE.join(tokens[:-1])
+                year = tokens[-1]
+                if not (year.isdigit() or year == configs.BAD_YEAR):
+                    report(
+                        token.start,
+                        WARNING,
+                        f"the header should end in a year or {configs.BAD_YEAR}",
+                    )
+                question = token.start
+                texts = 0
+        elif kind == TEXT:
+            texts += 1
+        elif kind == "BEGIN_QUESTION":
+            for problem in Parser.option_problems(token.value, source, configs):
+                report(token.start, WARNING, problem)
+        elif kind == "BEGIN_CHOICES":
+            choices = token.start
+            corrects = 0
+        elif kind in ("CHOICE", "CORRECT"):
+            if choices is None:
+                report(token.start, ERROR, f"{configs[kind]} outside choices")
+            elif kind == "CORRECT":
+                corrects += 1
+                if corrects == 2:
+                    report(token.start, WARNING, "more than one correct choice")
+        elif kind == "END_CHOICES":
+            if choices is None:
+                report(token.start, ERROR, f"unexpected {configs.END_CHOICES}")
+            elif not corrects:
+                report(choices, ERROR, f"no {configs.CORRECT} in the choices")
+            choices = None
+        elif kind == "END_QUESTION":
+            if choices is not None:
+                report(choices, ERROR, f"{configs.BEGIN_CHOICES} isn't closed")
+                choices = None
+            if not texts:
+                report(token.start, WARNING, "the question has no text")
+        elif kind == "END_ANSWER":
+            question = None
+        location = next_location
+    if location != Parser.OUT:
+        start = question if question is not None else len(text.rstrip())
+        if location == Parser.IN_ANSWER:
+            missing = configs.END_ANSWER
+        else:
+            missing = configs.END_QUESTION
+        report(start, ERROR, f"the question isn't closed (no {missing})")
+    return found
+
+
+class Diagnostician:
+    """Checks the block of a tk.Text around each edit, delay ms after the edits stop.
+    A block runs from the line after the closest END_ANSWER above the edit to the next
+    END_ANSWER; both are found by Tk's own search, so nothing else is read. The check
+    runs in a worker thread, and its diagnostics become tags over the offending lines
+    (one tag per diagnostic, so they follow the text as it's edited) and rows of a
+    tk.Listbox; clicking a row shows its line.
+    """
+
+    def __init__(
+        self, configs: Optional[Configuration] = None, delay: int = 400
+    ) -> None:
+        self.configs = Configuration(configs)
+        self.delay = delay
+        self.text = None
+        self.listbox = None
+        self.scheduled = None
+        # lines edited since the last check
+        self.edited = set()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        # checks being run: (future, name of the mark at the start of their block)
+        self.running = []
+        # tag of a diagnostic: the diagnostic
+        self.diagnostics = {}
+        # the tag of each row of listbox
+        self.rows = []
+        self.names = itertools.count()
+
+    def attach(self, text: tk.Text, listbox: tk.Listbox) -> None:
+        self.text = text
+        self.listbox = listbox
+        for tag, style in TAG_STYLES.items():
+            text.tag_configure(tag, **style)
+        text.tag_raise(tk.SEL)
+        text.bind("<<Modified>>", self.on_modified, add="+")
+        listbox.bind("<<ListboxSelect>>", self.on_select)
+
+    def set_configs(self, configs: Configuration) -> None:
+        self.configs = Configuration(configs)
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=False)
+
+    def on_modified(self, event=None) -> None:
+        self.edited.add(self.line_of(tk.INSERT))
+        if self.scheduled is not None:
+            self.text.after_cancel(self.scheduled)
+        self.scheduled = self.text.after(self.delay, self.check)
+
+    def line_of(self, index: str) -> int:
+        return int(self.text.index(index).split(".")[0])
+
+    def block(self, line: int) -> Tuple[int, int]:
+        """The first and last lines of the block with line in it.
+        """
+        marker = self.configs.END_ANSWER
+        previous = self.text.search(
+            marker, f"{line}.0", backwards=True, stopindex="1.0"
+        )
+        first = self.line_of(previous) + 1 if previous else 1
+        following = self.text.search(marker, f"{line}.0", stopindex=tk.END)
+        last = self.line_of(following) if following else self.line_of(tk.END)
+        return first, last
+
+    def check(self) -> None:
+        self.scheduled = None
+        blocks = {self.block(line) for line in self.edited}
+        self.edited.clear()
+        for first, last in sorted(blocks):
+            content = self.text.get(f"{first}.0", f"{last}.end")
+            # the mark keeps track of the block while it's being checked
+            mark = f"diagnostics-block{next(self.names)}"
+            self.text.mark_set(mark, f"{first}.0")
+            self.text.mark_gravity(mark, tk.LEFT)
+            future = self.pool.submit(check_block, content, self.configs)
+            self.running.append((future, mark))
+        self.poll()
+
+    def poll(self) -> None:
+        while self.running and self.running[0][0].done():
+            future, mark = self.running.pop(0)
+            try:
+                found = future.result()
+            except Exception as e:
+                found = [Diagnostic(1, ERROR, f"the check failed: {e}")]
+            self.show(mark, found)
+            self.text.mark_unset(mark)
+        if self.running:
+            self.text.after(50, self.poll)
+
+    def show(self, mark: str, found: List[Diagnostic]) -> None:
+        """Replaces the diagnostics of the block at mark with found.
+        """
+        text = self.text
+        first, last = self.block(self.line_of(mark))
+        for severity in (ERROR, WARNING):
+            text.tag_remove(f"diagnostic-{severity}", f"{first}.0", f"{last + 1}.0")
+        # the old diagnostics of the block, and those whose lines were deleted
+        for tag in list(self.diagnostics):
+            ranges = text.tag_ranges(tag)
+            if not ranges or first <= self.line_of(ranges[0]) <= last:
+                text.tag_delete(tag)
+                del self.diagnostics[tag]
+        for diagnostic in found:
+            start = f"{first + diagnostic.line - 1}.0"
+            end = f"{first + diagnostic.line}.0"
+            tag = f"diagnostic{next(self.names)}"
+            text.tag_add(tag, start, end)
+            text.tag_add(f"diagnostic-{diagnostic.severity}", start, end)
+            self.diagnostics[tag] = diagnostic
+        self.fill_listbox()
+
+    def fill_listbox(self) -> None:
+        rows = []
+        for tag, diagnostic in self.diagnostics.items():
+            ranges = self.text.tag_ranges(tag)
+            if ranges:
+                rows.append((self.line_of(ranges[0]), tag, diagnostic))
+        rows.sort()
+        self.rows = [tag for _, tag, _ in rows]
+        self.listbox.delete(0, tk.END)
+        for line, _, diagnostic in rows:
+            self.listbox.insert(
+                tk.END, f"{line}: {diagnostic.severity}: {diagnostic.message}"
+            )
+            if diagnostic.severity == ERROR:
+                self.listbox.itemconfig(tk.END, foreground=ERROR_COLOR)
+
+    def on_select(self, event=None) -> None:
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        ranges = self.text.tag_ranges(self.rows[selection[0]])
+        if ranges:
+            self.text.see(ranges[0])
+            self.text.mark_set(tk.INSERT, ranges[0])
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
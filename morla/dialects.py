@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Named Configuration profiles for the dialects that banks are written in, and a
+detector that tells them apart by the first SAMPLE_SIZE bytes of a bank:
+    python3 -m morla.dialects banks/*.tex
+Each profile is scored by the markers it finds in the sample, so picking one costs the
+same for any size of bank, and nothing is parsed twice.
+"""
+
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, Union
+
+# sys is already loaded by tkinter; use tk.sys instead
+import argparse
+import codecs
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.configuration import Configuration
+from morla.fileio import SNIFF_SIZE, FallbackDecoder, sniff_encoding
+from morla.tokenizer import MARKERS
+
+
+# bytes of a bank examined to detect its dialect
+SAMPLE_SIZE = SNIFF_SIZE
+
+DEFAULT_PROFILE = "exercise"
+PROFILES = {
+    # the exercise package, morla's own
+    DEFAULT_PROFILE: Configuration(),
+    # the environments of the exam class (and of exsheets); the bare \question of exam
+    # has no closing marker, which the parser needs
+    "exam": Configuration(
+        {
+            "BEGIN_QUESTION": r"\begin{question}",
+            "END_QUESTION": r"\end{question}",
+            "BEGIN_ANSWER": r"\begin{solution}",
+            "END_ANSWER": r"\end{solution}",
+        }
+    ),
+    # custom environments, in Portuguese
+    "questao": Configuration(
+        {
+            "LABEL": "rotulo",
+            "ORIGIN": "origem",
+            "BEGIN_QUESTION": r"\begin{questao}",
+            "END_QUESTION": r"\end{questao}",
+            "BEGIN_CHOICES": r"\begin{alternativas}",
+            "END_CHOICES": r"\end{alternativas}",
+            "CHOICE": r"\alternativa",
+            "CORRECT": r"\correta",
+            "BEGIN_ANSWER": r"\begin{resolucao}",
+            "END_ANSWER": r"\end{resolucao}",
+        }
+    ),
+}
+
+Candidates = Dict[str, Configuration]
+
+
+class Detection(NamedTuple):
+    name: str
+    configs: Configuration
+    # how many of the markers of configs are in the sample, and how many times
+    kinds: int
+    hits: int
+
+    @property
+    def rank(self) -> Tuple[int, int]:
+        return self.kinds, self.hits
+
+
+def score(sample: str, configs: Configuration) -> Detection:
+    counts = [sample.count(configs[kind]) for kind in MARKERS]
+    kinds = sum(1 for count in counts if count)
+    return Detection("", configs, kinds, sum(counts))
+
+
+def detect(
+    sample: str, candidates: Optional[Candidates] = None
+) -> Optional[Detection]:
+    """The candidate (by default, one of PROFILES) that finds the most kinds of markers
+    in sample, and then the most markers; ties go to the first candidate. None if no
+    candidate finds any.
+    """
+    candidates = PROFILES if candidates is None else candidates
+    best = None
+    for name, configs in candidates.items():
+        detection = score(sample, configs)._replace(name=name)
+        if best is None or detection.rank > best.rank:
+            best = detection
+    if best is None or not best.hits:
+        return None
+    return best
+
+
+def read_sample(filename: str, size: int = SAMPLE_SIZE) -> str:
+    with open(filename, "rb") as f:
+        data = f.read(size)
+    encoding = sniff_encoding(data)
+    if codecs.lookup(encoding).name == UTF8:
+        return FallbackDecoder(encoding).decode(data, final=True)
+    return data.decode(encoding, "replace")
+
+
+def detect_file(
+    filename: str, candidates: Optional[Candidates] = None
+) -> Optional[Detection]:
+    return detect(read_sample(filename), candidates)
+
+
+def configs_for_file(
+    filename: str, default: Optional[Union[dict, Configuration]] = None
+) -> Configuration:
+    """The Configuration of the dialect that filename is written in, or default (by
+    default, Configuration()) if it has none of the known markers.
+    """
+    detection = detect_file(filename)
+    if detection is None:
+        return Configuration(default)
+    return Configuration(detection.configs)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.dialects", description="Detects the dialect of banks."
+    )
+    arg_parser.add_argument("filenames", nargs="+")
+    args = arg_parser.parse_args(argv)
+    for filename in args.filenames:
+        detection = detect_file(filename)
+        if detection is None:
+            print(f"> {filename}: unknown")
+        else:
+            print(
+                f"> {filename}: {detection.name} "
+                f"({detection.kinds} kinds of markers, {detection.hits} hits)"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""Exports question banks to other formats: JSON Lines, CSV, Moodle XML and GIFT.
+Every exporter renders one question at a time from a stream of questions, so a bank of
+any size is exported in bounded memory:
+    python3 -m morla.exporters bank.tex --format gift --output bank.gift
+"""
+
+from typing import Iterable, Iterator, Optional, Sequence, Type
+
+# sys is already loaded by tkinter; use tk.sys instead
+from xml.sax.saxutils import escape, quoteattr
+import argparse
+import csv
+import io
+import json
+import os
+
+from tkinter import re, sys
+
+from morla.utils import *
+from morla.bulk import Parser, Question
+from morla.configuration import Configuration
+from morla.fileio import write_atomically
+
+
+class Exporter:
+    """Base class of the exporters. A subclass implements render_question, and may
+    implement header and footer; export yields the rendered output piece by piece,
+    never more than one question at a time.
+    """
+
+    name = ""
+    extension = ""
+
+    def header(self) -> str:
+        return ""
+
+    def footer(self) -> str:
+        return ""
+
+    def render_question(self, number: int, q: Question) -> str:
+        raise NotImplementedError
+
+    def export(self, questions: Iterable[Question]) -> Iterator[str]:
+        header = self.header()
+        if header:
+            yield header
+        for number, q in enumerate(questions, start=1):
+            yield self.render_question(number, q)
+        footer = self.footer()
+        if footer:
+            yield footer
+
+    @staticmethod
+    def title(number: int, q: Question) -> str:
+        return f"{q.source} {q.year} #{number}"
+
+    @staticmethod
+    def text(q: Question) -> str:
+        # the lines of a LaTeX paragraph are wrapped, not broken
+        return SPACE.join(q.texts)
+
+    @staticmethod
+    def explanation(q: Question) -> str:
+        return SPACE.join(q.explanations)
+
+
+EXPORTERS = {}
+
+
+def register(cls: Type[Exporter]) -> Type[Exporter]:
+    """Class decorator that makes an exporter available by its name.
+    """
+    if cls.name in EXPORTERS:
+        raise ValueError(f"{cls.name} is already registered.")
+    EXPORTERS[cls.name] = cls
+    return cls
+
+
+def get_exporter(name: str) -> Exporter:
+    try:
+        return EXPORTERS[name]()
+    except KeyError:
+        valid = COMMA.join(sorted(EXPORTERS))
+        raise ValueError(f"{repr(name)} is not an export format ({valid}).") from None
+
+
+def exporter_for(filename: str) -> Exporter:
+    """Picks the exporter by the extension of filename.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    for cls in EXPORTERS.values():
+        if cls.extension == ext:
+            return cls()
+    raise ValueError(f"there is no exporter for {repr(ext)} files.")
+
+
+@register
+class JSONLinesExporter(Exporter):
+    """One JSON object per line and per question.
+    """
+
+    name = "jsonl"
+    extension = ".jsonl"
+
+    @staticmethod
+    def record(number: int, q: Question) -> dict:
+        return {
+            "number": number,
+            "source": q.source,
+            "year": q.year,
+            "type": q.question_type,
+            "histories": q.histories,
+            "tags": q.tags,
+            "texts": q.texts,
+            "choices": q.choices,
+            "answer": q.answer,
+            "explanations": q.explanations,
+        }
+
+    def render_question(self, number: int, q: Question) -> str:
+        return json.dumps(self.record(number, q), ensure_ascii=False) + "\n"
+
+
+@register
+class CSVExporter(Exporter):
+    """One row per question, followed by one row per choice; the record column tells
+    them apart, and the number column ties the choices to their question.
+    """
+
+    name = "csv"
+    extension = ".csv"
+    QUESTION = "question"
+    CHOICE = "choice"
+    COLUMNS = (
+        "record",
+        "number",
+        "source",
+        "year",
+        "type",
+        "histories",
+        "tags",
+        "text",
+        "choice",
+        "correct",
+        "explanation",
+    )
+
+    def __init__(self) -> None:
+        # the csv module writes to files; this one is emptied after every question
+        self.buffer = io.StringIO()
+        # write_atomically translates line breaks itself
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+
+    def flush(self) -> str:
+        rendered = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return rendered
+
+    def header(self) -> str:
+        self.writer.writerow(self.COLUMNS)
+        return self.flush()
+
+    def render_question(self, number: int, q: Question) -> str:
+        self.writer.writerow(
+            (
+                self.QUESTION,
+                number,
+                q.source,
+                q.year,
+                q.question_type,
+                "; ".join([h.strip() for h in q.histories]),
+                "; ".join(q.tags),
+                self.text(q),
+                "",
+                "",
+                self.explanation(q),
+            )
+        )
+        for choice in q.choices:
+            correct = int(choice == q.answer)
+            self.writer.writerow(
+                (self.CHOICE, number, "", "", "", "", "", "", choice, correct, "")
+            )
+        return self.flush()
+
+
+@register
+class MoodleXMLExporter(Exporter):
+    """Moodle's XML question format: choices questions become multichoice questions,
+    and written ones, essays.
+    https://docs.moodle.org/en/Moodle_XML_format
+    """
+
+    name = "moodle"
+    extension = ".xml"
+    INDENT = "  "
+
+    def header(self) -> str:
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<quiz>\n'
+
+    def footer(self) -> str:
+        return "</quiz>\n"
+
+    @staticmethod
+    def html(text: str) -> str:
+        # HTML inside XML: escaped once as HTML and once as XML
+        return escape(f"<p>{escape(text)}</p>")
+
+    def render_question(self, number: int, q: Question) -> str:
+        i = self.INDENT
+        if q.question_type == Question.CHOICES_TYPE:
+            kind = "multichoice"
+        else:
+            kind = "essay"
+        lines = [
+            f"{i}<question type={quoteattr(kind)}>",
+            f"{i * 2}<name><text>{escape(self.title(number, q))}</text></name>",
+            f'{i * 2}<questiontext format="html">'
+            f"<text>{self.html(self.text(q))}</text></questiontext>",
+            f'{i * 2}<generalfeedback format="html">'
+            f"<text>{self.html(self.explanation(q))}</text></generalfeedback>",
+        ]
+        if kind == "multichoice":
+            lines.append(f"{i * 2}<single>true</single>")
+            lines.append(f"{i * 2}<shuffleanswers>true</shuffleanswers>")
+            lines.append(f"{i * 2}<answernumbering>abc</answernumbering>")
+            for choice in q.choices:
+                fraction = 100 if choice == q.answer else 0
+                lines.append(
+                    f'{i * 2}<answer fraction="{fraction}" format="html">'
+                    f"<text>{self.html(choice)}</text></answer>"
+                )
+        if q.tags:
+            lines.append(f"{i * 2}<tags>")
+            for tag in q.tags:
+                lines.append(f"{i * 3}<tag><text>{escape(tag)}</text></tag>")
+            lines.append(f"{i * 2}</tags>")
+        lines.append(f"{i}</question>")
+        return "\n".join(lines) + "\n"
+
+
+@register
+class GIFTExporter(Exporter):
+    """Moodle's GIFT plain text format.
+    https://docs.moodle.org/en/GIFT_format
+    """
+
+    name = "gift"
+    extension = ".gift"
+    # these characters have to be escaped with a backslash
+    special = re.compile(r"([~=#{}:\\])")
+
+    def quote(self, text: str) -> str:
+        return self.special.sub(r"\\\1", text)
+
+    def render_question(self, number: int, q: Question) -> str:
+        lines = [f"// {q.source} {q.year}"]
+        for tag in q.tags:
+            lines.append(f"// [tag:{tag}]")
+        title = self.quote(self.title(number, q))
+        lines.append(f"::{title}::{self.quote(self.text(q))} {{")
+        if q.question_type == Question.CHOICES_TYPE:
+            for choice in q.choices:
+                mark = "=" if choice == q.answer else "~"
+                lines.append(f"{mark}{self.quote(choice)}")
+        explanation = self.explanation(q)
+        if explanation:
+            lines.append(f"####{self.quote(explanation)}")
+        lines.append("}")
+        return "\n".join(lines) + "\n\n"
+
+
+def export_bank(
+    filename: str,
+    output: str,
+    exporter: Optional[Exporter] = None,
+    configs: Optional[Configuration] = None,
+) -> Iterator[int]:
+    """Streams the questions of filename into output, yielding the number of characters
+    written so far; by default, the exporter is picked by the extension of output, and
+    the configs by the dialect of filename.
+    """
+    exporter = exporter or exporter_for(output)
+    questions = Parser(quiet=True).parse_file(filename, configs)
+    yield from write_atomically(output, exporter.export(questions))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.exporters", description="Exports a bank to another format."
+    )
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--format", choices=sorted(EXPORTERS))
+    arg_parser.add_argument(
+        "--output", help="by default, filename with the format's extension"
+    )
+    args = arg_parser.parse_args(argv)
+    if args.format:
+        exporter = get_exporter(args.format)
+    elif args.output:
+        exporter = exporter_for(args.output)
+    else:
+        arg_parser.error("either --format or --output is required")
+    output = args.output or os.path.splitext(args.filename)[0] + exporter.extension
+    written = 0
+    for written in export_bank(args.filename, output, exporter):
+        pass
+    print(f"> Wrote {output} ({written} characters).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
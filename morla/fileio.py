@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+# sys is already loaded by tkinter; use tk.sys instead
+import codecs
+import io
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+from tkinter import re, sys
+
+from morla.utils import *
+
+
+# bytes read or written at a time
+CHUNK_SIZE = 64 * 1024
+# bytes examined to guess an encoding
+SNIFF_SIZE = 64 * 1024
+
+CP1252 = "cp1252"
+LATIN1 = "latin-1"
+# the UTF-32 BOMs start like the UTF-16 ones, so they must be tried first
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+UTF8_MULTIBYTE = re.compile(
+    rb"[\xc2-\xdf][\x80-\xbf]|[\xe0-\xef][\x80-\xbf]{2}|[\xf0-\xf4][\x80-\xbf]{3}"
+)
+
+# the GUI's handlers are thread-safe, so background threads log instead of printing
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTask(threading.Thread):
+    """Runs a generator function (or any function that returns an iterable) in a daemon
+    thread and queues whatever it yields, so that the Tk thread can consume the results
+    with after() polling.
+    The queue is bounded: a producer faster than the GUI simply waits, which keeps the
+    memory in use bounded as well.
+    """
+
+    def __init__(self, f: Callable, *args, maxsize: int = 64, **kwargs) -> None:
+        super(BackgroundTask, self).__init__(daemon=True)
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.cancelled = threading.Event()
+        self.finished = False
+        self.error = None
+        self.start()
+
+    def run(self) -> None:
+        items = None
+        try:
+            items = self.f(*self.args, **self.kwargs)
+            # a plain function that returns nothing has nothing to queue
+            for item in items or ():
+                while not self.cancelled.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                    except queue.Full:
+                        continue
+                    else:
+                        break
+                if self.cancelled.is_set():
+                    break
+        except Exception as e:
+            logger.error(f"{self.f.__name__} failed: {e}")
+            self.error = e
+        finally:
+            # closing the generator lets it clean up if it was cancelled midway; poll_task
+            # waits for finished, so it's set whatever happens
+            try:
+                close = getattr(items, "close", None)
+                if close is not None:
+                    close()
+            finally:
+                self.finished = True
+
+    def take(self, n: int) -> List[Any]:
+        """Returns up to n of the queued items, without blocking.
+        """
+        items = []
+        while len(items) < n:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    @property
+    def done(self) -> bool:
+        return self.finished and self.queue.empty()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+
+def sniff_encoding(prefix: bytes) -> str:
+    """Guesses the encoding of a file from its first bytes: a BOM settles it; otherwise
+    UTF-8 is tried, and if it fails (and there are no valid UTF-8 multibyte characters
+    either) the file is taken as CP1252 (when it uses the bytes 0x80-0x9F, where CP1252
+    has quotes and dashes and Latin-1 has only control characters) or Latin-1.
+    """
+    for bom, encoding in BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # final=False: the prefix may end in the middle of a character
+        codecs.getincrementaldecoder(UTF8)().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        pass
+    else:
+        return UTF8
+    # legacy text practically never contains valid UTF-8 multibyte sequences, so any
+    # of them means UTF-8 with a few legacy lines, which FallbackDecoder can handle
+    if UTF8_MULTIBYTE.search(prefix):
+        return UTF8
+    if re.search(rb"[\x80-\x9f]", prefix):
+        return CP1252
+    return LATIN1
+
+
+class FallbackDecoder:
+    """An incremental UTF-8 decoder that decodes a line with fallback (from the first
+    byte that isn't UTF-8 to the end of the line) instead of failing, and goes back to
+    UTF-8 right after it. This handles banks pasted together from UTF-8 and legacy
+    files without rereading anything.
+    """
+
+    def __init__(self, encoding: str = UTF8, fallback: str = CP1252) -> None:
+        self.encoding = encoding
+        self.fallback = fallback
+        # bytes of a character split between two chunks
+        self.buffer = b""
+        # how many times the fallback has been used
+        self.fallbacks = 0
+
+    def decode(self, input: bytes, final: bool = False) -> str:
+        data = self.buffer + bytes(input)
+        self.buffer = b""
+        decoded = []
+        while data:
+            try:
+                decoded.append(data.decode(self.encoding))
+                break
+            except UnicodeDecodeError as e:
+                decoded.append(data[: e.start].decode(self.encoding))
+                if not final and e.reason == "unexpected end of data":
+                    self.buffer = data[e.start :]
+                    break
+                end = data.find(b"\n", e.start)
+                if end == -1:
+                    end = len(data)
+                decoded.append(data[e.start : end].decode(self.fallback, "replace"))
+                self.fallbacks += 1
+                data = data[end:]
+        return "".join(decoded)
+
+    def getstate(self) -> Tuple[bytes, int]:
+        return self.buffer, 0
+
+    def setstate(self, state: Tuple[bytes, int]) -> None:
+        self.buffer = state[0]
+
+    def reset(self) -> None:
+        self.buffer = b""
+
+
+def read_chunks(
+    filename: str, encoding: Optional[str] = None, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[int, str]]:
+    """Reads filename chunk_size bytes at a time and yields (bytes read so far, decoded
+    text) pairs. Line breaks are translated to "\\n", even across chunk boundaries.
+    If no encoding is given, it is sniffed from the first chunk (which is at least
+    SNIFF_SIZE bytes long). UTF-8 lines that fail to decode are decoded as CP1252
+    instead; in other encodings, undecodable bytes are replaced.
+    """
+    done = 0
+    with open(filename, "rb") as f:
+        data = f.read(max(chunk_size, SNIFF_SIZE))
+        if encoding is None:
+            encoding = sniff_encoding(data)
+            logger.info(f"{filename} seems to be {encoding}")
+        if codecs.lookup(encoding).name == UTF8:
+            decoder = FallbackDecoder(encoding)
+        else:
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        newlines = io.IncrementalNewlineDecoder(decoder, translate=True)
+        while True:
+            final = not data
+            text = newlines.decode(data, final=final)
+            done += len(data)
+            if text:
+                yield done, text
+            if final:
+                break
+            data = f.read(chunk_size)
+    if getattr(decoder, "fallbacks", 0):
+        logger.warning(
+            f"{filename}: {decoder.fallbacks} line(s) weren't {encoding}; "
+            f"they were decoded as {decoder.fallback}"
+        )
+
+
+def read_lines(filename: str, encoding: Optional[str] = None) -> Iterator[str]:
+    """Yields the lines of filename, without line breaks, as they are decoded.
+    """
+    tail = ""
+    for _, text in read_chunks(filename, encoding):
+        lines = (tail + text).split("\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def write_atomically(
+    filename: str,
+    content: Union[str, Iterable[str]],
+    encoding: str = UTF8,
+    chunk_size: int = CHUNK_SIZE,
+    durable: bool = True,
+) -> Iterator[int]:
+    """Writes content (a str, or an iterable of str to be streamed) to a temporary file
+    next to filename, chunk_size characters at a time, yielding how many have been
+    written so far; then it renames the temporary file to filename, so that filename is
+    never left half-written. Unless durable, the temporary file isn't fsynced first,
+    which suits files that are rewritten all the time and cheap to lose.
+    """
+    if isinstance(content, str):
+        content = [
+            content[start : start + chunk_size]
+            for start in range(0, len(content), chunk_size)
+        ]
+    filename = os.path.abspath(filename)
+    directory, basename = os.path.split(filename)
+    fd, temp_name = tempfile.mkstemp(
+        prefix=f".{basename}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with open(fd, "w", encoding=encoding) as temp_file:
+            written = 0
+            for chunk in content:
+                temp_file.write(chunk)
+                written += len(chunk)
+                yield written
+            if durable:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_name)
+        else:
+            # mkstemp creates files readable by their owner only
+            os.chmod(temp_name, 0o644)
+        os.replace(temp_name, filename)
+    except BaseException:
+        try:
+            os.remove(temp_name)
+        except OSError:
+            pass
+        raise
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
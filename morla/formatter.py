@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Formats (renders back to LaTeX) large banks with a pool of processes:
+    python3 -m morla.formatter bank.tex --output formatted.tex --workers 8
+The questions are sent to the workers in batches, and the rendered batches are put
+back in their original order by a reorder buffer before being written.
+"""
+
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import argparse
+import itertools
+import os
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Parser, Question, render_question
+from morla.configuration import Configuration
+from morla.fileio import write_atomically
+from morla import metrics
+
+
+# what a worker needs to render a question, without the Question around it
+Packed = Tuple[int, str, List[str], List[str], str, List[str]]
+
+SEPARATOR = EOL * 2
+
+
+def pack(batch: Sequence[Question]) -> Tuple[List[Configuration], List[Packed]]:
+    """Turns a batch into plain values; each distinct Configuration is sent once per
+    batch, not once per question, which makes the batch several times cheaper to
+    pickle.
+    """
+    configs = []
+    indexes = {}
+    packed = []
+    for q in batch:
+        key = tuple(q.configs.items())
+        if key not in indexes:
+            indexes[key] = len(configs)
+            configs.append(q.configs)
+        packed.append(
+            (
+                indexes[key],
+                q.question_type,
+                q.texts,
+                q.choices,
+                q.answer,
+                q.explanations,
+            )
+        )
+    return configs, packed
+
+
+def render_batch(
+    configs: List[Configuration], packed: List[Packed], separator: str = SEPARATOR
+) -> Tuple[str, int]:
+    """Renders a packed batch into a single str (runs in the workers). Returns it and
+    how many questions it has.
+    """
+    rendered = [
+        render_question(configs[i], question_type, texts, choices, answer, explanations)
+        for i, question_type, texts, choices, answer, explanations in packed
+    ]
+    return separator.join(rendered), len(rendered)
+
+
+def batches(questions: Iterable[Question], size: int) -> Iterator[List[Question]]:
+    questions = iter(questions)
+    while True:
+        batch = list(itertools.islice(questions, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ParallelFormatter:
+    """Renders a stream of questions into a stream of str, batch_size questions per
+    str, with workers processes; joined, the output is the same as
+    Parser.pretty_print's. At most max_pending batches are being rendered or waiting
+    in the reorder buffer at any time, so the memory in use stays bounded however big
+    the bank is.
+    Rendering is pure Python, and holds the GIL, so threads wouldn't help; with a
+    single worker, the batches are simply rendered in this process.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        batch_size: int = 1000,
+        max_pending: Optional[int] = None,
+        separator: str = SEPARATOR,
+    ) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_pending = max_pending or 4 * self.workers
+        self.separator = separator
+
+    def count(self, rendered: str, n: int) -> None:
+        metrics.QUESTIONS_FORMATTED.inc(n)
+        metrics.BYTES_OUT.inc(len(rendered.encode(UTF8)))
+
+    def format(self, questions: Iterable[Question]) -> Iterator[str]:
+        if self.workers == 1:
+            yield from self.format_serially(questions)
+            return
+        to_render = enumerate(batches(questions, self.batch_size))
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # future: index of its batch
+            pending = {}
+            # the reorder buffer; index of the batch: (rendered, number of questions)
+            done = {}
+            next_index = 0
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) + len(done) < self.max_pending:
+                    item = next(to_render, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    index, batch = item
+                    future = pool.submit(render_batch, *pack(batch), self.separator)
+                    pending[future] = index
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[pending.pop(future)] = future.result()
+                # flush every batch that is next in line
+                while next_index in done:
+                    rendered, n = done.pop(next_index)
+                    self.count(rendered, n)
+                    yield self.separator + rendered if next_index else rendered
+                    next_index += 1
+
+    def format_serially(self, questions: Iterable[Question]) -> Iterator[str]:
+        for index, batch in enumerate(batches(questions, self.batch_size)):
+            rendered, n = render_batch(*pack(batch), self.separator)
+            self.count(rendered, n)
+            yield self.separator + rendered if index else rendered
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.formatter", description="Formats a bank with many processes."
+    )
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--output", required=True)
+    arg_parser.add_argument("--workers", type=int)
+    arg_parser.add_argument("--batch-size", type=int, default=1000)
+    args = arg_parser.parse_args(argv)
+    if os.path.abspath(args.output) == os.path.abspath(args.filename):
+        arg_parser.error("the output can't be the input")
+    formatter = ParallelFormatter(args.workers, args.batch_size)
+    written = 0
+    questions = Parser(quiet=True).parse_file(args.filename)
+    for written in write_atomically(args.output, formatter.format(questions)):
+        pass
+    print(f"> Wrote {args.output} ({written} characters).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
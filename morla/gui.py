@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from typing import Callable, Iterable, List, Union  # , TypeVar
+from typing import Any, Callable, Iterable, List, Sequence, Union  # , TypeVar
 
 # sys is already loaded by tkinter; use tk.sys instead
 # import base64
@@ -142,6 +142,39 @@ class CustomToplevel(tk.Toplevel):
         self.destroy()
 
 
+class TableView(tk.Frame):
+    """A read-only grid of values, in a ttk.Treeview with both scrollbars; the first
+    column holds the names of the rows.
+    """
+
+    def __init__(
+        self,
+        master,
+        name: str,
+        rows: Sequence[str],
+        columns: Sequence[str],
+        values: Sequence[Sequence[Any]],
+        column_width: int = 80,
+    ) -> None:
+        super(TableView, self).__init__(master)
+        ids = [f"column{i}" for i in range(len(columns))]
+        self.tree = ttk.Treeview(self, columns=ids, selectmode="browse")
+        self.tree.heading("#0", text=name, anchor=W)
+        for column_id, column in zip(ids, columns):
+            self.tree.heading(column_id, text=column)
+            self.tree.column(column_id, width=column_width, anchor=E, stretch=False)
+        for row, row_values in zip(rows, values):
+            self.tree.insert("", tk.END, text=row, values=list(row_values))
+        yscroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        xscroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
+        self.tree.grid(row=0, column=0, sticky=(N, S, E, W))
+        yscroll.grid(row=0, column=1, sticky=(N, S))
+        xscroll.grid(row=1, column=0, sticky=(E, W))
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+
 def zoom(widget: tk.Tk, value: Optional[bool] = None) -> bool:
     if value in (True, False):
         widget.wm_attributes("-zoomed", value)
@@ -292,15 +325,16 @@ def typeset_Text(content: str, Text: tk.Text, mode: str = "w") -> str:
     mode = mode.lower()
     if mode not in "aw":
         raise ValueError(f"{mode} should be either w(rite) (default) or a(ppend).")
-    size = len(Text.get("1.0", tk.END))
-    if mode == "w" or size > 1500:
+    # count the characters instead of copying them all out of the widget
+    size = Text.count("1.0", tk.END, "chars") if mode == "a" else None
+    if mode == "w" or (size and size[0] > 1500):
         clear_text(Text)
         # Text.insert(tk.END, "--cleared--")
         print(f"> {Text} cleared")
     if not content.endswith(EOL):
         content += EOL
     Text.insert(tk.END, content)
-    return Text.get("1.0", tk.END)
+    return content
 
 
 if __name__ == "__main__":
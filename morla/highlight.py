@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Syntax highlighting for the input: source headers, exercise and choices markers,
+choices and answer blocks are tagged in the tk.Text as the user types and scrolls.
+Highlighting is incremental, so its cost doesn't depend on the size of the bank.
+"""
+
+from typing import Optional, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from collections import OrderedDict
+
+from tkinter import sys
+import tkinter as tk
+
+from morla.utils import *
+from morla.configuration import Configuration
+from morla.tokenizer import COMMENT, TEXT, Tokenizer
+
+
+# tag: options of tk.Text.tag_configure
+TAG_STYLES = {
+    "header": {"foreground": "#1f5fbf"},
+    "comment": {"foreground": "#808080"},
+    "exercise": {"foreground": "#a0307f"},
+    "choice": {"foreground": "#6b4f00"},
+    "correct": {"foreground": "#11771f", "background": "#e4f7e4"},
+    "answer": {"foreground": "#555555", "background": "#f2f2f2"},
+}
+TAG_KINDS = {
+    "BEGIN_QUESTION": "exercise",
+    "END_QUESTION": "exercise",
+    "BEGIN_CHOICES": "exercise",
+    "END_CHOICES": "exercise",
+    "CHOICE": "choice",
+    "CORRECT": "correct",
+    "BEGIN_ANSWER": "answer",
+    "END_ANSWER": "answer",
+}
+# how far above the screen an answer block may start
+CONTEXT_LINES = 1000
+
+# (tag, first column, last column)
+Span = Tuple[str, int, int]
+
+
+class LineHighlighter:
+    """Finds the tags of a line, given whether it's inside an answer block (the only
+    context that highlighting needs). The spans of each (line, context) are kept in a
+    bounded LRU cache, so a line that is typed, scrolled past or repeated in the bank is
+    only tokenized once.
+    """
+
+    def __init__(
+        self, configs: Optional[Configuration] = None, cache_size: int = 4096
+    ) -> None:
+        self.cache_size = cache_size
+        self.set_configs(configs)
+
+    def set_configs(self, configs: Optional[Configuration]) -> None:
+        self.configs = Configuration(configs)
+        self.tokenizer = Tokenizer.for_configs(self.configs)
+        self.cache = OrderedDict()
+
+    def spans(self, line: str, in_answer: bool) -> Tuple[Tuple[Span, ...], bool]:
+        """Returns the spans of line and whether the line after it is in an answer.
+        """
+        key = (line, in_answer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            return cached
+        spans = []
+        for token in self.tokenizer.tokenize(line):
+            if token.kind == COMMENT:
+                usage = token.value.startswith((self.configs.USO, self.configs.TAGS))
+                tag = "comment" if usage or in_answer else "header"
+            elif token.kind == TEXT:
+                if not in_answer:
+                    continue
+                tag = "answer"
+            else:
+                tag = TAG_KINDS[token.kind]
+                if token.kind == "BEGIN_ANSWER":
+                    in_answer = True
+                elif token.kind == "END_ANSWER":
+                    in_answer = False
+            spans.append((tag, token.start, token.end))
+        result = (tuple(spans), in_answer)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+
+class Highlighter:
+    """Highlights a tk.Text. Every edit or scroll schedules a pass, delay ms later
+    (postponed by further edits), that re-tags the lines on screen and the line of the
+    cursor; a line whose content and context haven't changed since it was last tagged
+    is skipped, so typing within a line re-tags just that line (adding or deleting
+    lines re-tags the screen). Lines changed off screen, like the ones of a loaded file,
+    are tagged once they are scrolled into view.
+    """
+
+    def __init__(self, configs: Optional[Configuration] = None, delay: int = 80) -> None:
+        self.lines = LineHighlighter(configs)
+        self.delay = delay
+        self.text = None
+        self.scroll_command = None
+        self.scheduled = None
+        # line number: (hash of its content, whether it's in an answer), as tagged
+        self.tagged = {}
+        # lines in the text when it was last tagged
+        self.line_count = 0
+
+    def attach(self, text: tk.Text) -> None:
+        self.text = text
+        for tag, style in TAG_STYLES.items():
+            text.tag_configure(tag, **style)
+        # selections are drawn on top of the highlighting
+        text.tag_raise(tk.SEL)
+        # scrolling is noticed by chaining the scrollbar's command
+        self.scroll_command = text.cget("yscrollcommand")
+        text.configure(yscrollcommand=self.on_scroll)
+        text.bind("<<Modified>>", self.schedule, add="+")
+        text.bind("<Configure>", self.schedule, add="+")
+
+    def set_configs(self, configs: Configuration) -> None:
+        self.lines.set_configs(configs)
+        self.tagged.clear()
+        self.schedule()
+
+    def on_scroll(self, lo: str, hi: str) -> None:
+        if self.scroll_command:
+            self.text.tk.call(*self.text.tk.splitlist(self.scroll_command), lo, hi)
+        self.schedule()
+
+    def schedule(self, event=None) -> None:
+        if self.text is None:
+            return
+        if self.scheduled is not None:
+            self.text.after_cancel(self.scheduled)
+        self.scheduled = self.text.after(self.delay, self.refresh)
+
+    def line_of(self, index: str) -> int:
+        return int(self.text.index(index).split(".")[0])
+
+    def in_answer(self, line: int) -> bool:
+        """Whether line starts inside an answer block, found by searching (in Tk's C
+        code) for the closest answer marker above it.
+        """
+        stop = f"{max(1, line - CONTEXT_LINES)}.0"
+        index = f"{line}.0"
+        begin = self.text.search(
+            self.lines.configs.BEGIN_ANSWER, index, backwards=True, stopindex=stop
+        )
+        if not begin:
+            return False
+        end = self.text.search(
+            self.lines.configs.END_ANSWER, index, backwards=True, stopindex=begin
+        )
+        return not end
+
+    def refresh(self) -> None:
+        self.scheduled = None
+        text = self.text
+        first = self.line_of("@0,0")
+        last = self.line_of(f"@0,{text.winfo_height()}")
+        regions = [(first, last)]
+        cursor = self.line_of(tk.INSERT)
+        if not first <= cursor <= last:
+            regions.append((cursor, cursor))
+        # lines were added or deleted, so the numbers of the tagged lines may be off
+        line_count = self.line_of(tk.END)
+        if line_count != self.line_count:
+            self.tagged.clear()
+            self.line_count = line_count
+        for start, stop in regions:
+            self.tag_region(start, stop)
+
+    def tag_region(self, start: int, stop: int) -> None:
+        text = self.text
+        content = text.get(f"{start}.0", f"{stop}.end")
+        in_answer = self.in_answer(start)
+        for number, line in enumerate(content.split("\n"), start):
+            key = (hash(line), in_answer)
+            spans, after = self.lines.spans(line, in_answer)
+            if self.tagged.get(number) != key:
+                for tag in TAG_STYLES:
+                    text.tag_remove(tag, f"{number}.0", f"{number}.end")
+                for tag, begin, end in spans:
+                    text.tag_add(tag, f"{number}.{begin}", f"{number}.{end}")
+                self.tagged[number] = key
+            in_answer = after
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Lazy parsing, for banks too big to hold in memory: a LazySource maps the bank with
+mmap and scans it once, keeping only the metadata of each question (source, year, type,
+answer, histories and tags) and where its body is in the file:
+    python3 -m morla.lazy bank.tex --tag calculo --source UFRJ
+The texts, choices, wrongs and explanations of a LazyQuestion are decoded the first time
+they are read, and the most recently read bodies are kept in a bounded LRU cache, so
+indexing and filtering a huge bank never brings its bodies into memory.
+"""
+
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+# sys is already loaded by tkinter; use tk.sys instead
+from collections import Counter, OrderedDict
+import argparse
+import codecs
+import mmap
+import os
+import threading
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Parser, ParsingException, Question
+from morla.configuration import Configuration
+from morla.dialects import SAMPLE_SIZE, detect
+from morla.fileio import SNIFF_SIZE, FallbackDecoder, sniff_encoding
+from morla.tokenizer import COMMENT, INLINE, TEXT, Tokenizer, line_number
+from morla import metrics
+
+
+# bodies kept in memory by default
+CACHE_SIZE = 256
+# the offsets of the markers are found in the raw bytes, which only works with
+# encodings in which the markers are ASCII
+WIDE_ENCODINGS = ("utf-16", "utf-32")
+
+Body = Dict[str, List[str]]
+
+
+def body_field(name: str) -> property:
+    """A list of the body of a LazyQuestion, decoded when it's read. Assigning to it
+    pins the new value to the question; the lists that are read, on the other hand,
+    belong to the cache, and changes made to them are lost when they are evicted.
+    """
+
+    def get(self: "LazyQuestion") -> List[str]:
+        if name in self.overrides:
+            return self.overrides[name]
+        return self.document.body(self.start, self.end)[name]
+
+    def set(self: "LazyQuestion", value: List[str]) -> None:
+        self.__dict__.setdefault("overrides", {})[name] = value
+
+    return property(get, set)
+
+
+class LazyQuestion(Question):
+    """A Question whose body lives in a LazySource until it's needed.
+    """
+
+    texts = body_field("texts")
+    choices = body_field("choices")
+    wrongs = body_field("wrongs")
+    explanations = body_field("explanations")
+
+    def __init__(
+        self,
+        source: str,
+        year: str,
+        question_type: str,
+        answer: str,
+        histories: list,
+        tags: list,
+        document: "LazySource",
+        start: int,
+        end: int,
+        configs: Optional[Union[dict, Configuration]] = None,
+    ) -> None:
+        # the empty bodies only go through Question's checks, and are thrown away
+        super().__init__(
+            source, year, question_type, answer, histories, tags, [], [], [], [], configs
+        )
+        self.overrides = {}
+        self.document = document
+        # where the question is in the bytes of document
+        self.start = start
+        self.end = end
+
+    @property
+    def materialized(self) -> bool:
+        return self.document.is_cached(self.start, self.end)
+
+    def materialize(self) -> Question:
+        """A plain Question, with the body in it.
+        """
+        return Question(
+            self.source,
+            self.year,
+            self.question_type,
+            self.answer,
+            self.histories[:],
+            self.tags[:],
+            self.texts[:],
+            self.choices[:],
+            self.wrongs[:],
+            self.explanations[:],
+            configs=self.configs,
+        )
+
+
+class LazySource:
+    """A bank mapped into memory. Iterating over it scans the bank for the metadata of
+    its questions, with the markers alone (the lines of text are skipped by the C
+    engine); the bodies are parsed one question at a time, by body, when the questions
+    ask for them. Errors in the text of a question only show up then.
+    cache_size bounds how many bodies are kept (None keeps them all, 0 none). Without
+    configs, those of the dialect of the bank are used.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        configs: Optional[Union[dict, Configuration]] = None,
+        cache_size: Optional[int] = CACHE_SIZE,
+    ) -> None:
+        self.filename = filename
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # the GUI reads questions from background threads
+        self.lock = threading.Lock()
+        self.file = open(filename, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            self.buffer = b""
+        self.encoding = sniff_encoding(self.buffer[:SNIFF_SIZE])
+        if self.encoding in WIDE_ENCODINGS:
+            self.close()
+            raise ValueError(
+                f"{filename} is {self.encoding}; transcode it to UTF-8 first "
+                "(python3 -m morla.transcode)"
+            )
+        if configs is None:
+            detection = detect(self.decode(self.buffer[:SAMPLE_SIZE]))
+            configs = detection.configs if detection is not None else None
+        self.configs = Configuration(configs)
+
+    def __enter__(self) -> "LazySource":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self.lock:
+            self.cache.clear()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __iter__(self) -> Iterator[LazyQuestion]:
+        return self.questions()
+
+    def where(self, offset: int) -> int:
+        return self.buffer[:offset].count(b"\n") + 1
+
+    def questions(self) -> Iterator[LazyQuestion]:
+        """Scans the bank and yields its questions, with no body.
+        """
+        configs = self.configs
+        # Parser.check_options needs a Parser with the source of the question; a
+        # quiet one, since lazy banks are scanned from background threads
+        parser = Parser(quiet=True)
+        location = Parser.OUT
+        start = 0
+        for token in Tokenizer.for_configs(configs, binary=True).tokenize(
+            self.buffer, with_texts=False
+        ):
+            kind = token.kind
+            next_location = Parser.TRANSITIONS.get((location, kind))
+            if next_location is None:
+                raise ParsingException(
+                    f"unexpected {kind} on line {self.where(token.start)} ({location})"
+                )
+            if kind == COMMENT:
+                value = self.decode(token.value)
+                if location == Parser.OUT:
+                    tokens = value.split()
+                    if not tokens:
+                        continue
+                    parser.clear()
+                    start = token.start
+                    parser.source = SPACE.join(tokens[:-1])
+                    parser.year = tokens[-1]
+                elif value.startswith(configs.USO):
+                    value = delete(value, configs.USO)
+                    parser.histories.extend([t.strip() for t in value.split(",")])
+                elif value.startswith(configs.TAGS):
+                    value = delete(value, configs.TAGS)
+                    parser.tags.extend([t.strip() for t in value.split(",")])
+            elif kind == "BEGIN_QUESTION":
+                parser.check_options(self.decode(token.value), configs)
+            elif kind == "BEGIN_CHOICES":
+                parser.question_type = Question.CHOICES_TYPE
+            elif kind == "CORRECT":
+                parser.answer = self.decode(token.value)
+            elif kind == "END_QUESTION":
+                if not parser.question_type:
+                    parser.question_type = Question.WRITTEN_TYPE
+            elif kind == "END_ANSWER":
+                q = LazyQuestion(
+                    parser.source,
+                    parser.year,
+                    parser.question_type,
+                    parser.answer,
+                    parser.histories[:],
+                    parser.tags[:],
+                    self,
+                    start,
+                    token.end,
+                    configs=configs,
+                )
+                parser.clear()
+                metrics.QUESTIONS.inc(type=q.question_type)
+                location = next_location
+                yield q
+            location = next_location
+        metrics.BYTES_IN.inc(len(self.buffer))
+
+    def decode(self, data: bytes) -> str:
+        if codecs.lookup(self.encoding).name == UTF8:
+            return FallbackDecoder(self.encoding).decode(data, final=True)
+        return data.decode(self.encoding, "replace")
+
+    def is_cached(self, start: int, end: int) -> bool:
+        with self.lock:
+            return (start, end) in self.cache
+
+    def body(self, start: int, end: int) -> Body:
+        key = (start, end)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        body = self.parse_body(start, end)
+        if self.cache_size != 0:
+            with self.lock:
+                self.cache[key] = body
+                if self.cache_size is not None:
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        return body
+
+    def parse_body(self, start: int, end: int) -> Body:
+        """Parses the texts, choices and explanations of the question in
+        buffer[start:end]; its metadata was taken when the bank was scanned.
+        """
+        text = self.decode(self.buffer[start:end])
+        body = {"texts": [], "choices": [], "wrongs": [], "explanations": []}
+        answer = None
+        location = Parser.OUT
+        for token in Tokenizer.for_configs(self.configs).tokenize(text):
+            kind = token.kind
+            next_location = Parser.TRANSITIONS.get((location, kind))
+            if next_location is None:
+                where = self.where(start) + line_number(text, token.start) - 1
+                raise ParsingException(f"unexpected {kind} on line {where} ({location})")
+            if kind == TEXT:
+                if location == Parser.IN_QUESTION:
+                    body["texts"].append(token.value)
+                else:
+                    body["explanations"].append(token.value)
+            elif kind in INLINE:
+                body["choices"].append(token.value)
+                if kind == "CORRECT":
+                    answer = token.value
+            elif kind == "END_CHOICES":
+                body["wrongs"].extend(body["choices"])
+                if answer in body["wrongs"]:
+                    body["wrongs"].remove(answer)
+            location = next_location
+        return body
+
+
+def parse_lazily(
+    filename: str,
+    configs: Optional[Union[dict, Configuration]] = None,
+    cache_size: Optional[int] = CACHE_SIZE,
+) -> Iterator[LazyQuestion]:
+    """Yields the questions of filename, with their bodies left in the file (which
+    stays open, mapped, while any of them is alive).
+    """
+    yield from LazySource(filename, configs, cache_size)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.lazy",
+        description="Filters a bank by its metadata, without reading the questions.",
+    )
+    arg_parser.add_argument("filename")
+    arg_parser.add_argument("--tag")
+    arg_parser.add_argument("--source", help="a part of the source")
+    arg_parser.add_argument(
+        "--show", type=int, default=0, help="print the first SHOW matching questions"
+    )
+    args = arg_parser.parse_args(argv)
+    tags = Counter()
+    matching = 0
+    with LazySource(args.filename) as document:
+        for q in document:
+            if args.tag is not None and args.tag not in q.tags:
+                continue
+            if args.source is not None and args.source not in q.source:
+                continue
+            matching += 1
+            tags.update(q.tags)
+            if matching <= args.show:
+                print(q.render(), end=EOL * 2)
+    print(f"> {matching} question(s) match")
+    for tag, n in tags.most_common(10):
+        print(f">   {tag}: {n}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
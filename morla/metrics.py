@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Throughput metrics of the parser and the formatter.
+The registry can be dumped as JSON or as a Prometheus text file; from the command line:
+    python3 -m morla.metrics bank.tex other_bank.tex --format
+parses (and optionally formats) the given files and prints the metrics as JSON.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from bisect import bisect_left
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import math
+import threading
+
+from tkinter import sys
+
+from morla.utils import *
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        # one value per combination of labels
+        self.values = {}
+
+    @staticmethod
+    def key(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def format_labels(labels: Labels, extra: Labels = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        inner = ",".join([f'{k}="{v}"' for k, v in pairs])
+        return "{" + inner + "}"
+
+    def reset(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            values = [
+                {"labels": dict(labels), "value": value}
+                for labels, value in self.values.items()
+            ]
+        return {"type": self.TYPE, "help": self.help, "values": values}
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+    def to_prometheus(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def total(self) -> float:
+        with self.lock:
+            return sum(self.values.values())
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, math.inf)
+
+    def __init__(
+        self, name: str, help: str, buckets: Optional[Sequence[float]] = None
+    ) -> None:
+        super(Histogram, self).__init__(name, help)
+        self.buckets = tuple(buckets or self.BUCKETS)
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                # per-bucket counts (not cumulative), sum, count
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state = self.values[key]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def mean(self, **labels: str) -> float:
+        state = self.values.get(self.key(labels))
+        if not state or not state[2]:
+            return 0.0
+        return state[1] / state[2]
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            values = [
+                {
+                    "labels": dict(labels),
+                    "buckets": dict(zip(map(str, self.buckets), counts)),
+                    "sum": total,
+                    "count": count,
+                }
+                for labels, (counts, total, count) in self.values.items()
+            ]
+        return {"type": self.TYPE, "help": self.help, "values": values}
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        with self.lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else str(bound)
+                    samples.append(
+                        (f"{self.name}_bucket", labels + (("le", le),), cumulative)
+                    )
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"{metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: Optional[Sequence[float]] = None
+    ) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def reset(self) -> None:
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def as_dict(self) -> dict:
+        return {name: metric.as_dict() for name, metric in self.metrics.items()}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=4)
+
+    def to_prometheus(self) -> str:
+        blocks = [metric.to_prometheus() for metric in self.metrics.values()]
+        return "\n".join(blocks) + "\n"
+
+
+REGISTRY = Registry()
+LINES_READ = REGISTRY.counter("morla_lines_read_total", "Lines read by the parser.")
+BYTES_IN = REGISTRY.counter(
+    "morla_bytes_in_total", "UTF-8 bytes of the lines read by the parser."
+)
+QUESTIONS = REGISTRY.counter(
+    "morla_questions_total", "Questions emitted by the parser, by type."
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "morla_question_parse_seconds", "Time spent parsing each question."
+)
+QUESTIONS_FORMATTED = REGISTRY.counter(
+    "morla_questions_formatted_total", "Questions rendered by the formatter."
+)
+BYTES_OUT = REGISTRY.counter(
+    "morla_bytes_out_total", "UTF-8 bytes of the questions rendered by the formatter."
+)
+CACHE = REGISTRY.counter(
+    "morla_cache_requests_total", "Cache lookups, by cache and result (hit or miss)."
+)
+
+
+def status_line() -> str:
+    """A one-line summary of the metrics, for the GUI's status bar.
+    """
+    mib = 2 ** 20
+    per_type = COMMA.join(
+        [f"{dict(labels)['type']}: {int(n)}" for _, labels, n in QUESTIONS.samples()]
+    )
+    hits = sum([n for _, labels, n in CACHE.samples() if ("result", "hit") in labels])
+    return (
+        f"lines: {int(LINES_READ.total())} | questions: {per_type or 0} | "
+        f"parse: {PARSE_SECONDS.mean() * 1000:.3f} ms/question | "
+        f"in: {BYTES_IN.total() / mib:.2f} MiB | "
+        f"out: {BYTES_OUT.total() / mib:.2f} MiB | "
+        f"cache hits: {int(hits)}"
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    from morla.bulk import Parser
+    from morla.configuration import Configuration
+    from morla.fileio import read_lines
+    # when run with -m, this module is __main__, and the parser feeds morla.metrics
+    from morla.metrics import REGISTRY
+
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.metrics", description="Parses banks and prints morla's metrics."
+    )
+    arg_parser.add_argument("filenames", nargs="+")
+    arg_parser.add_argument(
+        "--format", action="store_true", help="format the questions too"
+    )
+    arg_parser.add_argument(
+        "--prometheus", help="also write the metrics to this Prometheus text file"
+    )
+    args = arg_parser.parse_args(argv)
+    configs = Configuration()
+    for filename in args.filenames:
+        lines = list(read_lines(filename))
+        parser = Parser()
+        # the parser is chatty
+        with redirect_stdout(io.StringIO()):
+            parser.read(lines, configs)
+            if args.format:
+                for _ in parser.iter_pretty():
+                    pass
+    print(REGISTRY.to_json())
+    if args.prometheus:
+        with open(args.prometheus, "w", encoding=UTF8) as prom:
+            prom.write(REGISTRY.to_prometheus())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@
 #import io
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG, NOTSET
 import logging
+import queue
 
 # import base64
 # from functools import partial, wraps
@@ -31,29 +32,88 @@ from morla import *  # SELETOR_NAME
 class TextHandler(logging.Handler):
     """This class allows you to log to a Tkinter Text or ScrolledText widget.
     https://beenje.github.io/blog/posts/logging-to-a-tkinter-scrolledtext-widget/
+    Records are queued by emit, which is safe to call from any thread, and drained by
+    the Tk thread every <interval> milliseconds with a single insert per batch. The
+    widget keeps at most <max_lines> lines, the oldest being trimmed from the top.
+    Once the widget is destroyed, records are dropped until attach gives a new one.
     """
 
-    def __init__(self, text: tk.Text):
+    def __init__(
+        self,
+        text: tk.Text,
+        interval: int = 100,
+        max_lines: int = 1000,
+        batch_size: int = 500,
+    ):
         # run the regular Handler __init__
         #logging.Handler.__init__(self)
         super(TextHandler, self).__init__()
         # store a reference to the Text it will log to
         self.text = text
+        self.interval = interval
+        self.max_lines = max_lines
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        # this is necessary because we can't modify the Text from other threads
+        self.scheduled = self.text.after(self.interval, self.drain)
+
+    def attach(self, text: tk.Text) -> None:
+        """Logs to text from now on, e.g. after the widgets were rebuilt.
+        """
+        if self.scheduled is not None:
+            text.after_cancel(self.scheduled)
+        self.text = text
+        self.scheduled = self.text.after(self.interval, self.drain)
 
     def emit(self, record):
-        msg = self.format(record)
+        if self.text is None:
+            # nowhere to show it; the other handlers still get it
+            return
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
         if not msg.endswith(EOL):
             msg += EOL
-
+        self.queue.put(msg)
+
+    def drain(self) -> None:
+        """Inserts every queued message (at most batch_size of them) at once, and
+        reschedules itself.
+        """
+        self.scheduled = None
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            if batch:
+                self.append("".join(batch))
+        except tk.TclError:
+            # the widget has been destroyed; stop queueing until attach
+            self.text = None
+            self.queue = queue.SimpleQueue()
+            return
+        # drain again right away if the queue couldn't be emptied in one batch
+        delay = 1 if len(batch) == self.batch_size else self.interval
+        self.scheduled = self.text.after(delay, self.drain)
+
+    def append(self, content: str) -> None:
         # why doesn't @keepTextDisabled work here?
-        def append():
-            self.text.configure(state = "normal")
-            self.text.insert(tk.END, msg)
-            self.text.configure(state = "disabled")
-            # autoscroll to the bottom
-            self.text.yview(tk.END)
-        # this is necessary because we can't modify the Text from other threads
-        self.text.after(0, append)
+        self.text.configure(state = "normal")
+        self.text.insert(tk.END, content)
+        # trim from the top, so the widget works as a ring buffer of lines
+        # the text always ends with an EOL, so "end-1c" is on an empty last line
+        lines = int(self.text.index("end-1c").split(".")[0]) - 1
+        excess = lines - self.max_lines
+        if excess > 0:
+            self.text.delete("1.0", f"{excess + 1}.0")
+        self.text.configure(state = "disabled")
+        # autoscroll to the bottom
+        self.text.yview(tk.END)
 
 
 def init_logger(filename: str, Text: tk.Text) -> logging.Logger:
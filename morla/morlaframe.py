@@ -6,9 +6,11 @@ from typing import Any, Callable, List, Iterable, Optional, Union, Tuple
 from os.path import abspath, expanduser, relpath
 import os
 
+import argparse
 import io
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG, NOTSET
 import logging
+import threading
 
 # import base64
 from functools import partial, wraps
@@ -26,11 +28,26 @@ import tkinter as tk
 
 from morla.utils import *
 from morla.configuration import Configuration
+from morla.dialects import PROFILES, detect_file
 from morla.preference import Preferences
-from morla.bulk import Parser
+from morla.autosave import Autosave
+from morla.bulk import Deduplicator, Parser
+from morla.fileio import BackgroundTask, read_chunks, write_atomically
+from morla.exporters import EXPORTERS, exporter_for
+from morla.store import ingest_questions
+from morla.watch import Bank, watch_bank
+from morla.build import BuildCache, BuildError, Builder, LatexCompiler, Job
+from morla.highlight import Highlighter
+from morla.diagnostics import Diagnostician
+from morla.browser import QuestionBrowser
+from morla.analytics import report_tables
+from morla.spill import MB
 from morla.gui import *
 from morla.tooltip import Tooltip
-from morla.morla_logging import init_logger
+from morla.viewer import VirtualText
+from morla.profiling import PROFILER, TIMERS, instrument
+from morla import metrics
+from morla.morla_logging import TextHandler, init_logger
 import morla
 
 
@@ -46,6 +63,14 @@ import morla
 TEXT_HEIGHT = 20
 TEXT_WIDTH = 40
 
+# background tasks are polled every POLL_INTERVAL ms, ITEMS_PER_POLL items at a time
+POLL_INTERVAL = 50
+ITEMS_PER_POLL = 4
+# the metrics file is rewritten at most once every METRICS_DELAY ms
+METRICS_DELAY = 1000
+# the dedupe preference that keeps duplicates
+KEEP = "keep"
+
 # fonts and cursors
 HEADER_FONT = ("Helvetica", "16", "bold")
 SANS_FONT = ("Helvetica", "12")
@@ -135,7 +160,7 @@ class MorlaFrame(tk.Frame):
                 break
         return self.ftypes
 
-    def __init__(self, cmdline_arg: Optional[str] = "") -> None:
+    def __init__(self, cmdline_arg: Optional[str] = "", profile: bool = False) -> None:
         master = tk.Tk()
         super(MorlaFrame, self).__init__(master)
         self.master = master
@@ -162,31 +187,41 @@ class MorlaFrame(tk.Frame):
         self.log(DEBUG, f"app dir: {self.app_dir}")
         self.log(DEBUG, f"full app dir: {self.full_app_dir}")
         # both home_dir and app_dir end with os.sep
-        # set a Preferences object
-        prefs_path = "preferences.ini"
-        with Cd(self.full_app_dir):
-            self.preferences = Preferences(os.getcwd())
-            if os.path.exists(prefs_path):
-                try:
-                    self.preferences.read(prefs_path)
-                except:
-                    self.log(CRITICAL, f"reading {prefs_path} failed!")
-                    raise
-                else:
-                    self.log(INFO, f"reading {prefs_path} succeeded!")
-                    with open(prefs_path, "r") as ini_file:
-                        content = ini_file.read().strip()
-                        self.log(INFO, EOL + content)
+        # set a Preferences object; its paths are absolute, so the working directory
+        # is never changed
+        self.preferences = Preferences(self.full_app_dir)
+        prefs_path = self.preferences.path()
+        if os.path.exists(prefs_path):
+            try:
+                self.preferences.load()
+            except:
+                self.log(CRITICAL, f"reading {prefs_path} failed!")
+                raise
             else:
-                self.preferences.save()
+                self.log(INFO, f"reading {prefs_path} succeeded!")
+                self.log(INFO, EOL + self.preferences.dumps().strip())
+        else:
+            self.preferences.save()
         # language
         with open(LANGUAGE_PATH, "r") as json_file:
             language_dict = json.load(json_file)
-        if are_subdicts_invalid(language_dict):
-            msg = f"reading {prefs_path} failed!"
+        outliers = keyset_outliers(language_dict)
+        if outliers:
+            problems = describe_outliers(outliers)
+            msg = f"invalid {LANGUAGE_PATH}: " + "; ".join(problems)
             self.log(CRITICAL, msg)
             raise MorlaError(msg)
         self.language_dict = language_dict
+        # the file being loaded in the background, if any
+        self.loading = None
+        # the pending rewrite of the metrics file, if any
+        self.metrics_scheduled = None
+        # the banks of the folder being watched, if any, kept up to date in the
+        # background
+        self.bank = None
+        self.watch_stop = None
+        # journal of the input edits, in case morla crashes
+        self.autosave = Autosave(self.full_app_dir)
         # menubars and widgets
         self.init_menubar()
         self.init_widgets()
@@ -194,6 +229,11 @@ class MorlaFrame(tk.Frame):
         log_path = os.path.join(self.full_app_dir, morla.SELETOR_NAME.lower() + ".log")
         self.logger = init_logger(log_path, self.log_text)
         self.log(DEBUG, f"log_path: {log_path}")
+        # profiling, if asked for in the command line or in the preferences
+        pstats_name = morla.SELETOR_NAME.lower() + ".pstats"
+        PROFILER.path = os.path.join(self.full_app_dir, pstats_name)
+        if profile or self.preferences.get_section().getboolean("profile"):
+            PROFILER.enable()
         # icon
         icon_path = ICON_PATH
         # with open(icon_path, "rb") as icon:
@@ -214,7 +254,9 @@ class MorlaFrame(tk.Frame):
         # create a default Configuration
         self.configs = Configuration()
         # create a parser
-        self.parser = Parser()
+        self.parser = Parser(self.memory_budget)
+        # the open QuestionBrowser, if any
+        self.browser = None
         # set a minimum size, allow resizing, and display everything
         # master.attributes("-fullscreen", True)
         master.resizable(True, True)  # (False, False)
@@ -232,6 +274,13 @@ class MorlaFrame(tk.Frame):
         # now master.geometry() returns valid size/placement
         master.minsize(master.winfo_width(), master.winfo_height())
         center(master)
+        # recover the input left by a crash, if any
+        if self.autosave.recoverable():
+            recover_autosave = self.get_string("recover_autosave")
+            if self.pop_yesno(recover_autosave, title=morla.SELETOR_NAME):
+                self.autosave.replay()
+            else:
+                self.autosave.discard()
         # load the file given as argument, if any
         if cmdline_arg:
             if not isinstance(cmdline_arg, str):
@@ -273,6 +322,10 @@ class MorlaFrame(tk.Frame):
             self.actually_quit()
 
     def actually_quit(self) -> None:
+        # quitting normally, so there's nothing to recover the next time
+        self.autosave.discard()
+        self.stop_watching()
+        self.diagnostician.close()
         logging.shutdown()
         # https://stackoverflow.com/a/36291907
         for h in self.logger.handlers:
@@ -303,6 +356,14 @@ class MorlaFrame(tk.Frame):
         fileMenu.add_command(label=open_word, command=self.on_open_file)
         save_word = self.get_string("save") + LDOTS
         fileMenu.add_command(label=save_word, command=self.on_save_file)
+        export_word = self.get_string("export") + LDOTS
+        fileMenu.add_command(label=export_word, command=self.on_export_file)
+        watch_word = self.get_string("watch_folder") + LDOTS
+        fileMenu.add_command(label=watch_word, command=self.on_watch_folder)
+        build_word = self.get_string("build_pdf") + LDOTS
+        fileMenu.add_command(label=build_word, command=self.on_build_pdf)
+        analytics_word = self.get_string("analytics") + LDOTS
+        fileMenu.add_command(label=analytics_word, command=self.on_analytics)
         quit_word = self.get_string("quit")
         fileMenu.add_command(label=quit_word, command=self.prompt_quit)
         # configs "button"
@@ -313,7 +374,9 @@ class MorlaFrame(tk.Frame):
         self.menubar.add_command(label=preferences_word, command=self.open_preferences)
         # Exercises "button"
         exercises_word = self.get_string("exercises")
-        self.menubar.add_command(label=exercises_word, command=lambda *a, **kw: None)
+        self.menubar.add_command(
+            label=exercises_word, command=self.open_exercises_window
+        )
         self.set_exercises_button(False)
         # menubar.entryconfig(exercises_word, state="disabled")
         # about "button"
@@ -364,13 +427,22 @@ class MorlaFrame(tk.Frame):
         self.input_text.grid(
             row=1, column=0, columnspan=2, sticky=(N, E, W), padx=BORDER, pady=BORDER
         )
+        self.autosave.attach(self.input_text)
+        # only the lines on screen (and the edited ones) are highlighted
+        self.highlighter = Highlighter()
+        self.highlighter.attach(self.input_text)
         # self.columnconfigure(0, weight=1)
         # output area
         # grid(1, 2-3)
-        self.output_text = ScrolledText(
-            self, height=TEXT_HEIGHT, width=TEXT_WIDTH, font=SANS_FONT
+        # the output is virtualized: only the lines on screen are kept in the widget
+        jump_word = self.get_string("jump_to_question")
+        self.output_text = VirtualText(
+            self,
+            jump_label=jump_word,
+            height=TEXT_HEIGHT,
+            width=TEXT_WIDTH,
+            font=SANS_FONT,
         )
-        self.output_text.configure(state=DISABLED)
         # self.output_text.bind('<Control-c>', copy_cmd)
         self.output_text.grid(
             row=1, column=2, columnspan=2, sticky=(N, E, W), padx=BORDER, pady=BORDER
@@ -401,7 +473,38 @@ class MorlaFrame(tk.Frame):
         )
         self.log_text.config(insertbackground="white", state=DISABLED)
         self.log_text.grid(row=0, sticky=(N, S, E, W), padx=BORDER, pady=BORDER)
+        # problems found in the input as it's edited
+        # grid(0, 1) of logRect
+        diagnostics_word = self.get_string("diagnostics")
+        self.diagnosticsRect = tk.LabelFrame(
+            self.logRect, text=diagnostics_word, font=MONO_FONT
+        )
+        self.diagnosticsRect.grid(
+            row=0, column=1, sticky=(N, S, E, W), padx=BORDER, pady=BORDER
+        )
+        self.diagnosticsRect.grid_rowconfigure(0, weight=1)
+        self.diagnosticsRect.grid_columnconfigure(0, weight=1)
+        self.diagnostics_list = tk.Listbox(
+            self.diagnosticsRect,
+            height=TEXT_HEIGHT // 3,
+            width=TEXT_WIDTH,
+            font=MONO_FONT,
+        )
+        self.diagnostics_list.grid(row=0, column=0, sticky=(N, S, E, W))
+        self.logRect.grid_columnconfigure(1, weight=1)
+        self.diagnostician = Diagnostician()
+        self.diagnostician.attach(self.input_text, self.diagnostics_list)
         # row=2, column=0, columnspan=4,
+        # progress bar for background file operations, only shown while they run
+        # grid(3, 0-3)
+        self.progress = ttk.Progressbar(self, mode="determinate")
+        self.progress.grid(row=3, column=0, columnspan=4, sticky=(E, W), padx=BORDER)
+        self.progress.grid_remove()
+        # status bar with the parsing and formatting metrics
+        # grid(4, 0-3)
+        self.status_bar = tk.Label(self, anchor=W, relief=SUNKEN, font=MONO_FONT)
+        self.status_bar.grid(row=4, column=0, columnspan=4, sticky=(E, W), padx=BORDER)
+        self.update_metrics()
 
     def open_preferences(self) -> None:
         # self.prefs_window = openToplevel()
@@ -448,6 +551,51 @@ class MorlaFrame(tk.Frame):
                 variable=tooltip_choice,
             )
             cb.grid(row=0, column=0, padx=BORDER, pady=BORDER)  # , sticky=tk.W)
+            # profiling tab
+            cur_profile = cur_section.getboolean("profile")
+            profile_tab = tk.Frame(nb)
+            profiling_word = self.get_string("profiling")
+            nb.add(profile_tab, text=profiling_word)
+            profile_choice = tk.BooleanVar()
+            profile_choice.set(cur_profile)
+            D["profile"] = (cur_profile, profile_choice)
+            cb = tk.Checkbutton(
+                profile_tab,
+                text=enabled_word,
+                onvalue=True,
+                offvalue=False,
+                variable=profile_choice,
+            )
+            cb.grid(row=0, column=0, padx=BORDER, pady=BORDER)
+            # duplicates tab
+            cur_dedupe = cur_section.get("dedupe", KEEP)
+            dedupe_tab = tk.Frame(nb)
+            duplicates_word = self.get_string("duplicates")
+            nb.add(dedupe_tab, text=duplicates_word)
+            dedupe_choice = tk.StringVar()
+            dedupe_choice.set(cur_dedupe)
+            D["dedupe"] = (cur_dedupe, dedupe_choice)
+            for i, mode in enumerate((KEEP,) + Deduplicator.MODES):
+                mode_word = self.get_string(f"{mode}_duplicates")
+                rb = tk.Radiobutton(
+                    dedupe_tab, text=mode_word, variable=dedupe_choice, value=mode
+                )
+                rb.grid(row=i, column=0, padx=BORDER, pady=BORDER, sticky=(W,))
+            # memory tab
+            cur_budget = cur_section.get("memory_budget", "0")
+            memory_tab = tk.Frame(nb)
+            memory_word = self.get_string("memory")
+            nb.add(memory_tab, text=memory_word)
+            budget_choice = tk.StringVar()
+            budget_choice.set(cur_budget)
+            D["memory_budget"] = (cur_budget, budget_choice)
+            budget_word = self.get_string("memory_budget")
+            label = tk.Label(memory_tab, text=budget_word)
+            label.grid(row=0, column=0, padx=BORDER, pady=BORDER, sticky=(W,))
+            spinbox = tk.Spinbox(
+                memory_tab, from_=0, to=65536, increment=64, textvariable=budget_choice
+            )
+            spinbox.grid(row=1, column=0, padx=BORDER, pady=BORDER, sticky=(W,))
             #
             ok_var = tk.BooleanVar()
             confirm = partial(tk.BooleanVar.set, ok_var, True)
@@ -481,6 +629,11 @@ class MorlaFrame(tk.Frame):
                 if not proceed:
                     return
                 self.preferences.set_user_pref(key, chosen)
+                if key == "profile":
+                    PROFILER.enable(chosen)
+                if key == "memory_budget":
+                    self.parser.set_memory_budget(self.memory_budget)
+                    self.refresh_browser()
                 if key == "language":
                     # refreshing the MorlaFrame while it is maximized ("zoomed") is
                     # buggy, for some reason
@@ -489,6 +642,10 @@ class MorlaFrame(tk.Frame):
                     self.init_menubar()
                     clear_widgets(self)
                     self.init_widgets()
+                    # the log handler still points at the destroyed log_text
+                    for handler in self.logger.handlers:
+                        if isinstance(handler, TextHandler):
+                            handler.attach(self.log_text)
                     if was_zoomed:
                         zoom(self.master, True)
             if proceed:
@@ -513,6 +670,26 @@ class MorlaFrame(tk.Frame):
         if filename:
             self.open_file(filename)
 
+    def poll_task(
+        self, task: BackgroundTask, on_item: Callable, on_done: Callable
+    ) -> None:
+        """Feeds the items queued by a BackgroundTask to on_item, a few at a time, and
+        calls on_done once the task is over, polling it every POLL_INTERVAL ms.
+        """
+        if task.cancelled.is_set():
+            return
+        for item in task.take(ITEMS_PER_POLL):
+            on_item(item)
+        if task.done:
+            self.progress.grid_remove()
+            on_done(task)
+        else:
+            self.after(POLL_INTERVAL, self.poll_task, task, on_item, on_done)
+
+    def start_progress(self, maximum: int) -> None:
+        self.progress.config(maximum=max(1, maximum), value=0)
+        self.progress.grid()
+
     @divert2log
     def open_file(self, filename: str):
         self.last_dir = os.path.dirname(filename)
@@ -520,15 +697,32 @@ class MorlaFrame(tk.Frame):
         # opened
         ext = get_extension(filename)
         self.reorder_ftypes(ext)
-        with open(filename, "r") as f:
-            try:
-                content = f.read().strip()
-            except UnicodeDecodeError:
-                msg = f"couldn't read {filename}!"
-                print(msg)
-                # typeset_Text(msg, self.log_text)
+        if self.loading is not None:
+            # a file is still being loaded; drop it
+            self.loading.cancel()
+        # journaling the whole file would be pointless; it is snapshotted once loaded
+        self.autosave.pause()
+        clear_text(self.input_text)
+        self.start_progress(os.path.getsize(filename))
+        # the file is read in a background thread, and its content is inserted in
+        # bounded chunks, so the first screen shows up right away
+        self.loading = BackgroundTask(read_chunks, filename)
+
+        def insert(item: Tuple[int, str]) -> None:
+            done, text = item
+            self.input_text.insert(tk.END, text)
+            self.progress.config(value=done)
+
+        def finish(task: BackgroundTask) -> None:
+            self.loading = None
+            self.autosave.resume()
+            if task.error:
+                self.log(ERROR, f"couldn't read {filename}: {task.error}")
             else:
-                typeset_Text(content, self.input_text)
+                self.log(INFO, f"read {filename}")
+                self.detect_dialect(filename)
+
+        self.poll_task(self.loading, insert, finish)
 
     @divert2log
     def on_save_file(self) -> None:
@@ -537,13 +731,131 @@ class MorlaFrame(tk.Frame):
             initialdir=self.last_dir, title=save_file_word, filetypes=self.ftypes
         )
         if filename:
-            with open(filename, "w") as f:
-                f.write(self.input_text_content)
             self.last_dir = os.path.dirname(filename)
-            # reordering ftypes will only take effect the next time a filename dialog is
-            # opened
-            ext = get_extension(filename)
-            self.reorder_ftypes(ext)
+            content = self.input_text_content
+            self.start_progress(len(content))
+            # the file is written in a background thread, through a temporary file
+            task = BackgroundTask(write_atomically, filename, content)
+
+            def advance(written: int) -> None:
+                self.progress.config(value=written)
+
+            def finish(task: BackgroundTask) -> None:
+                if task.error:
+                    self.log(ERROR, f"couldn't write {filename}: {task.error}")
+                    return
+                self.log(INFO, f"wrote {filename}")
+                # reordering ftypes will only take effect the next time a filename
+                # dialog is opened
+                ext = get_extension(filename)
+                self.reorder_ftypes(ext)
+
+            self.poll_task(task, advance, finish)
+
+    @divert2log
+    def on_export_file(self) -> None:
+        export_file_word = self.get_string("export_file")
+        ftypes = [(cls.name, f"*{cls.extension}") for cls in EXPORTERS.values()]
+        filename = filedialog.asksaveasfilename(
+            initialdir=self.last_dir, title=export_file_word, filetypes=ftypes
+        )
+        if not filename:
+            return
+        self.last_dir = os.path.dirname(filename)
+        try:
+            exporter = exporter_for(filename)
+        except ValueError as e:
+            self.pop_error(str(e))
+            return
+        # the input is parsed and exported one question at a time, in the background
+        questions = Parser(quiet=True).parse_text(self.input_text_content, self.configs)
+        task = BackgroundTask(write_atomically, filename, exporter.export(questions))
+
+        def finish(task: BackgroundTask) -> None:
+            if task.error:
+                self.log(ERROR, f"couldn't export {filename}: {task.error}")
+            else:
+                self.log(INFO, f"exported {filename}")
+
+        self.poll_task(task, lambda written: None, finish)
+
+    @divert2log
+    def on_build_pdf(self) -> None:
+        build_pdf_word = self.get_string("build_pdf")
+        filename = filedialog.asksaveasfilename(
+            initialdir=self.last_dir,
+            title=build_pdf_word,
+            filetypes=[("PDF files", "*.pdf")],
+            defaultextension=".pdf",
+        )
+        if not filename:
+            return
+        self.last_dir = os.path.dirname(filename)
+        try:
+            compiler = LatexCompiler()
+        except BuildError as e:
+            self.pop_error(str(e))
+            return
+        questions = tuple(
+            Parser(quiet=True).parse_text(self.input_text_content, self.configs)
+        )
+        name = os.path.splitext(os.path.basename(filename))[0]
+        cache = BuildCache(os.path.join(self.full_app_dir, "build-cache"))
+        builder = Builder(compiler, cache)
+        output = os.path.dirname(filename)
+        task = BackgroundTask(builder.build, [Job(name, questions)], output)
+
+        def report(item: tuple) -> None:
+            job, path, cached, error = item
+            if error is not None:
+                self.log(ERROR, f"couldn't build {job.name}:{EOL}{error}")
+            else:
+                self.log(INFO, f"built {path}{' (cached)' if cached else ''}")
+                self.update_metrics()
+
+        self.poll_task(task, report, lambda task: None)
+
+    @divert2log
+    def on_watch_folder(self) -> None:
+        watch_folder_word = self.get_string("watch_folder")
+        directory = filedialog.askdirectory(
+            initialdir=self.last_dir, title=watch_folder_word
+        )
+        if directory:
+            self.watch_folder(directory)
+
+    def watch_folder(self, directory: str) -> None:
+        """Loads every bank under directory into self.bank and the watched bank in the
+        app directory, and re-parses each file again whenever it changes.
+        """
+        self.stop_watching()
+        self.bank = Bank(self.configs)
+        self.watch_stop = threading.Event()
+        # not bank.db: the watcher deletes what leaves the folder, and bank.db holds
+        # what Parse stored too
+        store_path = os.path.join(self.full_app_dir, "watched.db")
+        task = BackgroundTask(
+            watch_bank, directory, self.bank, store_path, stop=self.watch_stop
+        )
+
+        def update(item: tuple) -> None:
+            changed, added, removed = item
+            self.log(
+                INFO,
+                f"{len(changed)} file(s) changed in {directory}: "
+                f"+{len(added)} -{len(removed)} questions",
+            )
+
+        def finish(task: BackgroundTask) -> None:
+            if task.error:
+                self.log(ERROR, f"stopped watching {directory}: {task.error}")
+
+        self.poll_task(task, update, finish)
+
+    def stop_watching(self) -> None:
+        if self.watch_stop is not None:
+            self.watch_stop.set()
+            self.watch_stop = None
 
     def pop_error(self, message) -> None:
         error_word = self.get_string("error")
@@ -653,6 +965,16 @@ class MorlaFrame(tk.Frame):
             self.config_window, text=restore_word, command=self.restore_configs
         )
         restore_defaults.grid(row=i, column=1)
+        # the profiles are in column 2, away from the Entry widgets
+        profiles_word = self.get_string("profiles")
+        profiles_label = tk.Label(self.config_window, text=profiles_word)
+        profiles_label.grid(row=0, column=2, padx=BORDER)
+        for j, name in enumerate(PROFILES, 1):
+            use_profile = partial(self.use_profile, name)
+            profile_button = CustomButton(
+                self.config_window, text=name, command=use_profile
+            )
+            profile_button.grid(row=j, column=2, padx=BORDER, sticky=(W, E))
         #
         center(self.config_window)
 
@@ -698,32 +1020,188 @@ class MorlaFrame(tk.Frame):
                 if self.parser.questions:
                     for q in self.parser.questions:
                         q.configs[k] = v
+            self.highlighter.set_configs(self.configs)
+            self.diagnostician.set_configs(self.configs)
 
     def restore_configs(self):
         self.set_configs(table=Configuration())
         self.typeset_configsEntries()
 
+    def use_profile(self, name: str) -> None:
+        self.set_configs(table=Configuration(PROFILES[name]))
+        self.typeset_configsEntries()
+
+    def detect_dialect(self, filename: str) -> None:
+        """Offers the configs of the dialect of filename, if they aren't the current
+        ones; the current ones win ties, so customized markers aren't replaced by a
+        profile that fits no better.
+        """
+        candidates = {"": self.configs}
+        candidates.update(PROFILES)
+        detection = detect_file(filename, candidates)
+        if detection is None or not detection.name:
+            return
+        dialect_word = self.get_string("dialect")
+        self.log(INFO, f"{dialect_word}: {detection.name}")
+        self.set_configs(table=Configuration(detection.configs))
+
     @divert2log
     def on_parseButton_press(self):
-        lines = self.input_text_content.split(EOL)
-        self.parser.read(lines, self.configs)
+        dedupe = self.dedupe_mode
+        # big inputs are parsed by the regex engine, small ones line by line
+        self.parser.read_text(self.input_text_content, self.configs, dedupe=dedupe)
+        if dedupe:
+            duplicates_word = self.get_string("duplicates")
+            self.log(INFO, f"{duplicates_word}: {self.parser.duplicates}")
         self.set_exercises_button(True)
+        self.refresh_browser()
+        self.log(DEBUG, TIMERS.summary())
+        self.update_metrics()
+        self.store_questions(dedupe)
+
+    @property
+    def memory_budget(self) -> Optional[int]:
+        """The memory budget of the parsed questions chosen in the preferences, in
+        bytes, or None for no budget.
+        """
+        budget = self.preferences.get_section().get("memory_budget", "0")
+        try:
+            megabytes = int(budget)
+        except ValueError:
+            print(f"> {repr(budget)} isn't a memory budget; ignoring it")
+            return None
+        return megabytes * MB if megabytes > 0 else None
+
+    @property
+    def dedupe_mode(self) -> Optional[str]:
+        """The Deduplicator mode chosen in the preferences, or None to keep
+        duplicates.
+        """
+        mode = self.preferences.get_section().get("dedupe", KEEP)
+        return mode if mode in Deduplicator.MODES else None
+
+    def store_questions(self, dedupe: Optional[str] = None) -> None:
+        """Upserts the questions added by the last Parse into the bank in the app
+        directory, in the background; those parsed before are already there.
+        """
+        store_path = os.path.join(self.full_app_dir, "bank.db")
+        start = self.parser.last_read
+        count = len(self.parser.questions) - start
+        questions = self.parser.snapshot(start)
+        task = BackgroundTask(ingest_questions, store_path, questions, dedupe)
+        duplicates = [0]
+
+        def finish(task: BackgroundTask) -> None:
+            if task.error:
+                self.log(ERROR, f"couldn't store the questions: {task.error}")
+            else:
+                self.log(INFO, f"stored {count} questions in {store_path}")
+                if duplicates[0]:
+                    duplicates_word = self.get_string("duplicates")
+                    self.log(INFO, f"{duplicates_word}: {duplicates[0]}")
+
+        def on_item(progress: Tuple[int, int]) -> None:
+            duplicates[0] = progress[1]
+
+        self.poll_task(task, on_item, finish)
 
     @divert2log
     def on_formatButton_press(self):
-        questions = self.parser.pretty_print()
-        if questions:
-            typeset_Text(questions, self.output_text)
+        if self.parser.questions:
+            self.typeset_output()
             self.parser.clear(total=True)
             self.set_exercises_button(False)
+            self.refresh_browser()
+            self.log(DEBUG, TIMERS.summary())
+            self.update_metrics()
         else:
             nothing_parsed = self.get_string("no_questions_parsed")
             print(f"{nothing_parsed}.")
 
+    def update_metrics(self) -> None:
+        """Refreshes the status bar, and schedules a rewrite of the Prometheus metrics
+        file in the app directory, unless one is pending already.
+        """
+        self.status_bar.config(text=metrics.status_line())
+        if self.metrics_scheduled is None:
+            self.metrics_scheduled = self.after(METRICS_DELAY, self.write_metrics)
+
+    def write_metrics(self) -> None:
+        """Rewrites the metrics file in the background. It's a scrape file, rewritten
+        all the time, so it isn't fsynced; a failure is logged by BackgroundTask.
+        """
+        self.metrics_scheduled = None
+        prom_path = os.path.join(self.full_app_dir, "metrics.prom")
+        content = metrics.REGISTRY.to_prometheus()
+        BackgroundTask(write_atomically, prom_path, content, durable=False)
+
+    @instrument("morlaframe.typeset_output", top_level=True)
+    def typeset_output(self) -> None:
+        # stream the questions into the viewer instead of joining them
+        self.output_text.load(self.parser.iter_pretty())
+
+    def refresh_browser(self) -> None:
+        """Shows the current self.parser.questions in the open QuestionBrowser, after
+        they were parsed, cleared or moved.
+        """
+        if self.browser is not None and self.browser.winfo_exists():
+            self.browser.reload(self.parser.questions)
+
     def open_exercises_window(self):
+        if self.browser is not None and self.browser.winfo_exists():
+            # the window isn't modal; there's no need for a second one
+            self.browser.winfo_toplevel().lift()
+            return
         exercises_word = self.get_string("exercises")
-        with CustomToplevel(self, title=exercises_word) as exerc_window:
-            pass
+        window = open_toplevel(self, title=exercises_word, exclusive=False)
+        window.resizable(True, True)
+        window.grid_rowconfigure(0, weight=1)
+        window.grid_columnconfigure(0, weight=1)
+
+        def deleted(n: int) -> None:
+            self.log(INFO, f"deleted {n} question(s)")
+            if not self.parser.questions:
+                self.set_exercises_button(False)
+
+        # the browser edits self.parser.questions in place, and is reloaded whenever
+        # they change (see refresh_browser)
+        self.browser = QuestionBrowser(
+            window, self.parser.questions, self.get_string, on_delete=deleted
+        )
+        self.browser.grid(row=0, column=0, sticky=(N, S, E, W))
+        center(window)
+
+    @divert2log
+    def on_analytics(self) -> None:
+        """Computes the reports of morla.analytics over the parsed questions, in the
+        background, and shows each one in a tab.
+        """
+        if not self.parser.questions:
+            nothing_parsed = self.get_string("no_questions_parsed")
+            print(f"{nothing_parsed}.")
+            return
+        task = BackgroundTask(report_tables, self.parser.snapshot())
+        tables = []
+
+        def finish(task: BackgroundTask) -> None:
+            if task.error:
+                self.log(ERROR, f"couldn't compute the reports: {task.error}")
+                return
+            analytics_word = self.get_string("analytics")
+            window = open_toplevel(self, title=analytics_word, exclusive=False)
+            window.resizable(True, True)
+            window.grid_rowconfigure(0, weight=1)
+            window.grid_columnconfigure(0, weight=1)
+            nb = ttk.Notebook(window)
+            for table in tables:
+                view = TableView(
+                    nb, table.name, table.rows, table.columns, table.counts.tolist()
+                )
+                nb.add(view, text=table.name)
+            nb.grid(row=0, column=0, sticky=(N, S, E, W))
+            center(window)
+
+        self.poll_task(task, tables.append, finish)
 
     def open_about_window(self):
         name = morla.SELETOR_NAME
@@ -773,31 +1251,35 @@ class MorlaFrame(tk.Frame):
         center(window)
 
 
-def _cleanup() -> None:
-    with Cd(morla_frame.full_app_dir):
-        ini_name = "preferences.ini"
-        try:
-            os.remove(ini_name)
-            # os.rmdir(morla_frame.full_app_dir)
-        except FileNotFoundError:
-            print("Couldn't erase", ini_name)
-        else:
-            print(f"File {ini_name} erased.")
-        with Cd(morla_frame.home_dir):
-            try:
-                os.rmdir(".morla")
-            except FileNotFoundError:
-                print("Couldn't erase .morla")
-            else:
-                print(f"Directory {morla_frame.home_dir}.morla/ erased.")
+def _cleanup(morla_frame: MorlaFrame) -> None:
+    ini_path = morla_frame.preferences.path()
+    try:
+        os.remove(ini_path)
+    except FileNotFoundError:
+        print("Couldn't erase", ini_path)
+    else:
+        print(f"File {ini_path} erased.")
+    try:
+        os.rmdir(morla_frame.full_app_dir)
+    except OSError:
+        print("Couldn't erase", morla_frame.full_app_dir)
+    else:
+        print(f"Directory {morla_frame.full_app_dir} erased.")
 
 
 def gui_loop() -> None:
-    to_open = sys.argv[1] if len(sys.argv) == 2 else ""
-    morla_frame = MorlaFrame(to_open)
+    arg_parser = argparse.ArgumentParser(prog="morla")
+    arg_parser.add_argument("filename", nargs="?", default="", help="file to open")
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile parsing and formatting with cProfile",
+    )
+    args = arg_parser.parse_args()
+    morla_frame = MorlaFrame(args.filename, profile=args.profile)
     exit_status = morla_frame.mainloop()
     if False:
-        _cleanup()
+        _cleanup(morla_frame)
     sys.exit(exit_status)
 
 
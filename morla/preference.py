@@ -3,7 +3,9 @@
 from typing import Any, Optional
 
 # sys is already loaded by tkinter; use tk.sys instead
+import io
 import os
+import threading
 
 from configparser import ConfigParser
 
@@ -11,20 +13,36 @@ from tkinter import sys
 import tkinter as tk
 
 from morla.utils import *
+from morla.fileio import write_atomically
 from morla.gui import ENABLED, DISABLED
 
 
 class Preferences(ConfigParser):
-    defaults = {"language": ENUS, "tooltip": "True"}  # only strings as values!
+    """The user's preferences, kept in directory/preferences.ini. Every path is built
+    from the absolute directory, and reads and writes hold a lock, so that they can be
+    made from worker threads, regardless of the working directory.
+    """
+
+    # only strings as values!
+    # dedupe is "keep" or a mode of bulk.Deduplicator; memory_budget is in MB, and 0
+    # means no budget
+    defaults = {
+        "language": ENUS,
+        "tooltip": "True",
+        "profile": "False",
+        "dedupe": "keep",
+        "memory_budget": "0",
+    }
 
     synonyms = {True: set(("true", ENABLED)), False: set(("false", DISABLED))}
 
     def __init__(self, directory: str, D: Optional[dict] = None) -> None:
         super(Preferences, self).__init__()
-        self.directory = os.path.expanduser(directory)
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.lock = threading.RLock()
         print("> Preferences object at", self.directory)
         if D:
-            illegal = dict_diff(D, self.defaults)
+            _, illegal = key_diff(self.defaults, D)
             if illegal:
                 illegal = COMMA.join(sorted(illegal))
                 raise ValueError(f"{illegal} are not valid preference keys.")
@@ -32,17 +50,18 @@ class Preferences(ConfigParser):
         else:
             self[DEFAULT] = self.defaults.copy()
 
+    def path(self, name: str = "preferences", where: Optional[str] = None) -> str:
+        where = os.path.abspath(os.path.expanduser(where or self.directory))
+        return os.path.join(where, name + ".ini")
+
     def get_section(self) -> str:
-        try:
-            return self[USER]
-        except KeyError:
-            return self[DEFAULT]
+        with self.lock:
+            try:
+                return self[USER]
+            except KeyError:
+                return self[DEFAULT]
 
     def set_user_pref(self, key: str, value: Any) -> None:
-        try:
-            self[USER]
-        except KeyError:
-            self[USER] = {}
         if not isinstance(value, str):
             try:
                 value = str(value)
@@ -51,26 +70,43 @@ class Preferences(ConfigParser):
                 raise
             else:
                 print(f"> converting {value} to str...")
-        self[USER][key] = value
-
-    def save(self, name: str = "preferences", where: str = None):
-        if not where:
-            where = self.directory
-        with Cd(where):
-            filename = name + ".ini"
-            with open(filename, "w") as prefs_file:
-                try:
-                    self.write(prefs_file)
-                    # json.dump(self.dict, json_file)
-                except:
-                    print(f"> Writing {filename} failed.")
-                    raise
-                else:
-                    print(f"> Wrote {filename}.")
-            print_sep()
-            with open(filename, "r") as prefs_file:
-                print(prefs_file.read().strip())
-            print_sep()
+        with self.lock:
+            try:
+                self[USER]
+            except KeyError:
+                self[USER] = {}
+            self[USER][key] = value
+
+    def load(self, name: str = "preferences", where: Optional[str] = None) -> bool:
+        """Reads the preferences saved in where (by default, directory); returns
+        whether there were any.
+        """
+        filename = self.path(name, where)
+        with self.lock:
+            return bool(self.read(filename, encoding=UTF8))
+
+    def dumps(self) -> str:
+        with self.lock:
+            content = io.StringIO()
+            self.write(content)
+        return content.getvalue()
+
+    def save(self, name: str = "preferences", where: Optional[str] = None) -> None:
+        filename = self.path(name, where)
+        content = self.dumps()
+        # the lock also keeps two threads from replacing the file at the same time
+        with self.lock:
+            try:
+                for _ in write_atomically(filename, content):
+                    pass
+            except:
+                print(f"> Writing {filename} failed.")
+                raise
+            else:
+                print(f"> Wrote {filename}.")
+        print_sep()
+        print(content.strip())
+        print_sep()
 
 
 if __name__ == "__main__":
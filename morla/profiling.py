@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Dict, List, Optional
+
+# sys is already loaded by tkinter; use tk.sys instead
+from functools import wraps
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+
+from tkinter import sys
+
+from morla.utils import *
+
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimers:
+    """Accumulates the number of calls, the wall time and the CPU time of each stage
+    (parse, format, etc). Timing a call costs a couple of clock reads, so the timers
+    are always on.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # stage: [calls, wall seconds, cpu seconds]
+        self.stages = {}
+
+    def add(self, stage: str, wall: float, cpu: float) -> None:
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages.clear()
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {
+                stage: {"calls": calls, "wall": wall, "cpu": cpu}
+                for stage, (calls, wall, cpu) in self.stages.items()
+            }
+
+    def summary(self) -> str:
+        lines = []
+        for stage, totals in sorted(self.as_dict().items()):
+            calls, wall, cpu = totals["calls"], totals["wall"], totals["cpu"]
+            lines.append(f"{stage}: {calls} calls, {wall:.4f} s wall, {cpu:.4f} s cpu")
+        return EOL.join(lines)
+
+
+class Profiler:
+    """Runs the outermost instrumented call under cProfile while enabled. When a
+    top-level stage (a whole parse, a whole typesetting) ends, or when profiling is
+    disabled, the accumulated statistics are written to path (a .pstats file, which can
+    be read with the pstats module or snakeviz) and the top functions are logged.
+    """
+
+    def __init__(self, path: Optional[str] = None, top: int = 20) -> None:
+        self.enabled = False
+        self.path = path
+        self.top = top
+        self.profile = cProfile.Profile()
+        # cProfile can't be enabled twice, so nested calls are just run
+        self.depth = 0
+        self.lock = threading.Lock()
+        # whether there are statistics that haven't been dumped yet
+        self.pending = False
+
+    def enable(self, value: bool = True) -> None:
+        self.enabled = value
+        logger.info(f"profiling {'enabled' if value else 'disabled'}")
+        if not value and self.pending:
+            self.dump()
+
+    def run(self, f: Callable, args: tuple, kwargs: dict, dump: bool = False) -> Any:
+        """Calls f(*args, **kwargs), profiled if it's the outermost instrumented call;
+        with dump, the statistics are dumped after it.
+        """
+        # only one thread at a time can be profiled; the others are just timed
+        if self.depth or not self.lock.acquire(blocking=False):
+            return f(*args, **kwargs)
+        self.depth += 1
+        self.profile.enable()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self.profile.disable()
+            self.depth -= 1
+            self.pending = True
+            self.lock.release()
+            if dump:
+                self.dump()
+
+    def summary(self, top: Optional[int] = None) -> str:
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(top or self.top)
+        return stream.getvalue()
+
+    def dump(self) -> None:
+        self.pending = False
+        if self.path:
+            self.profile.dump_stats(self.path)
+            logger.info(f"profile written to {self.path}")
+        logger.info(self.summary())
+
+    def reset(self) -> None:
+        self.profile = cProfile.Profile()
+
+
+TIMERS = StageTimers()
+PROFILER = Profiler()
+
+
+def instrument(stage: str, top_level: bool = False) -> Callable:
+    """Decorator that times every call of the decorated function as stage, and profiles
+    it when PROFILER is enabled; the profile is dumped when a top_level stage ends.
+    """
+
+    def wrapper(f: Callable) -> Callable:
+        @wraps(f)
+        def wrapped(*args, **kwargs) -> Any:
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                if PROFILER.enabled:
+                    return PROFILER.run(f, args, kwargs, dump=top_level)
+                return f(*args, **kwargs)
+            finally:
+                TIMERS.add(
+                    stage,
+                    time.perf_counter() - wall,
+                    time.thread_time() - cpu,
+                )
+
+        return wrapped
+
+    return wrapper
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""A local JSON-RPC 2.0 service, so that other programs can parse, format, search and
+export banks without starting a Python (and Tk) process for each call:
+    python3 -m morla.service --socket /tmp/morla.sock
+    python3 -m morla.service --port 8765
+Requests and responses are JSON objects, one per line. Parsing and rendering run in a
+pool of processes that is started once, with the default Tokenizers compiled, so a
+warm request costs milliseconds. Results are streamed as they are produced: each piece
+is a "chunk" notification,
+    {"method": "chunk", "params": {"id": ..., "index": ..., "data": ...}},
+and the response to the request comes last, with the number of chunks sent (or an
+error, which may come after some chunks).
+    {"jsonrpc": "2.0", "id": 1, "method": "parse", "params": {"text": "..."}}
+The methods:
+    parse(text | filename, configs?)                      chunks of question records
+    format(text | filename, configs?)                     chunks of LaTeX
+    export(text | filename, format, configs?)             chunks of the exported bank
+    search(database, source?, year?, question_type?, tag?, text?, limit?, offset?)
+configs is a dict of markers or the name of a profile of morla.dialects; without it,
+the dialect of the bank is detected.
+"""
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+# sys is already loaded by tkinter; use tk.sys instead
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Parser, Question
+from morla.configuration import Configuration
+from morla.dialects import PROFILES, SAMPLE_SIZE, detect
+from morla.exporters import JSONLinesExporter, get_exporter
+from morla.formatter import ParallelFormatter, batches
+from morla.store import QuestionStore
+from morla.tokenizer import Tokenizer
+
+
+LOCALHOST = "127.0.0.1"
+PORT = 8765
+# questions per chunk of parse, format and search, and characters per chunk of export
+CHUNK_QUESTIONS = 500
+CHUNK_SIZE = 256 * 1024
+# the longest request line, which may carry a whole bank
+MAX_REQUEST = 64 * 1024 * 1024
+# chunks produced but not yet sent, per request; a producer waits when there are more
+MAX_PENDING = 4
+# seconds between checks that a producer is still alive, and that the workers start
+POLL = 0.5
+WARM_UP_TIMEOUT = 60
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+# search params that are QuestionStore.query filters
+FILTERS = ("source", "year", "question_type", "tag", "text")
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        # both are args, so that the error survives pickling out of a worker
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+# the workers ----------------------------------------------------------------------
+def warm_up() -> None:
+    """Runs once in each worker, so that the first request finds it ready.
+    """
+    # the parser is chatty, and the workers' prints would go nowhere useful
+    sys.stdout = open(os.devnull, "w")
+    for configs in PROFILES.values():
+        Tokenizer.for_configs(configs)
+
+
+def ping(barrier) -> int:
+    """Waits until every worker has a ping, so that the pool starts all of them.
+    """
+    try:
+        barrier.wait(WARM_UP_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    return os.getpid()
+
+
+def produce(job: Callable, params: dict, queue, cancelled) -> None:
+    """Puts the chunks of job into queue as they are produced, and then None. queue is
+    bounded, so a producer can't run ahead of a slow client by more than MAX_PENDING
+    chunks; it stops early once cancelled is set.
+    """
+    try:
+        for chunk in job(params):
+            if cancelled.is_set():
+                break
+            queue.put(chunk)
+    finally:
+        queue.put(None)
+
+
+@functools.lru_cache(maxsize=64)
+def cached_configs(items: tuple) -> Configuration:
+    return Configuration(dict(items))
+
+
+def get_configs(params: dict) -> Optional[Configuration]:
+    """The Configuration asked for in params, from the cache; None if the dialect of
+    the bank is to be detected.
+    """
+    configs = params.get("configs")
+    if configs is None:
+        return None
+    if isinstance(configs, str):
+        if configs not in PROFILES:
+            raise RPCError(INVALID_PARAMS, f"{repr(configs)} is not a profile.")
+        return PROFILES[configs]
+    if not isinstance(configs, dict):
+        raise RPCError(INVALID_PARAMS, "configs must be an object or a profile name.")
+    return cached_configs(tuple(sorted(configs.items())))
+
+
+def load_questions(params: dict) -> Iterator[Question]:
+    configs = get_configs(params)
+    text = params.get("text")
+    filename = params.get("filename")
+    if (text is None) == (filename is None):
+        raise RPCError(INVALID_PARAMS, "give either text or filename.")
+    if filename is not None:
+        return Parser(quiet=True).parse_file(filename, configs)
+    if configs is None:
+        detection = detect(text[:SAMPLE_SIZE])
+        configs = detection.configs if detection is not None else Configuration()
+    return Parser(quiet=True).parse_text(text, configs)
+
+
+def gather(pieces: Iterable[str], size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Joins pieces into chunks of about size characters.
+    """
+    chunk = []
+    length = 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def records(questions: Iterable[Question], start: int = 1) -> Iterator[List[dict]]:
+    numbers = itertools.count(start)
+    for batch in batches(questions, CHUNK_QUESTIONS):
+        yield [JSONLinesExporter.record(next(numbers), q) for q in batch]
+
+
+def parse_job(params: dict) -> Iterator[List[dict]]:
+    return records(load_questions(params))
+
+
+def format_job(params: dict) -> Iterator[str]:
+    formatter = ParallelFormatter(workers=1, batch_size=CHUNK_QUESTIONS)
+    return formatter.format(load_questions(params))
+
+
+def export_job(params: dict) -> Iterator[str]:
+    name = params.get("format")
+    if not isinstance(name, str):
+        raise RPCError(INVALID_PARAMS, "format is required.")
+    try:
+        exporter = get_exporter(name)
+    except ValueError as e:
+        raise RPCError(INVALID_PARAMS, str(e)) from None
+    return gather(exporter.export(load_questions(params)))
+
+
+def search_job(params: dict) -> Iterator[List[dict]]:
+    """Runs in a thread: it only waits for SQLite.
+    """
+    database = params.get("database")
+    if not isinstance(database, str):
+        raise RPCError(INVALID_PARAMS, "database is required.")
+    if not os.path.exists(database):
+        raise RPCError(INVALID_PARAMS, f"there is no {database}.")
+    filters = {key: params[key] for key in FILTERS if key in params}
+    offset = params.get("offset", 0)
+    with QuestionStore(database) as store:
+        questions = store.query(params.get("limit"), offset, **filters)
+        yield from records(questions, start=offset + 1)
+
+
+# the server -----------------------------------------------------------------------
+class Service:
+    """Answers JSON-RPC requests from any number of connections; the requests of a
+    connection are answered in order. The pool is started (and warmed up) by start,
+    and kept until close; the jobs in the pool stream their chunks back through queues
+    of a multiprocessing Manager.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.manager = None
+        # the producers running or waiting, to be cancelled by close
+        self.jobs = set()
+        # (queue, cancelled) pairs of the Manager that are free to reuse; making them
+        # costs more than a small request
+        self.channels = []
+        # method: (job, whether it runs in the pool rather than in a thread)
+        self.methods: Dict[str, Tuple[Callable, bool]] = {
+            "parse": (parse_job, True),
+            "format": (format_job, True),
+            "export": (export_job, True),
+            "search": (search_job, False),
+        }
+
+    async def start(self) -> None:
+        self.manager = multiprocessing.Manager()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=warm_up)
+        # the pool starts workers lazily; pings that wait for each other need them all
+        barrier = self.manager.Barrier(self.workers)
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *[
+                loop.run_in_executor(self.pool, ping, barrier)
+                for _ in range(self.workers)
+            ]
+        )
+        print(f"> {len(set(pids))} worker(s) ready")
+
+    def close(self) -> None:
+        for job in self.jobs:
+            job.cancel()
+        self.jobs.clear()
+        self.channels.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+
+    async def serve(
+        self, path: Optional[str] = None, host: str = LOCALHOST, port: int = PORT
+    ) -> None:
+        await self.start()
+        try:
+            if path is not None:
+                server = await asyncio.start_unix_server(
+                    self.handle, path, limit=MAX_REQUEST
+                )
+                print(f"> Listening on {path}")
+            else:
+                server = await asyncio.start_server(
+                    self.handle, host, port, limit=MAX_REQUEST
+                )
+                print(f"> Listening on {host}:{port}")
+            # a terminated service stops like an interrupted one
+            stop = asyncio.Event()
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+            except NotImplementedError:
+                # Windows has no signal handlers in the event loop
+                pass
+            async with server:
+                await stop.wait()
+        finally:
+            self.close()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than MAX_REQUEST; the rest of the stream can't be trusted
+                    error = RPCError(INVALID_REQUEST, "the request is too long.")
+                    await self.send(writer, self.error(None, error))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await self.answer(line, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, message: dict) -> None:
+        writer.write(json.dumps(message, ensure_ascii=False).encode(UTF8) + b"\n")
+        # waiting for the buffer to drain keeps slow clients from piling up chunks
+        await writer.drain()
+
+    @staticmethod
+    def error(request_id: Any, error: RPCError) -> dict:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": error.code, "message": error.message},
+        }
+
+    async def answer(self, line: bytes, writer: asyncio.StreamWriter) -> None:
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise RPCError(PARSE_ERROR, f"invalid JSON: {e}") from None
+            if not isinstance(request, dict) or request.get("jsonrpc") != "2.0":
+                raise RPCError(INVALID_REQUEST, "not a JSON-RPC 2.0 request.")
+            request_id = request.get("id")
+            method = request.get("method")
+            params = request.get("params", {})
+            if method not in self.methods:
+                raise RPCError(METHOD_NOT_FOUND, f"there is no {repr(method)}.")
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "params must be an object.")
+
+            async def send_chunk(index: int, chunk: Any) -> None:
+                if request_id is None:
+                    # a notification has no answer
+                    return
+                params = {"id": request_id, "index": index, "data": chunk}
+                message = {"jsonrpc": "2.0", "method": "chunk", "params": params}
+                await self.send(writer, message)
+
+            chunks = await self.run(method, params, send_chunk)
+        except RPCError as e:
+            await self.send(writer, self.error(request_id, e))
+            return
+        if request_id is None:
+            return
+        result = {"chunks": chunks}
+        await self.send(writer, {"jsonrpc": "2.0", "id": request_id, "result": result})
+
+    async def run(
+        self, method: str, params: dict, send_chunk: Callable[[int, Any], Any]
+    ) -> int:
+        """Runs the job of method, awaiting send_chunk(index, chunk) for each chunk as
+        soon as it's produced, and returns the number of chunks.
+        """
+        job, in_pool = self.methods[method]
+        loop = asyncio.get_running_loop()
+        if not in_pool:
+            queue, cancelled = Queue(MAX_PENDING), threading.Event()
+        elif self.channels:
+            queue, cancelled = self.channels.pop()
+        else:
+            queue, cancelled = self.manager.Queue(MAX_PENDING), self.manager.Event()
+        executor = self.pool if in_pool else None
+        producer = loop.run_in_executor(
+            executor, produce, job, params, queue, cancelled
+        )
+        self.jobs.add(producer)
+        take = functools.partial(queue.get, timeout=POLL)
+        count = 0
+        finished = False
+        try:
+            while True:
+                try:
+                    chunk = await loop.run_in_executor(None, take)
+                except Empty:
+                    # a worker that died never puts its None
+                    if producer.done() and producer.exception() is not None:
+                        break
+                    continue
+                if chunk is None:
+                    finished = True
+                    break
+                await send_chunk(count, chunk)
+                count += 1
+            await self.result(producer)
+        finally:
+            self.jobs.discard(producer)
+            if finished and in_pool:
+                # the producer put its None last, so the queue is empty
+                self.channels.append((queue, cancelled))
+            elif not producer.done():
+                # e.g. the client left: unblock the producer, which stops early
+                cancelled.set()
+                while not producer.done():
+                    try:
+                        await loop.run_in_executor(None, take)
+                    except Empty:
+                        pass
+        return count
+
+    @staticmethod
+    async def result(producer: asyncio.Future) -> None:
+        try:
+            await producer
+        except RPCError:
+            raise
+        except AssertionError:
+            # the line parser asserts the order of the markers
+            raise RPCError(SERVER_ERROR, "the markers are out of order.") from None
+        except Exception as e:
+            raise RPCError(SERVER_ERROR, f"{type(e).__name__}: {e}") from None
+
+
+# the client -----------------------------------------------------------------------
+class ServiceError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(f"{message} ({code})")
+        self.code = code
+
+
+class Client:
+    """A blocking client, for scripts:
+        with Client(path="/tmp/morla.sock") as client:
+            for records in client.stream("parse", filename="bank.tex"):
+                ...
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, host: str = LOCALHOST, port: int = PORT
+    ) -> None:
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile("rwb")
+        self.ids = itertools.count(1)
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def stream(self, method: str, **params: Any) -> Iterator[Any]:
+        """Sends a request and yields the data of its chunks as they arrive.
+        """
+        request_id = next(self.ids)
+        request = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        request["params"] = params
+        self.file.write(json.dumps(request, ensure_ascii=False).encode(UTF8) + b"\n")
+        self.file.flush()
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("the service closed the connection")
+            message = json.loads(line)
+            if message.get("method") == "chunk":
+                if message["params"]["id"] == request_id:
+                    yield message["params"]["data"]
+                continue
+            if message.get("id") != request_id:
+                continue
+            if "error" in message:
+                error = message["error"]
+                raise ServiceError(error["code"], error["message"])
+            return
+
+    def call(self, method: str, **params: Any) -> list:
+        return list(self.stream(method, **params))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.service", description="Serves morla over local JSON-RPC."
+    )
+    arg_parser.add_argument("--socket", help="listen on this Unix socket")
+    arg_parser.add_argument("--host", default=LOCALHOST)
+    arg_parser.add_argument("--port", type=int, default=PORT)
+    arg_parser.add_argument("--workers", type=int)
+    args = arg_parser.parse_args(argv)
+    service = Service(args.workers)
+    try:
+        asyncio.run(service.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
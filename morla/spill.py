@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""A list of questions with a memory budget: once the questions in memory take more
+than the budget, they are appended to a temporary spill file as compact binary records
+(marshal), and only their offsets stay in memory. Reading the list back (iterating,
+indexing) is transparent; iterating streams the spilled questions from the file, so
+formatting or exporting a spilled bank never holds it all in memory either.
+"""
+
+from typing import Iterable, Iterator, List, Optional, Union
+
+# sys is already loaded by tkinter; use tk.sys instead
+from array import array
+import marshal
+import os
+import tempfile
+import threading
+import weakref
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Question
+from morla.configuration import Configuration
+
+
+MB = 1024 * 1024
+# rough costs of a parsed question in memory (its lists, its own Configuration) and of
+# each of its strings, besides their characters; measured with tracemalloc
+QUESTION_OVERHEAD = 1024
+STR_OVERHEAD = 56
+
+
+def estimate_size(q: Question) -> int:
+    """Roughly how many bytes q takes in memory.
+    """
+    strings = [q.source, q.year, q.question_type, q.answer]
+    for values in (q.histories, q.tags, q.texts, q.choices, q.wrongs, q.explanations):
+        strings.extend(values)
+    return QUESTION_OVERHEAD + sum(STR_OVERHEAD + len(s) for s in strings)
+
+
+def remove_spill(file, path: str) -> None:
+    file.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class QuestionSpool:
+    """Holds questions like a list, spilling them to a temporary file when those in
+    memory take more than budget bytes (None never spills). Questions can be appended
+    and read back in any order, and the whole list can be replaced (spool[:] = ...),
+    but single questions can't be replaced or removed. Questions read back from the
+    file are new objects, except for their configs, which are shared by the questions
+    that had equal ones, so that changing the configs of a question read back changes
+    it for good.
+    """
+
+    def __init__(
+        self, budget: Optional[int] = None, directory: Optional[str] = None
+    ) -> None:
+        self.budget = budget
+        self.directory = directory
+        # the questions that haven't been spilled, and their estimated size
+        self.memory = []
+        self.memory_size = 0
+        # the offset of each spilled question in the file, and the end of the file
+        self.offsets = array("q")
+        self.end = 0
+        # the distinct configs of the spilled questions
+        self.configs = []
+        self.config_indexes = {}
+        self.file = None
+        self.path = None
+        self.finalizer = None
+        # the GUI reads the questions from background threads
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.offsets) + len(self.memory)
+
+    @property
+    def spilled(self) -> int:
+        return len(self.offsets)
+
+    def append(self, q: Question) -> None:
+        with self.lock:
+            self.memory.append(q)
+            self.memory_size += estimate_size(q)
+            if self.budget is not None and self.memory_size > self.budget:
+                self.spill()
+
+    def extend(self, questions: Iterable[Question]) -> None:
+        for q in questions:
+            self.append(q)
+
+    def spill(self) -> None:
+        """Appends the questions in memory to the spill file.
+        """
+        with self.lock:
+            if not self.memory:
+                return
+            if self.file is None:
+                fd, self.path = tempfile.mkstemp(
+                    prefix="morla-", suffix=".spill", dir=self.directory
+                )
+                self.file = open(fd, "w+b")
+                # the file is removed even if the spool is never cleared
+                self.finalizer = weakref.finalize(
+                    self, remove_spill, self.file, self.path
+                )
+            self.file.seek(self.end)
+            for q in self.memory:
+                record = marshal.dumps(self.pack(q))
+                self.offsets.append(self.end)
+                self.file.write(record)
+                self.end += len(record)
+            self.file.flush()
+            print(f"> Spilled {len(self.memory)} question(s) to {self.path}")
+            self.memory = []
+            self.memory_size = 0
+
+    def pack(self, q: Question) -> tuple:
+        key = tuple(q.configs.items())
+        index = self.config_indexes.get(key)
+        if index is None:
+            index = self.config_indexes[key] = len(self.configs)
+            self.configs.append(Configuration(q.configs))
+        return (
+            index,
+            q.source,
+            q.year,
+            q.question_type,
+            q.answer,
+            q.histories,
+            q.tags,
+            q.texts,
+            q.choices,
+            q.wrongs,
+            q.explanations,
+            q.duplicate_of,
+        )
+
+    def unpack(
+        self, record: tuple, configs_table: Optional[List[Configuration]] = None
+    ) -> Question:
+        index, *fields, duplicate_of = record
+        configs = (self.configs if configs_table is None else configs_table)[index]
+        q = Question(*fields, configs=configs)
+        q.configs = configs
+        if duplicate_of is not None:
+            q.duplicate_of = duplicate_of
+        return q
+
+    def read(self, index: int) -> Question:
+        with self.lock:
+            start = self.offsets[index]
+            if index + 1 < len(self.offsets):
+                end = self.offsets[index + 1]
+            else:
+                end = self.end
+            self.file.seek(start)
+            return self.unpack(marshal.loads(self.file.read(end - start)))
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[Question, List[Question]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        with self.lock:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("QuestionSpool index out of range")
+            if index < self.spilled:
+                return self.read(index)
+            return self.memory[index - self.spilled]
+
+    def __setitem__(self, index: slice, questions: Iterable[Question]) -> None:
+        if index != slice(None):
+            raise TypeError("only the whole QuestionSpool ([:]) can be replaced")
+        self.replace(questions)
+
+    def replace(self, questions: Iterable[Question]) -> None:
+        """Replaces every question with questions, which are streamed into a new spill
+        file, swapped in at the end; they may be read from this very spool (e.g. all
+        of its questions but a few), since iterating it reads a snapshot.
+        """
+        with self.lock:
+            new = QuestionSpool(self.budget, self.directory)
+            new.extend(questions)
+            self.clear()
+            self.memory = new.memory
+            self.memory_size = new.memory_size
+            self.offsets = new.offsets
+            self.end = new.end
+            self.configs = new.configs
+            self.config_indexes = new.config_indexes
+            self.file = new.file
+            self.path = new.path
+            if new.finalizer is not None:
+                # the file now belongs to this spool
+                new.finalizer.detach()
+                self.finalizer = weakref.finalize(
+                    self, remove_spill, self.file, self.path
+                )
+
+    def __iter__(self) -> Iterator[Question]:
+        """Iterates over the questions as they are now: questions appended meanwhile
+        are left out, and the spilled ones are streamed from the file, even if the
+        spool is cleared meanwhile.
+        """
+        return self.tail(0)
+
+    def tail(self, start: int) -> Iterator[Question]:
+        """Like iterating the spool, but from the question at index start on; the
+        spilled questions before it are skipped with a seek, not read.
+        """
+        with self.lock:
+            start = min(max(start, 0), len(self))
+            spilled = max(self.spilled - start, 0)
+            memory = self.memory[max(start - self.spilled, 0) :]
+            # a handle of its own, opened right away, so that it can be read from
+            # another thread, and after clear removes the file
+            f = None
+            if spilled:
+                f = open(self.path, "rb")
+                f.seek(self.offsets[start])
+            return self.stream(f, spilled, memory, self.configs)
+
+    def stream(
+        self,
+        f,
+        spilled: int,
+        memory: List[Question],
+        configs_table: List[Configuration],
+    ) -> Iterator[Question]:
+        if f is not None:
+            with f:
+                for _ in range(spilled):
+                    yield self.unpack(marshal.load(f), configs_table)
+        yield from memory
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory = []
+            self.memory_size = 0
+            self.offsets = array("q")
+            self.end = 0
+            self.configs = []
+            self.config_indexes = {}
+            if self.finalizer is not None:
+                self.finalizer()
+            self.file = None
+            self.path = None
+            self.finalizer = None
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
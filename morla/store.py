@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+"""A persistent question bank on SQLite. Questions are upserted by fingerprint, so
+ingesting a bank again only updates its histories and tags; queries stream Question
+objects out of the database a batch at a time, so banks larger than the memory can be
+searched:
+    python3 -m morla.store bank.db ingest lista01.tex lista02.tex --dedupe drop
+    python3 -m morla.store bank.db query --tag sintaxe --format jsonl
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Deduplicator, Parser, Question
+from morla.configuration import Configuration
+from morla.formatter import batches
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    year TEXT NOT NULL,
+    type TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    texts TEXT NOT NULL,
+    explanations TEXT NOT NULL,
+    ingested REAL NOT NULL,
+    canonical TEXT
+);
+CREATE INDEX IF NOT EXISTS questions_source ON questions (source);
+CREATE INDEX IF NOT EXISTS questions_year ON questions (year);
+CREATE TABLE IF NOT EXISTS choices (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    correct INTEGER NOT NULL,
+    PRIMARY KEY (question_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tags (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (question_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, question_id);
+CREATE TABLE IF NOT EXISTS histories (
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    history TEXT NOT NULL,
+    PRIMARY KEY (question_id, position)
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO questions
+    (fingerprint, source, year, type, answer, texts, explanations, ingested, canonical)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (fingerprint) DO UPDATE SET
+    ingested = excluded.ingested, canonical = excluded.canonical
+"""
+COLUMNS = "id, source, year, type, answer, texts, explanations"
+
+# SQLite limits the number of ? in a statement (to 999, in older versions)
+BATCH_SIZE = 500
+
+
+class QuestionStore:
+    """A question bank in a SQLite database, in WAL mode: any number of readers (in
+    other threads or processes) can query it while one writer ingests.
+    A QuestionStore, like its connection, should be used by a single thread.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        configs: Optional[Configuration] = None,
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        self.path = path
+        # the Configuration of the questions returned by queries
+        self.configs = Configuration(configs)
+        self.batch_size = batch_size
+        # transactions are managed by hand, see ingest
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        # in WAL mode, NORMAL is still safe from corruption; only the very last
+        # transactions may be lost on a power failure
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+        # copies dropped or linked by the last ingest with dedupe
+        self.duplicates = 0
+
+    def migrate(self) -> None:
+        """Adds the canonical fingerprints to databases made before they were stored.
+        """
+        columns = self.connection.execute("PRAGMA table_info(questions)").fetchall()
+        if "canonical" not in [column[1] for column in columns]:
+            self.connection.execute("ALTER TABLE questions ADD COLUMN canonical TEXT")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS questions_canonical ON questions (canonical)"
+        )
+        query = (
+            f"SELECT {COLUMNS} FROM questions WHERE canonical IS NULL "
+            "ORDER BY id LIMIT ?"
+        )
+        while True:
+            rows = self.connection.execute(query, (self.batch_size,)).fetchall()
+            if not rows:
+                break
+            updates = [
+                (q.canonical_fingerprint(), row[0])
+                for row, q in zip(rows, self.build(rows))
+            ]
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE questions SET canonical = ? WHERE id = ?", updates
+                )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "QuestionStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    # writing ------------------------------------------------------------------------
+    def ingest(
+        self, questions: Iterable[Question], dedupe: Optional[str] = None
+    ) -> Iterator[int]:
+        """Upserts questions (which may be a lazy stream, like Parser.parse) batch_size
+        at a time, one transaction per batch, yielding how many have been stored so far.
+        With dedupe (a Deduplicator mode), copies of questions already stored or
+        ingested are dropped, or stored with the same canonical fingerprint, which links
+        them; see copies.
+        """
+        if dedupe:
+            questions = self.deduplicate(questions, dedupe)
+        batch = []
+        stored = 0
+        for q in questions:
+            batch.append(q)
+            if len(batch) == self.batch_size:
+                stored += self.ingest_batch(batch)
+                batch.clear()
+                yield stored
+        if batch:
+            stored += self.ingest_batch(batch)
+            yield stored
+
+    def deduplicate(
+        self, questions: Iterable[Question], mode: str
+    ) -> Iterator[Question]:
+        """A copy is a question with the canonical fingerprint of another question;
+        one with the same fingerprint is the same question, ingested again, and is let
+        through to be updated. The store is looked up batch_size questions at a time,
+        for their canonical fingerprints only, so it's never read whole.
+        """
+        deduplicator = Deduplicator(mode)
+        self.duplicates = 0
+        for batch in batches(questions, self.batch_size):
+            seen = deduplicator.seen
+            canonicals = {q.canonical_fingerprint() for q in batch}.difference(seen)
+            if canonicals:
+                marks = ", ".join(["?"] * len(canonicals))
+                # newest first, so that the oldest copy of each question is the one kept
+                seen.update(
+                    self.connection.execute(
+                        f"SELECT canonical, fingerprint FROM questions "
+                        f"WHERE canonical IN ({marks}) ORDER BY id DESC",
+                        list(canonicals),
+                    )
+                )
+            for q in batch:
+                first = deduplicator.first_copy(q)
+                if first is None or first == q.fingerprint():
+                    yield q
+                    continue
+                self.duplicates += 1
+                if mode == Deduplicator.LINK:
+                    q.duplicate_of = first
+                    yield q
+
+    def ingest_batch(self, questions: Sequence[Question]) -> int:
+        now = time.time()
+        by_fingerprint = {q.fingerprint(): q for q in questions}
+        rows = [
+            (
+                fingerprint,
+                q.source,
+                q.year,
+                q.question_type,
+                q.answer,
+                json.dumps(q.texts, ensure_ascii=False),
+                json.dumps(q.explanations, ensure_ascii=False),
+                now,
+                q.canonical_fingerprint(),
+            )
+            for fingerprint, q in by_fingerprint.items()
+        ]
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(UPSERT, rows)
+            marks = ", ".join(["?"] * len(by_fingerprint))
+            ids = dict(
+                cursor.execute(
+                    f"SELECT fingerprint, id FROM questions "
+                    f"WHERE fingerprint IN ({marks})",
+                    list(by_fingerprint),
+                )
+            )
+            id_marks = ", ".join(["?"] * len(ids))
+            id_list = list(ids.values())
+            # the children of a question already stored are replaced: its histories and
+            # tags may have changed, and its choices are the same anyway
+            for table in ("choices", "tags", "histories"):
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE question_id IN ({id_marks})", id_list
+                )
+            choices, tags, histories = [], [], []
+            for fingerprint, q in by_fingerprint.items():
+                qid = ids[fingerprint]
+                for position, choice in enumerate(q.choices):
+                    choices.append((qid, position, choice, int(choice == q.answer)))
+                # a question may list a tag twice
+                for tag in dict.fromkeys(q.tags):
+                    tags.append((qid, tag))
+                for position, history in enumerate(q.histories):
+                    histories.append((qid, position, history.strip()))
+            cursor.executemany("INSERT INTO choices VALUES (?, ?, ?, ?)", choices)
+            cursor.executemany("INSERT INTO tags VALUES (?, ?)", tags)
+            cursor.executemany("INSERT INTO histories VALUES (?, ?, ?)", histories)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return len(by_fingerprint)
+
+    def delete(self, fingerprint: str) -> bool:
+        cursor = self.connection.execute(
+            "DELETE FROM questions WHERE fingerprint = ?", (fingerprint,)
+        )
+        return cursor.rowcount > 0
+
+    # reading ------------------------------------------------------------------------
+    @staticmethod
+    def where(
+        source: Optional[str] = None,
+        year: Optional[str] = None,
+        question_type: Optional[str] = None,
+        tag: Optional[str] = None,
+        text: Optional[str] = None,
+    ) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if year is not None:
+            clauses.append("year = ?")
+            params.append(year)
+        if question_type is not None:
+            clauses.append("type = ?")
+            params.append(question_type)
+        if tag is not None:
+            clauses.append("id IN (SELECT question_id FROM tags WHERE tag = ?)")
+            params.append(tag)
+        if text is not None:
+            clauses.append("texts LIKE ?")
+            params.append(f"%{text}%")
+        if not clauses:
+            return "", params
+        return "WHERE " + " AND ".join(clauses), params
+
+    def count(self, **filters: Optional[str]) -> int:
+        where, params = self.where(**filters)
+        query = f"SELECT COUNT(*) FROM questions {where}"
+        return self.connection.execute(query, params).fetchone()[0]
+
+    def query(
+        self, limit: Optional[int] = None, offset: int = 0, **filters: Optional[str]
+    ) -> Iterator[Question]:
+        """Yields the questions that match every filter given (source, year,
+        question_type, tag and text, a substring of the question's text), in the
+        order they were first ingested, without loading them all at once.
+        """
+        where, params = self.where(**filters)
+        query = f"SELECT {COLUMNS} FROM questions {where} ORDER BY id LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        cursor = self.connection.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            yield from self.build(rows)
+
+    def get(self, fingerprint: str) -> Optional[Question]:
+        row = self.connection.execute(
+            f"SELECT {COLUMNS} FROM questions WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self.build([row])[0]
+
+    def fingerprints(self) -> Set[str]:
+        rows = self.connection.execute("SELECT fingerprint FROM questions")
+        return {row[0] for row in rows}
+
+    def copies(self, fingerprint: str) -> List[str]:
+        """The fingerprints of the other copies of a question (see
+        Question.canonical_fingerprint), oldest first.
+        """
+        query = (
+            "SELECT fingerprint FROM questions WHERE canonical = "
+            "(SELECT canonical FROM questions WHERE fingerprint = ?) "
+            "AND fingerprint != ? ORDER BY id"
+        )
+        rows = self.connection.execute(query, (fingerprint, fingerprint))
+        return [row[0] for row in rows]
+
+    def children(self, table: str, column: str, ids: List[int]) -> Dict[int, list]:
+        marks = ", ".join(["?"] * len(ids))
+        found = {}
+        query = (
+            f"SELECT question_id, {column} FROM {table} "
+            f"WHERE question_id IN ({marks}) ORDER BY question_id"
+        )
+        if table != "tags":
+            query += ", position"
+        for qid, value in self.connection.execute(query, ids):
+            found.setdefault(qid, []).append(value)
+        return found
+
+    def build(self, rows: List[tuple]) -> List[Question]:
+        ids = [row[0] for row in rows]
+        choices = self.children("choices", "text", ids)
+        tags = self.children("tags", "tag", ids)
+        histories = self.children("histories", "history", ids)
+        questions = []
+        for qid, source, year, question_type, answer, texts, explanations in rows:
+            choices_list = choices.get(qid, [])
+            questions.append(
+                Question(
+                    source,
+                    year,
+                    question_type,
+                    answer,
+                    histories.get(qid, []),
+                    tags.get(qid, []),
+                    json.loads(texts),
+                    choices_list,
+                    [c for c in choices_list if c != answer],
+                    json.loads(explanations),
+                    configs=self.configs,
+                )
+            )
+        return questions
+
+    def tag_counts(self) -> List[Tuple[str, int]]:
+        query = "SELECT tag, COUNT(*) FROM tags GROUP BY tag ORDER BY COUNT(*) DESC"
+        return self.connection.execute(query).fetchall()
+
+
+def ingest_files(
+    path: str,
+    filenames: Iterable[str],
+    configs: Optional[Configuration] = None,
+    dedupe: Optional[str] = None,
+) -> Iterator[Tuple[int, int]]:
+    """Parses each file and streams its questions into the store at path, yielding how
+    many questions have been stored and how many duplicates were found so far. Without
+    configs, each file is parsed in its own dialect (see dialects.configs_for_file). The
+    store is opened here, so this can run in a BackgroundTask.
+    """
+    stored = duplicates = 0
+    with QuestionStore(path, configs) as store:
+        for filename in filenames:
+            questions = Parser(quiet=True).parse_file(filename, configs)
+            done = 0
+            for done in store.ingest(questions, dedupe):
+                yield stored + done, duplicates + store.duplicates
+            stored += done
+            duplicates += store.duplicates
+        # a file with no questions yields nothing
+        yield stored, duplicates
+
+
+def ingest_questions(
+    path: str, questions: Iterable[Question], dedupe: Optional[str] = None
+) -> Iterator[Tuple[int, int]]:
+    """Like ingest_files, for questions already parsed.
+    """
+    with QuestionStore(path) as store:
+        for stored in store.ingest(questions, dedupe):
+            yield stored, store.duplicates
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    from morla.exporters import EXPORTERS, get_exporter
+
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.store", description="Stores banks in and queries a database."
+    )
+    arg_parser.add_argument("database")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="parse banks and store them")
+    ingest_parser.add_argument("filenames", nargs="+")
+    ingest_parser.add_argument(
+        "--dedupe",
+        choices=Deduplicator.MODES,
+        help="drop copies of questions already stored, or link them",
+    )
+    query_parser = commands.add_parser("query", help="print the matching questions")
+    for name in ("source", "year", "tag", "text"):
+        query_parser.add_argument(f"--{name}")
+    query_parser.add_argument("--type", choices=Question.TYPES)
+    query_parser.add_argument("--limit", type=int)
+    query_parser.add_argument("--offset", type=int, default=0)
+    query_parser.add_argument("--format", choices=sorted(EXPORTERS), default="jsonl")
+    query_parser.add_argument(
+        "--count", action="store_true", help="just print how many questions match"
+    )
+    commands.add_parser("tags", help="print every tag and how often it's used")
+    args = arg_parser.parse_args(argv)
+    if args.command == "ingest":
+        stored = duplicates = 0
+        progress = ingest_files(args.database, args.filenames, dedupe=args.dedupe)
+        for stored, duplicates in progress:
+            pass
+        print(f"> Stored {stored} questions in {args.database}.")
+        if args.dedupe:
+            action = "dropped" if args.dedupe == Deduplicator.DROP else "linked"
+            print(f"> {duplicates} duplicate(s) {action}.")
+        return 0
+    with QuestionStore(args.database) as store:
+        if args.command == "tags":
+            for tag, n in store.tag_counts():
+                print(f"{n:>8} {tag}")
+            return 0
+        filters = dict(
+            source=args.source,
+            year=args.year,
+            question_type=args.type,
+            tag=args.tag,
+            text=args.text,
+        )
+        if args.count:
+            print(store.count(**filters))
+            return 0
+        questions = store.query(args.limit, args.offset, **filters)
+        for chunk in get_exporter(args.format).export(questions):
+            sys.stdout.write(chunk)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Splits a whole bank into tokens with a single compiled regular expression over the
+markers of a Configuration, instead of going line by line; most of the scanning then
+happens inside the re module's C engine. The tokens feed Parser.parse_buffer.
+"""
+
+from typing import AnyStr, Iterator, NamedTuple, Union
+
+# tk provides the re module
+import threading
+
+from tkinter import re, sys
+
+from morla.utils import *
+from morla.configuration import Configuration
+
+
+# token kinds; the markers are named after their Configuration keys
+COMMENT = "COMMENT"
+TEXT = "TEXT"
+MARKERS = (
+    "BEGIN_QUESTION",
+    "END_QUESTION",
+    "BEGIN_CHOICES",
+    "END_CHOICES",
+    "CHOICE",
+    "CORRECT",
+    "BEGIN_ANSWER",
+    "END_ANSWER",
+)
+# the text after these markers, up to the end of their line, is their value
+INLINE = ("CHOICE", "CORRECT")
+
+
+class Token(NamedTuple):
+    kind: str
+    # offsets into the tokenized str (or bytes)
+    start: int
+    end: int
+    # the comment, the options of BEGIN_QUESTION, the choice or the line of text
+    value: Union[str, bytes]
+
+
+class Tokenizer:
+    """Tokenizes banks written with the markers of configs. Several markers may share
+    a line, e.g. "\\end{choices}\\end{Exercise}" or "\\choice a \\choice b".
+    A binary Tokenizer works on UTF-8 bytes (or a mmap of them), so its offsets are
+    byte offsets and its values are bytes.
+    """
+
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, configs: Configuration, binary: bool = False) -> None:
+        self.binary = binary
+        self.newline = b"\n" if binary else "\n"
+        self.empty = self.newline[:0]
+        # longer markers first, so that none is mistaken for a prefix of another
+        markers = sorted(MARKERS, key=lambda kind: len(configs[kind]), reverse=True)
+        # a UTF-8 BOM is only left in the text by the binary Tokenizer
+        alternatives = ["^(?:\ufeff)?" r"[ \t]*%+[ \t]*(?P<comment>[^\n]*)"]
+        for kind in markers:
+            marker = re.escape(configs[kind])
+            if kind == "BEGIN_QUESTION":
+                marker += r"(?P<options>\[[^\]\n]*\])?"
+            alternatives.append(f"(?P<{kind}>{marker})")
+        pattern = "|".join(alternatives)
+        if binary:
+            pattern = pattern.encode(UTF8)
+        self.pattern = re.compile(pattern, re.MULTILINE)
+        self.group_kinds = {
+            index: name
+            for name, index in self.pattern.groupindex.items()
+            if name in MARKERS
+        }
+
+    @classmethod
+    def for_configs(cls, configs: Configuration, binary: bool = False) -> "Tokenizer":
+        """Returns a Tokenizer for configs, compiling its pattern only once.
+        """
+        key = (tuple(sorted(configs.items())), binary)
+        with cls._cache_lock:
+            tokenizer = cls._cache.get(key)
+            if tokenizer is None:
+                tokenizer = cls._cache[key] = cls(configs, binary)
+        return tokenizer
+
+    def texts(self, text: AnyStr, start: int, stop: int) -> Iterator[Token]:
+        """Yields a TEXT token for each non-blank line of text[start:stop].
+        """
+        offset = start
+        for line in text[start:stop].split(self.newline):
+            stripped = line.strip()
+            if stripped:
+                yield Token(TEXT, offset, offset + len(line), stripped)
+            offset += len(line) + 1
+
+    def tokenize(self, text: AnyStr, with_texts: bool = True) -> Iterator[Token]:
+        """Yields the tokens of text; with_texts=False skips the lines of plain text,
+        for when only the markers matter.
+        """
+        position = 0
+        # an inline marker waits for the text after it
+        inline = None
+        for match in self.pattern.finditer(text):
+            start = match.start()
+            if inline is not None:
+                newline = text.find(self.newline, position, start)
+                value_end = start if newline < 0 else newline
+                value = text[position:value_end].strip()
+                yield inline._replace(end=value_end, value=value)
+                inline = None
+                position = value_end
+            if with_texts and start > position:
+                yield from self.texts(text, position, start)
+            position = match.end()
+            comment = match.group("comment")
+            if comment is not None:
+                yield Token(COMMENT, start, position, comment.strip())
+                continue
+            kind = self.group_kinds[match.lastindex]
+            if kind in INLINE:
+                inline = Token(kind, start, position, self.empty)
+            elif kind == "BEGIN_QUESTION":
+                options = match.group("options") or self.empty
+                yield Token(kind, start, position, options)
+            else:
+                yield Token(kind, start, position, self.empty)
+        if inline is not None:
+            newline = text.find(self.newline, position)
+            value_end = len(text) if newline < 0 else newline
+            yield inline._replace(end=value_end, value=text[position:value_end].strip())
+            position = value_end
+        if with_texts and position < len(text):
+            yield from self.texts(text, position, len(text))
+
+
+def line_number(text: str, offset: int) -> int:
+    return text.count("\n", 0, offset) + 1
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Converts legacy (Latin-1, CP1252, UTF-16...) banks to UTF-8, in parallel:
+    python3 -m morla.transcode banks/ --jobs 4
+rewrites every .tex file under banks/ that isn't UTF-8 yet, in place; --output DIR
+writes the converted files to DIR instead.
+"""
+
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.fileio import (
+    CHUNK_SIZE,
+    CP1252,
+    SNIFF_SIZE,
+    FallbackDecoder,
+    read_chunks,
+    sniff_encoding,
+    write_atomically,
+)
+
+
+def count_fallbacks(source: str) -> int:
+    """Decodes the whole of source as UTF-8 and returns how many lines weren't, and
+    had to be decoded as CP1252; the sniffed sample may be UTF-8 (or plain ASCII)
+    while later lines are not.
+    """
+    decoder = FallbackDecoder(UTF8)
+    with open(source, "rb") as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+            decoder.decode(data)
+    decoder.decode(b"", final=True)
+    return decoder.fallbacks
+
+
+def transcode_file(source: str, target: Optional[str] = None) -> Tuple[str, str]:
+    """Converts source to UTF-8, streaming it, and writes it to target (by default,
+    source itself). Files that are UTF-8 from end to end are left alone when source is
+    target. Returns (source, the encoding it was in).
+    """
+    with open(source, "rb") as f:
+        encoding = sniff_encoding(f.read(SNIFF_SIZE))
+    target = target or source
+    # what source is reported to be in
+    label = encoding
+    if encoding == UTF8 and os.path.abspath(target) == os.path.abspath(source):
+        fallbacks = count_fallbacks(source)
+        if not fallbacks:
+            return source, encoding
+        # read_chunks decodes those lines as CP1252 again
+        label = f"{UTF8} and {CP1252} ({fallbacks} line(s))"
+
+    def chunks() -> Iterator[str]:
+        for _, text in read_chunks(source, encoding):
+            yield text
+
+    for _ in write_atomically(target, chunks()):
+        pass
+    return source, label
+
+
+def find_banks(directory: str, extensions: Sequence[str] = (".tex",)) -> Iterator[str]:
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.join(root, filename)
+
+
+def transcode_directory(
+    directory: str,
+    output: Optional[str] = None,
+    extensions: Sequence[str] = (".tex",),
+    jobs: Optional[int] = None,
+) -> Dict[str, str]:
+    """Converts every bank under directory to UTF-8 in a pool of jobs processes, in
+    place or into the same relative paths under output. Returns {path: encoding}.
+    """
+    directory = os.path.abspath(directory)
+    sources = list(find_banks(directory, extensions))
+    targets = []
+    for source in sources:
+        if output:
+            target = os.path.join(output, os.path.relpath(source, directory))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        else:
+            target = source
+        targets.append(target)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return dict(pool.map(transcode_file, sources, targets))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.transcode", description="Converts banks to UTF-8."
+    )
+    arg_parser.add_argument("directory")
+    arg_parser.add_argument("--output", help="write the converted banks here")
+    arg_parser.add_argument("--jobs", type=int, help="number of processes")
+    arg_parser.add_argument(
+        "--extensions", nargs="+", default=[".tex"], help="extensions of the banks"
+    )
+    args = arg_parser.parse_args(argv)
+    extensions = [ext.lower() for ext in args.extensions]
+    encodings = transcode_directory(args.directory, args.output, extensions, args.jobs)
+    for path, encoding in encodings.items():
+        status = "kept" if encoding == UTF8 and not args.output else "converted"
+        print(f"> {path}: {encoding} ({status})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
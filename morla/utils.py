@@ -4,8 +4,10 @@ from typing import (
     Any,
     Callable,
     Dict,
+    FrozenSet,
     Generator,
     Hashable,
+    Iterable,
     List,
     Optional,
     Set,
@@ -47,34 +49,6 @@ PREVIOUS = []
 
 
 # OS functions -------------------------------------------------------------------------
-class Cd:
-    """Context manager for changing the current working directory.
-    https://stackoverflow.com/a/13197763
-    """
-
-    def __init__(self, new_path):
-        self.new_path = os.path.expanduser(new_path)
-
-    def __enter__(self):
-        self.old_path = os.getcwd()
-        try:
-            os.chdir(self.new_path)
-        except OSError:
-            print(f"> moving to {self.new_path} failed!")
-            raise
-        else:
-            print("> moving to", self.new_path)
-
-    def __exit__(self, etype, value, traceback):
-        try:
-            os.chdir(self.old_path)
-        except OSError:
-            print(f"> returning to {self.old_path} failed!")
-            raise
-        else:
-            print("> returning to", self.old_path)
-
-
 def get_extension(filename: str) -> str:
     if not os.path.isfile(filename):
         raise ValueError
@@ -270,62 +244,74 @@ def dict_diff(d1: dict, d2: dict, lazy: Optional[bool] = True) -> Set[Hashable]:
     If not lazy: returns the set of all keys that occur in exactly one of the two
     dictionaries.
     """
-    d1_keys, d2_keys = set(d1.keys()), set(d2.keys())
-    # if not lazy:
-    # XOR: a ^ b returns a new set with elements in either a or b but not both
-    #    return d1_keys ^ d2_keys
-    the_difference = set()
-    pair = (d1_keys, d2_keys)
-    for this, that in (pair, reversed(pair)):
-        for k in this:
-            if k not in that:
-                the_difference.add(k)
-                if lazy:
-                    # a break statement would exit just the inner for-loop
-                    return the_difference
+    # XOR: a ^ b returns a new set with elements in either a or b but not both; on key
+    # views, it runs in C
+    the_difference = d1.keys() ^ d2.keys()
+    if lazy and the_difference:
+        return {next(iter(the_difference))}
     return the_difference
 
 
-def dicts_diffs(L: Sequence[dict], lazy: Optional[bool] = True) -> List[Tuple[dict]]:
-    if len(L) < 2:
-        return []
-    all_differences = []
-    # the last dict doesn't need to be checked, for it will have already been checked
-    # by then
-    for i, d1 in enumerate(L[:-1]):
-        # i + 1 can't raise an IndexError here because i will never be the last index
-        after = L[i + 1 :]
-        for d2 in after:
-            diff = dict_diff(d1, d2)
-            if diff:
-                all_differences.append((d1, d2))
-                if lazy:
-                    # a break statement would exit just the inner for-loop
-                    return all_differences
-    return all_differences
-
-
-def are_subdicts_invalid(D: Dict[Hashable, Dict], lazy: Optional[bool] = True) -> bool:
-    dictionaries = tuple(D.values())
-    return bool(dicts_diffs(dictionaries, lazy=lazy))
-    if False:
-        last = None
-        all_differences = []
-        for key, sub_d in D.items():
-            if last is None:
-                last = sub_d
-                continue
-            diff = dict_diff(last, sub_d)
-            if not diff:
-                continue
-            if lazy:
-                return (key, diff)
-                # diff_str = COMMA.join(sorted(diff))
-                # msg = truncate(f"Key mismatch in {key}: {diff_str}")
-                # raise ValueError(msg)
-            else:
-                all_differences.append()
-        return all_differences
+def key_diff(reference: Iterable[Hashable], D: dict) -> Tuple[Set, Set]:
+    """Returns the keys of reference that D lacks, and the keys of D not in reference.
+    """
+    reference = reference if isinstance(reference, (set, frozenset)) else set(reference)
+    return reference - D.keys(), D.keys() - reference
+
+
+def group_by_keys(D: Dict[Hashable, dict]) -> Dict[FrozenSet, List[Hashable]]:
+    """Groups the names of the subdicts of D by their key set (their signature), in a
+    single pass.
+    """
+    groups = {}
+    for name, sub_d in D.items():
+        groups.setdefault(frozenset(sub_d), []).append(name)
+    return groups
+
+
+def keyset_outliers(
+    D: Dict[Hashable, dict], reference: Optional[Iterable[Hashable]] = None
+) -> Dict[Hashable, Tuple[Set, Set]]:
+    """Finds the subdicts of D whose keys differ from reference (by default, the key
+    set shared by most subdicts) and returns {name: (missing keys, extra keys)} for each
+    of them. The diff is computed once per distinct key set, not once per pair of
+    subdicts, so this is linear in the size of D.
+    """
+    groups = group_by_keys(D)
+    if reference is None:
+        if len(groups) < 2:
+            return {}
+        reference = max(groups, key=lambda signature: len(groups[signature]))
+    else:
+        reference = frozenset(reference)
+    outliers = {}
+    for signature, names in groups.items():
+        if signature == reference:
+            continue
+        missing, extra = reference - signature, signature - reference
+        for name in names:
+            outliers[name] = (missing, extra)
+    return outliers
+
+
+def are_subdicts_invalid(D: Dict[Hashable, Dict]) -> bool:
+    """Whether the subdicts of D don't all have the same keys.
+    """
+    return len(group_by_keys(D)) > 1
+
+
+def describe_outliers(outliers: Dict[Hashable, Tuple[Set, Set]]) -> List[str]:
+    """Turns the output of keyset_outliers into human-readable lines.
+    """
+    lines = []
+    for name, (missing, extra) in outliers.items():
+        problems = []
+        if missing:
+            problems.append("lacks " + COMMA.join(sorted(map(str, missing))))
+        if extra:
+            problems.append("has extra " + COMMA.join(sorted(map(str, extra))))
+        lines.append(f"{name} " + "; ".join(problems))
+    return lines
 
 
 # iterable's functions -----------------------------------------------------------------
@@ -351,7 +337,10 @@ def flat_len(L: Sequence) -> int:
 
 
 def listDiff(m: Sequence, n: Sequence) -> list:
-    return [x for x in m if x not in n]
+    """The items of m that aren't in n, in order; n's items must be hashable.
+    """
+    exclude = set(n)
+    return [x for x in m if x not in exclude]
 
 
 def make_first(obj: Any, L: list) -> list:
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+from typing import Iterable, List, Optional
+
+# sys is already loaded by tkinter; use tk.sys instead
+from array import array
+import os
+import tempfile
+
+from tkinter import font as tkfont
+from tkinter import sys
+import tkinter as tk
+
+from morla.utils import *
+from morla.gui import BORDER, DISABLED, NORMAL
+
+
+class LineStore:
+    """An append-only, disk-backed sequence of lines.
+    The text itself is spooled to an anonymous temporary file; only the byte offset of
+    every STRIDE-th line and the first line of every marked block (a question) are kept
+    in memory, so a page of lines can be fetched with a single seek and read.
+    """
+
+    STRIDE = 64
+
+    def __init__(self) -> None:
+        self.file = tempfile.TemporaryFile(mode="w+b")
+        # offsets[k] is the byte offset of line k * STRIDE
+        self.offsets = array("Q", [0])
+        # anchors[n] is the index of the first line of the n-th marked block
+        self.anchors = array("Q")
+        self._newlines = 0
+        self._size = 0
+        # whether the last line lacks a line break
+        self._open = False
+
+    def append(self, chunk: str) -> None:
+        data = chunk.encode(UTF8)
+        if not data:
+            return
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(data)
+        # record the start of every STRIDE-th line
+        pos = data.find(b"\n")
+        while pos != -1:
+            self._newlines += 1
+            if not self._newlines % self.STRIDE:
+                self.offsets.append(self._size + pos + 1)
+            pos = data.find(b"\n", pos + 1)
+        self._size += len(data)
+        self._open = not data.endswith(b"\n")
+
+    def mark(self) -> int:
+        """Marks the next line to be appended as the start of a new block, and returns
+        the index of that block.
+        """
+        self.anchors.append(self._newlines)
+        return len(self.anchors) - 1
+
+    def line_of(self, block: int) -> int:
+        return self.anchors[block]
+
+    @property
+    def blocks(self) -> int:
+        return len(self.anchors)
+
+    def __len__(self) -> int:
+        """The number of lines, counting a last line with no line break.
+        """
+        return self._newlines + (1 if self._open else 0)
+
+    def get_lines(self, start: int, stop: int) -> List[str]:
+        """Returns lines start up to (but not including) stop, without line breaks.
+        """
+        start = max(0, start)
+        stop = min(len(self), stop)
+        if start >= stop:
+            return []
+        self.file.flush()
+        first_block = start // self.STRIDE
+        last_block = (stop - 1) // self.STRIDE + 1
+        begin = self.offsets[first_block]
+        if last_block < len(self.offsets):
+            end = self.offsets[last_block]
+        else:
+            end = self._size
+        self.file.seek(begin)
+        data = self.file.read(end - begin).decode(UTF8)
+        # str.splitlines would also split on form feeds and other separators
+        lines = data.split("\n")
+        skip = start - first_block * self.STRIDE
+        return [line.rstrip("\r") for line in lines[skip : skip + stop - start]]
+
+    def read_all(self) -> str:
+        self.file.flush()
+        self.file.seek(0)
+        return self.file.read().decode(UTF8)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class VirtualText(tk.Frame):
+    """A read-only text viewer that keeps just the visible lines, plus a margin of
+    <margin> screens above and below them, in its tk.Text. Everything else lives in a
+    LineStore and is fetched as the user scrolls, so memory and redraw time don't depend
+    on the size of the content.
+    """
+
+    def __init__(
+        self,
+        master=None,
+        margin: int = 1,
+        jump_label: Optional[str] = None,
+        **kw,
+    ) -> None:
+        super(VirtualText, self).__init__(master)
+        self.margin = margin
+        self.store = LineStore()
+        # index of the first line held by the tk.Text, and how many it holds
+        self.first = 0
+        self.loaded = 0
+        # index of the first line on screen
+        self.top = 0
+        self.text = tk.Text(self, wrap=tk.NONE, **kw)
+        self.text.config(state=DISABLED, yscrollcommand=self.on_text_scroll)
+        self.text.grid(row=0, column=0, sticky=(tk.N, tk.S, tk.E, tk.W))
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        # jump-to-question bar
+        self.jump_bar = tk.Frame(self)
+        self.jump_bar.grid(row=1, column=0, columnspan=2, sticky=(tk.E,))
+        if jump_label:
+            tk.Label(self.jump_bar, text=jump_label).grid(row=0, column=0)
+        self.jump_var = tk.StringVar(value="1")
+        self.jump_box = tk.Spinbox(
+            self.jump_bar,
+            from_=1,
+            to=1,
+            width=8,
+            textvariable=self.jump_var,
+            command=self.on_jump,
+        )
+        self.jump_box.bind("<Return>", self.on_jump)
+        self.jump_box.grid(row=0, column=1, padx=BORDER)
+        self.total_label = tk.Label(self.jump_bar, text="/ 0")
+        self.total_label.grid(row=0, column=2)
+        self.bind("<Configure>", lambda event: self.render(self.top))
+
+    def visible_lines(self) -> int:
+        linespace = tkfont.Font(font=self.text.cget("font")).metrics("linespace")
+        height = self.text.winfo_height()
+        if height <= 1:
+            # not drawn yet
+            return int(self.text.cget("height"))
+        return max(1, height // linespace)
+
+    def clear(self) -> None:
+        self.store.close()
+        self.store = LineStore()
+        self.first = self.loaded = self.top = 0
+        self.render(0)
+
+    def load(self, chunks: Iterable[str], separator: str = EOL) -> None:
+        """Replaces the content with chunks, each of which is marked as a block that
+        can be jumped to, separated by separator.
+        """
+        self.clear()
+        for i, chunk in enumerate(chunks):
+            if i:
+                self.store.append(separator)
+            self.store.mark()
+            if not chunk.endswith(EOL):
+                chunk += EOL
+            self.store.append(chunk)
+        self.jump_box.config(to=max(1, self.store.blocks))
+        self.total_label.config(text=f"/ {self.store.blocks}")
+        self.render(0)
+
+    def get_content(self) -> str:
+        return self.store.read_all()
+
+    def render(self, top: int) -> None:
+        """Refills the tk.Text with the lines around top and scrolls to it.
+        """
+        total = len(self.store)
+        visible = self.visible_lines()
+        top = max(0, min(top, total - visible))
+        extra = visible * self.margin
+        self.first = max(0, top - extra)
+        stop = min(total, top + visible + extra)
+        lines = self.store.get_lines(self.first, stop)
+        self.loaded = len(lines)
+        self.top = top
+        self.text.config(state=NORMAL)
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, EOL.join(lines))
+        self.text.config(state=DISABLED)
+        self.text.yview(f"{top - self.first + 1}.0")
+        self.update_scrollbar()
+
+    def update_scrollbar(self) -> None:
+        total = len(self.store)
+        if not total:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        visible = self.visible_lines()
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + visible) / total))
+
+    def on_text_scroll(self, lo: str, hi: str) -> None:
+        """The tk.Text's yscrollcommand: it scrolls within its own window (mouse wheel,
+        arrow keys, selections), so the window is refilled once the view nears its
+        edges.
+        """
+        if not self.loaded:
+            self.update_scrollbar()
+            return
+        self.top = self.first + int(float(lo) * self.loaded + 0.5)
+        self.update_scrollbar()
+        total = len(self.store)
+        visible = self.visible_lines()
+        threshold = visible // 2
+        near_top = self.first > 0 and self.top - self.first < threshold
+        end = self.first + self.loaded
+        near_bottom = end < total and end - (self.top + visible) < threshold
+        if near_top or near_bottom:
+            self.after_idle(self.render, self.top)
+
+    def yview(self, *args) -> None:
+        """The scrollbar's command.
+        """
+        total = len(self.store)
+        if not args or not total:
+            return
+        if args[0] == tk.MOVETO:
+            top = int(float(args[1]) * total)
+        elif args[0] == tk.SCROLL:
+            step = self.visible_lines() if args[2] == tk.PAGES else 1
+            top = self.top + int(args[1]) * step
+        else:
+            return
+        self.render(top)
+
+    def jump_to(self, block: int) -> None:
+        """Scrolls to the start of the block-th block (0-indexed).
+        """
+        if not 0 <= block < self.store.blocks:
+            raise IndexError(f"there is no block {block}.")
+        self.render(self.store.line_of(block))
+
+    def on_jump(self, *args) -> None:
+        try:
+            block = int(self.jump_var.get()) - 1
+            self.jump_to(block)
+        except (ValueError, IndexError) as e:
+            print(f"> can't jump: {e}")
+
+    def destroy(self) -> None:
+        self.store.close()
+        super(VirtualText, self).destroy()
+
+
+if __name__ == "__main__":
+    sys.exit("This module should not be run alone.")
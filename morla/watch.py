@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+"""Watches a directory of banks and re-parses only the ones that change, keeping an
+in-memory Bank (and, optionally, a QuestionStore) up to date:
+    python3 -m morla.watch banks/ --database bank.db
+Changes are noticed with inotify on Linux, and by comparing the mtime and size of the
+files every --interval seconds elsewhere (or with --polling). Bursts of events, like the
+several writes of an editor saving a file, are debounced.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# sys is already loaded by tkinter; use tk.sys instead
+from collections import Counter
+import argparse
+import ctypes
+import ctypes.util
+import itertools
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from tkinter import sys
+
+from morla.utils import *
+from morla.bulk import Parser, ParsingException, Question
+from morla.configuration import Configuration
+from morla.store import QuestionStore
+from morla.transcode import find_banks
+
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = (".tex",)
+
+
+# backends -----------------------------------------------------------------------------
+class PollingBackend:
+    """Notices changes by scanning the directory for the mtime and size of each bank.
+    """
+
+    def __init__(self, directory: str, extensions: Sequence[str] = EXTENSIONS) -> None:
+        self.directory = directory
+        self.extensions = extensions
+        self.snapshot = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        found = {}
+        for path in find_banks(self.directory, self.extensions):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found[path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def poll(self, timeout: float) -> Set[str]:
+        """Waits timeout seconds and returns the banks created, modified or deleted
+        since the last call.
+        """
+        time.sleep(timeout)
+        snapshot = self.scan()
+        changed = {
+            path
+            for path in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(path) != self.snapshot.get(path)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyBackend:
+    """Notices changes with Linux's inotify, through libc, so that nothing is scanned.
+    Every subdirectory gets its own watch, including the ones created later.
+    """
+
+    # from <sys/inotify.h>
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    # struct inotify_event: int wd; uint32_t mask, cookie, len; char name[]
+    EVENT = struct.Struct("iIII")
+
+    _libc = None
+
+    @classmethod
+    def libc(cls) -> Optional[ctypes.CDLL]:
+        if cls._libc is None and sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+                libc.inotify_init1
+            except (OSError, AttributeError):
+                return None
+            cls._libc = libc
+        return cls._libc
+
+    @classmethod
+    def available(cls) -> bool:
+        return cls.libc() is not None
+
+    def __init__(self, directory: str, extensions: Sequence[str] = EXTENSIONS) -> None:
+        self.directory = directory
+        self.extensions = extensions
+        self.fd = self.libc().inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor: watched directory
+        self.watches = {}
+        self.add_tree(directory)
+
+    def add_watch(self, path: str) -> None:
+        wd = self.libc().inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            # e.g. the directory was removed meanwhile, or max_user_watches was hit
+            errno = ctypes.get_errno()
+            logger.warning(f"can't watch {path}: {os.strerror(errno)}")
+            return
+        self.watches[wd] = path
+
+    def add_tree(self, directory: str) -> Set[str]:
+        """Watches directory and its subdirectories, and returns the banks in them.
+        """
+        banks = set()
+        for root, _, filenames in os.walk(directory):
+            self.add_watch(root)
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in self.extensions:
+                    banks.add(os.path.join(root, filename))
+        return banks
+
+    def poll(self, timeout: float) -> Set[str]:
+        """Waits up to timeout seconds for events, and returns the banks created,
+        modified or deleted.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost; treat every bank as changed
+                logger.warning("inotify queue overflowed")
+                changed.update(find_banks(self.directory, self.extensions))
+                continue
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.update(self.add_tree(path))
+                elif mask & self.IN_MOVED_FROM:
+                    # its banks are gone from here; the Bank knows which they were
+                    changed.add(path + os.sep)
+            elif os.path.splitext(name)[1].lower() in self.extensions:
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# the bank -----------------------------------------------------------------------------
+class Bank:
+    """The questions of a set of bank files, kept per file and indexed by fingerprint,
+    tag and source. Loading a file again updates the indexes in place, in proportion to
+    the size of that file only. It's safe to read from one thread while another loads.
+    """
+
+    def __init__(self, configs: Optional[Configuration] = None) -> None:
+        self.configs = Configuration(configs)
+        # without configs, each file is parsed in its own dialect
+        self.detect = configs is None
+        self.lock = threading.RLock()
+        # path: {fingerprint: Question}
+        self.files = {}
+        # fingerprint: number of files that have it
+        self.fingerprints = Counter()
+        # tag (or source): Counter of fingerprints
+        self.by_tag = {}
+        self.by_source = {}
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    @staticmethod
+    def count(index: Dict[str, Counter], key: str, fingerprint: str, delta: int):
+        counter = index.setdefault(key, Counter())
+        counter[fingerprint] += delta
+        if counter[fingerprint] <= 0:
+            del counter[fingerprint]
+            if not counter:
+                del index[key]
+
+    def index(self, fingerprint: str, q: Question, delta: int) -> None:
+        self.fingerprints[fingerprint] += delta
+        if self.fingerprints[fingerprint] <= 0:
+            del self.fingerprints[fingerprint]
+        for tag in set(q.tags):
+            self.count(self.by_tag, tag, fingerprint, delta)
+        self.count(self.by_source, q.source, fingerprint, delta)
+
+    def parse(self, path: str) -> Dict[str, Question]:
+        # this runs in a background thread
+        configs = None if self.detect else self.configs
+        questions = Parser(quiet=True).parse_file(path, configs)
+        return {q.fingerprint(): q for q in questions}
+
+    def load(self, path: str) -> Tuple[Set[str], Set[str]]:
+        """(Re)parses path and returns the fingerprints that were added to and removed
+        from the bank. If path can't be parsed (e.g. it's half-written), the questions
+        it had are kept.
+        """
+        try:
+            new = self.parse(path)
+        except (ParsingException, AssertionError, ValueError, IndexError) as e:
+            logger.warning(f"couldn't parse {path}, keeping its old questions: {e!r}")
+            return set(), set()
+        with self.lock:
+            old = self.files.get(path, {})
+            for fingerprint, q in old.items():
+                self.index(fingerprint, q, -1)
+            for fingerprint, q in new.items():
+                self.index(fingerprint, q, +1)
+            self.files[path] = new
+            return self.diff(old, new)
+
+    def remove(self, path: str) -> Tuple[Set[str], Set[str]]:
+        with self.lock:
+            old = self.files.pop(path, {})
+            for fingerprint, q in old.items():
+                self.index(fingerprint, q, -1)
+            return self.diff(old, {})
+
+    def diff(self, old: dict, new: dict) -> Tuple[Set[str], Set[str]]:
+        # a question removed from a file may still be in another one
+        removed = {f for f in old.keys() - new.keys() if f not in self.fingerprints}
+        return new.keys() - old.keys(), removed
+
+    def apply(self, paths: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """Brings the bank up to date with the given paths, which may have been created,
+        modified or deleted. A path ending with os.sep stands for a whole directory
+        that is gone.
+        """
+        added, removed = set(), set()
+        for path in paths:
+            if path.endswith(os.sep):
+                with self.lock:
+                    gone = [p for p in self.files if p.startswith(path)]
+            elif os.path.exists(path):
+                gone = []
+                new, old = self.load(path)
+                added |= new
+                removed |= old
+            else:
+                gone = [path]
+            for p in gone:
+                new, old = self.remove(p)
+                added |= new
+                removed |= old
+        # a question may have moved from a file to another
+        return added - removed, removed - added
+
+    def questions(
+        self, tag: Optional[str] = None, source: Optional[str] = None
+    ) -> List[Question]:
+        """Returns the questions with the given tag and source, one per fingerprint.
+        """
+        with self.lock:
+            wanted = None
+            if tag is not None:
+                wanted = set(self.by_tag.get(tag, ()))
+            if source is not None:
+                from_source = set(self.by_source.get(source, ()))
+                wanted = from_source if wanted is None else wanted & from_source
+            found = {}
+            for questions in self.files.values():
+                for fingerprint, q in questions.items():
+                    if wanted is None or fingerprint in wanted:
+                        found.setdefault(fingerprint, q)
+            return list(found.values())
+
+
+# watching -----------------------------------------------------------------------------
+class Watcher:
+    """Yields the banks under directory that changed, each batch once there have been
+    no more events about them for debounce seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        extensions: Sequence[str] = EXTENSIONS,
+        debounce: float = 0.5,
+        interval: float = 1.0,
+        polling: bool = False,
+    ) -> None:
+        self.directory = os.path.abspath(directory)
+        self.debounce = debounce
+        self.interval = interval
+        if polling or not InotifyBackend.available():
+            self.backend = PollingBackend(self.directory, extensions)
+        else:
+            self.backend = InotifyBackend(self.directory, extensions)
+        logger.info(f"watching {self.directory} with {type(self.backend).__name__}")
+
+    def changes(self, stop: Optional[threading.Event] = None) -> Iterator[Set[str]]:
+        # path: time of its last event
+        pending = {}
+        try:
+            while stop is None or not stop.is_set():
+                if pending:
+                    oldest = min(pending.values())
+                    timeout = max(0.0, oldest + self.debounce - time.monotonic())
+                    timeout = min(timeout, self.interval)
+                else:
+                    timeout = self.interval
+                for path in self.backend.poll(timeout):
+                    pending[path] = time.monotonic()
+                now = time.monotonic()
+                ready = {p for p, t in pending.items() if now - t >= self.debounce}
+                if ready:
+                    for path in ready:
+                        del pending[path]
+                    yield ready
+        finally:
+            self.backend.close()
+
+
+def watch_bank(
+    directory: str,
+    bank: Optional[Bank] = None,
+    database: Optional[str] = None,
+    stop: Optional[threading.Event] = None,
+    **watcher_kwargs,
+) -> Iterator[Tuple[Set[str], Set[str], Set[str]]]:
+    """Loads every bank under directory into bank and keeps it up to date, as well as
+    the QuestionStore at database, if any. Yields (paths, added fingerprints, removed
+    fingerprints) for the initial load and for every batch of changes, until stop is
+    set. The store is opened here, so this can run in a BackgroundTask.
+    The store belongs to the watcher: it mirrors directory, so the questions it holds
+    that aren't in directory (e.g. stored by anything else) are deleted.
+    """
+    bank = bank if bank is not None else Bank()
+    watcher = Watcher(directory, **watcher_kwargs)
+    store = QuestionStore(database, bank.configs) if database else None
+    try:
+        paths = set(find_banks(watcher.directory))
+        for changed in itertools.chain([paths], watcher.changes(stop)):
+            added, removed = bank.apply(changed)
+            if store is not None and changed is paths:
+                # left over from another directory, or from changes made unwatched
+                with bank.lock:
+                    stale = store.fingerprints().difference(bank.fingerprints)
+                for fingerprint in stale:
+                    store.delete(fingerprint)
+            if store is not None:
+                with bank.lock:
+                    questions = [
+                        q
+                        for path in changed
+                        for q in bank.files.get(path, {}).values()
+                    ]
+                for _ in store.ingest(questions):
+                    pass
+                for fingerprint in removed:
+                    store.delete(fingerprint)
+            yield changed, added, removed
+    finally:
+        if store is not None:
+            store.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="morla.watch", description="Re-parses banks as they change."
+    )
+    arg_parser.add_argument("directory")
+    arg_parser.add_argument("--database", help="keep this QuestionStore up to date")
+    arg_parser.add_argument("--debounce", type=float, default=0.5)
+    arg_parser.add_argument("--interval", type=float, default=1.0)
+    arg_parser.add_argument(
+        "--polling", action="store_true", help="scan instead of using inotify"
+    )
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="> %(message)s")
+    bank = Bank()
+    updates = watch_bank(
+        args.directory,
+        bank,
+        args.database,
+        debounce=args.debounce,
+        interval=args.interval,
+        polling=args.polling,
+    )
+    try:
+        for changed, added, removed in updates:
+            names = [os.path.basename(p.rstrip(os.sep)) for p in changed]
+            names = COMMA.join(sorted(names))
+            print(
+                f"> {names}: +{len(added)} -{len(removed)} questions "
+                f"({len(bank)} in {len(bank.files)} files)"
+            )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,7 +24,7 @@ setup(name = SELETOR_NAME,
       author_email = SELETOR_EMAIL,
       license = SELETOR_LICENSE,
       packages = ["morla"],
-      python_requires=">=3.6",
+      python_requires=">=3.7",
       install_requires = [  # in alphabetical order
           # "base64",
           "configparser",
@@ -35,6 +35,7 @@ setup(name = SELETOR_NAME,
           "io",
           "json",
           "logging",
+          "numpy",
           "os",
           "pywin32",
           "setuptools",